@@ -7,6 +7,8 @@ from app.database import Base
 from app.models.categorias import Categoria
 from app.models.productos import Producto
 from app.models.usuarios import Usuario
+from app.models.imagenes import Imagen, TrabajoImagen
+from app.models.carrito import ItemCarrito
 
 # Cargar configuración de Alembic
 config = context.config
@@ -0,0 +1,45 @@
+"""Índices compuestos para los ordenamientos del catálogo
+
+Revision ID: 2eb38e448bfe
+Revises: aea82d9ceca4
+Create Date: 2026-10-18 11:03:27.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2eb38e448bfe'
+down_revision: Union[str, None] = 'aea82d9ceca4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Un índice por cada sortBy de get_productos, con y sin filtro de categoría.
+# Los órdenes descendentes recorren el mismo índice hacia atrás.
+INDICES = [
+    ('ix_productos_categoria_id_id', ['categoria_id', 'id']),
+    ('ix_productos_categoria_precio_id', ['categoria_id', 'precio', 'id']),
+    ('ix_productos_categoria_nombre_id', ['categoria_id', 'nombre', 'id']),
+    ('ix_productos_categoria_created_at_id', ['categoria_id', 'created_at', 'id']),
+    ('ix_productos_precio_id', ['precio', 'id']),
+    ('ix_productos_nombre_id', ['nombre', 'id']),
+    ('ix_productos_created_at_id', ['created_at', 'id']),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción.
+    with op.get_context().autocommit_block():
+        for nombre, columnas in INDICES:
+            op.create_index(
+                nombre, 'productos', columnas, unique=False,
+                postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for nombre, _ in reversed(INDICES):
+            op.drop_index(nombre, table_name='productos', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,26 @@
+"""Variantes de imagen por producto
+
+Revision ID: 7c82d9c14cd2
+Revises: 2eb38e448bfe
+Create Date: 2026-10-18 12:20:05.731946
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '7c82d9c14cd2'
+down_revision: Union[str, None] = '2eb38e448bfe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('productos', sa.Column('image_variants', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('productos', 'image_variants')
@@ -0,0 +1,29 @@
+"""Versiones de favoritos y carrito para concurrencia optimista
+
+Revision ID: a8d3e5f1c7b2
+Revises: f7c4b1d9a2e6
+Create Date: 2026-10-18 20:03:27.116458
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3e5f1c7b2'
+down_revision: Union[str, None] = 'f7c4b1d9a2e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Con un default constante PostgreSQL no reescribe la tabla.
+    op.add_column('usuarios', sa.Column('favoritos_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('usuarios', sa.Column('carrito_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('usuarios', 'carrito_version')
+    op.drop_column('usuarios', 'favoritos_version')
@@ -0,0 +1,60 @@
+"""Búsqueda de productos: tsvector + trigramas
+
+Revision ID: aea82d9ceca4
+Revises: 80f2a1d91787
+Create Date: 2026-10-18 10:12:41.204417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'aea82d9ceca4'
+down_revision: Union[str, None] = '80f2a1d91787'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Configuración en español que además elimina acentos antes del stemming.
+    op.execute("CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = pg_catalog.spanish)")
+    op.execute(
+        "ALTER TEXT SEARCH CONFIGURATION es_unaccent "
+        "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem"
+    )
+    # unaccent() no es IMMUTABLE, así que no puede usarse en un índice de expresión.
+    op.execute(
+        "CREATE FUNCTION f_unaccent(text) RETURNS text AS "
+        "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$ "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+    )
+
+    op.add_column('productos', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('es_unaccent', coalesce(nombre, '')), 'A') || "
+            "setweight(to_tsvector('es_unaccent', coalesce(descripcion, '')), 'B')",
+            persisted=True
+        ),
+        nullable=True
+    ))
+    op.create_index('ix_productos_search_vector', 'productos', ['search_vector'], unique=False, postgresql_using='gin')
+    op.execute(
+        "CREATE INDEX ix_productos_nombre_trgm ON productos "
+        "USING gin (f_unaccent(lower(nombre)) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_productos_nombre_trgm', table_name='productos')
+    op.drop_index('ix_productos_search_vector', table_name='productos')
+    op.drop_column('productos', 'search_vector')
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
+    op.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS es_unaccent")
@@ -0,0 +1,33 @@
+"""Almacén de imágenes por contenido con conteo de referencias
+
+Revision ID: b41e6f0a9d53
+Revises: 7c82d9c14cd2
+Create Date: 2026-10-18 13:02:47.118520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41e6f0a9d53'
+down_revision: Union[str, None] = '7c82d9c14cd2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('imagenes',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('referencias', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('hash'),
+    sa.UniqueConstraint('url')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('imagenes')
@@ -0,0 +1,28 @@
+"""productos.created_at no nulo
+
+Revision ID: c9e2d7a4b6f3
+Revises: a8d3e5f1c7b2
+Create Date: 2026-10-18 21:14:52.604318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e2d7a4b6f3'
+down_revision: Union[str, None] = 'a8d3e5f1c7b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # La paginación por cursor de created_at_desc compara (created_at, id) y saltearía
+    # las filas con NULL. Las que no tienen fecha quedan como las más antiguas.
+    op.execute("UPDATE productos SET created_at = 'epoch' WHERE created_at IS NULL")
+    op.alter_column('productos', 'created_at', nullable=False)
+
+
+def downgrade() -> None:
+    op.alter_column('productos', 'created_at', nullable=True)
@@ -0,0 +1,47 @@
+"""Cola de procesamiento de imágenes
+
+Revision ID: d5a27c9e4f18
+Revises: b41e6f0a9d53
+Create Date: 2026-10-18 13:41:09.552301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a27c9e4f18'
+down_revision: Union[str, None] = 'b41e6f0a9d53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('productos', sa.Column('image_status', sa.String(length=20), server_default='listo', nullable=False))
+    op.create_table('trabajos_imagenes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('producto_id', sa.Integer(), nullable=False),
+    sa.Column('estado', sa.String(length=20), server_default='pendiente', nullable=False),
+    sa.Column('archivo', sa.String(), nullable=False),
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('convertir', sa.Boolean(), server_default='true', nullable=False),
+    sa.Column('url', sa.String(), nullable=True),
+    sa.Column('variantes', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('intentos', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('tomado_en', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['producto_id'], ['productos.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_trabajos_imagenes_producto_id'), 'trabajos_imagenes', ['producto_id'], unique=False)
+    op.create_index('ix_trabajos_imagenes_estado_id', 'trabajos_imagenes', ['estado', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_trabajos_imagenes_estado_id', table_name='trabajos_imagenes')
+    op.drop_index(op.f('ix_trabajos_imagenes_producto_id'), table_name='trabajos_imagenes')
+    op.drop_table('trabajos_imagenes')
+    op.drop_column('productos', 'image_status')
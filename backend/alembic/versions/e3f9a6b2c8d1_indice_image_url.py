@@ -0,0 +1,34 @@
+"""Índice GIN sobre productos.image_url
+
+Revision ID: e3f9a6b2c8d1
+Revises: d5a27c9e4f18
+Create Date: 2026-10-18 16:41:09.382715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3f9a6b2c8d1'
+down_revision: Union[str, None] = 'd5a27c9e4f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Lo usa el reconciliador de huérfanos (image_url ?| :urls) para no recorrer productos por cada lote.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_productos_image_url', 'productos', ['image_url'], unique=False,
+            postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_productos_image_url', table_name='productos',
+            postgresql_concurrently=True, if_exists=True
+        )
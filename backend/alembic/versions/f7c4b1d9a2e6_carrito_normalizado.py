@@ -0,0 +1,80 @@
+"""Carrito normalizado en cart_items
+
+Revision ID: f7c4b1d9a2e6
+Revises: e3f9a6b2c8d1
+Create Date: 2026-10-18 18:12:44.905127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7c4b1d9a2e6'
+down_revision: Union[str, None] = 'e3f9a6b2c8d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('cart_items',
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('producto_id', sa.Integer(), nullable=False),
+    sa.Column('color', sa.String(length=50), server_default='', nullable=False),
+    sa.Column('talla', sa.String(length=20), server_default='', nullable=False),
+    sa.Column('cantidad', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.CheckConstraint('cantidad > 0', name='ck_cart_items_cantidad'),
+    sa.ForeignKeyConstraint(['producto_id'], ['productos.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('usuario_id', 'producto_id', 'color', 'talla')
+    )
+    op.create_index('ix_cart_items_producto_id', 'cart_items', ['producto_id'], unique=False)
+
+    # Una fila por línea del JSONB. Las líneas repetidas se suman, las de productos
+    # eliminados o sin cantidad válida se descartan, y created_at conserva el orden del arreglo.
+    # La cantidad solo se convierte si es un entero de hasta 9 dígitos: un valor viejo como
+    # "2.5", "dos" o un objeto descarta su línea en vez de abortar la migración.
+    op.execute("""
+        INSERT INTO cart_items (usuario_id, producto_id, color, talla, cantidad, created_at)
+        SELECT u.id, p.id,
+               coalesce(left(e->>'color', 50), ''), coalesce(left(e->>'talla', 20), ''),
+               sum(c.cantidad),
+               now() + min(t.orden) * interval '1 microsecond'
+        FROM usuarios u
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(u.carrito) = 'array' THEN u.carrito ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS t(e, orden)
+        CROSS JOIN LATERAL (
+            SELECT CASE
+                WHEN e->'cantidad' IS NULL OR e->'cantidad' = 'null'::jsonb THEN 1
+                WHEN btrim(e->>'cantidad') ~ '^[0-9]{1,9}$' THEN btrim(e->>'cantidad')::int
+            END AS cantidad
+        ) c
+        JOIN productos p ON p.id::text = e->>'producto_id'
+        WHERE jsonb_typeof(e) = 'object' AND c.cantidad > 0
+        GROUP BY 1, 2, 3, 4
+    """)
+    op.drop_column('usuarios', 'carrito')
+
+
+def downgrade() -> None:
+    op.add_column('usuarios', sa.Column('carrito', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.execute("""
+        UPDATE usuarios u SET carrito = c.items
+        FROM (
+            SELECT usuario_id,
+                   jsonb_agg(jsonb_build_object(
+                       'producto_id', producto_id, 'cantidad', cantidad, 'color', color, 'talla', talla
+                   ) ORDER BY created_at, producto_id) AS items
+            FROM cart_items
+            GROUP BY usuario_id
+        ) c
+        WHERE c.usuario_id = u.id
+    """)
+    op.execute("UPDATE usuarios SET carrito = '[]'::jsonb WHERE carrito IS NULL")
+    op.drop_index('ix_cart_items_producto_id', table_name='cart_items')
+    op.drop_table('cart_items')
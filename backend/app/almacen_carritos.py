@@ -0,0 +1,816 @@
+"""
+Almacén de carritos con escritura diferida (write-behind) a PostgreSQL.
+
+Con CART_STORE=postgres cada mutación es una transacción sobre cart_items
+(app.crud.carrito). Con "memoria" o "redis" los carritos activos se guardan
+fuera de PostgreSQL: una mutación solo lee de la base (valida el usuario y los
+productos; el carrito se carga la primera vez) y marca el carrito como
+pendiente. Un volcador en segundo plano escribe los pendientes cada
+CART_FLUSH_INTERVAL_SECONDS, hasta CART_FLUSH_BATCH carritos por transacción,
+así que todas las mutaciones de un carrito entre dos volcados cuestan una sola
+escritura. finalizar_orden, la edición de perfil y la baja de usuarios sacan
+el carrito del almacén en un paso atómico (extraer) con la fila del usuario
+bloqueada, así una mutación concurrente entra en el pedido o queda para el
+próximo, y un volcado atrasado no vuelve a escribir lo ya pedido.
+
+- memoria: diccionario en el proceso. Solo es correcto con un proceso (uvicorn
+  sin --workers): al iniciar toma un advisory lock de PostgreSQL y falla si otro
+  proceso ya lo tiene. Una caída pierde como máximo CART_FLUSH_INTERVAL_SECONDS
+  de cambios; al apagar se vuelca todo.
+- redis: compartido entre procesos, con el protocolo de Redis implementado acá
+  (Redis, Valkey, KeyDB...). Cada mutación es un script Lua atómico. Un proceso
+  reserva los carritos que vuelca, así el mismo carrito nunca se escribe desde
+  dos procesos a la vez; una reserva vencida (proceso caído) vuelve a pendientes.
+
+Los endpoints de usuarios leen cart_items, así que con escritura diferida
+muestran el carrito con hasta un intervalo de atraso; /api/carrito es la fuente al día.
+
+Todos los almacenes devuelven el carrito con su versión (el ETag de /api/carrito)
+y aceptan la versión esperada de If-Match: si no coincide la mutación no se
+aplica y se responde 412. Los almacenes diferidos guardan la versión junto al
+carrito, la avanzan solo cuando una mutación lo cambia y el volcado la escribe
+en usuarios.carrito_version.
+"""
+import asyncio
+import json
+import ssl
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.config import (
+    CART_STORE, CART_FLUSH_INTERVAL_SECONDS, CART_FLUSH_BATCH, CART_STORE_MAX_CARTS, CART_STORE_REDIS_URL,
+    CART_STORE_REDIS_POOL, CART_STORE_TTL_SECONDS, CART_STORE_LEASE_SECONDS, CART_STORE_REDIS_REQUIRE_AOF,
+)
+from app.crud import carrito as crud
+from app.database import async_session, engine
+
+
+class ErrorAlmacenCarritos(Exception):
+    pass
+
+
+# Afectadas que devuelve _mutar cuando la versión esperada no es la actual
+CONFLICTO = -1
+
+
+def _conflicto() -> HTTPException:
+    return HTTPException(status_code=412, detail="El carrito cambió desde la versión indicada (If-Match)")
+
+
+def _op(op: str, producto_id: int, color: str, talla: str, cantidad: Optional[int] = None) -> dict:
+    return {"op": op, "producto_id": producto_id, "color": color, "talla": talla, "cantidad": cantidad}
+
+
+def aplicar_en_lineas(lineas: List[dict], operaciones: List[dict]) -> int:
+    """
+    Aplica en orden operaciones add, set (crea la línea si falta), update (solo
+    líneas existentes) y remove sobre `lineas`. Devuelve las líneas afectadas.
+    Es la misma lógica que el script _MUTAR del almacén Redis.
+    """
+    afectadas = 0
+    for op in operaciones:
+        pos = next(
+            (i for i, linea in enumerate(lineas)
+             if (linea["producto_id"], linea["color"], linea["talla"]) == (op["producto_id"], op["color"], op["talla"])),
+            None
+        )
+        if op["op"] == "remove":
+            if pos is not None:
+                del lineas[pos]
+                afectadas += 1
+        elif pos is not None:
+            lineas[pos]["cantidad"] = lineas[pos]["cantidad"] + op["cantidad"] if op["op"] == "add" else op["cantidad"]
+            afectadas += 1
+        elif op["op"] != "update":
+            lineas.append({k: op[k] for k in ("producto_id", "cantidad", "color", "talla")})
+            afectadas += 1
+    return afectadas
+
+
+class AlmacenCarritos:
+    """
+    Sin escritura diferida: delega en app.crud.carrito y confirma cada mutación.
+    Cada mutación avanza primero carrito_version (condicionada a If-Match), que
+    bloquea la fila del usuario hasta el commit.
+    """
+    nombre = "postgres"
+
+    async def obtener(self, db: AsyncSession, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        return await crud.obtener_carrito_versionado(db, usuario_id)
+
+    async def obtener_detallado(self, db: AsyncSession, usuario_id: int) -> Optional[Tuple[dict, int]]:
+        return await crud.obtener_carrito_detallado(db, usuario_id)
+
+    async def agregar(self, db: AsyncSession, usuario_id: int, producto_id: int, color: str, talla: str,
+                      cantidad: int, version: Optional[int] = None) -> Tuple[List[dict], int]:
+        nueva = await crud.avanzar_version(db, usuario_id, version)
+        carrito = await crud.agregar_item(db, usuario_id, producto_id, color, talla, cantidad)
+        await db.commit()
+        return carrito, nueva
+
+    async def fijar(self, db: AsyncSession, usuario_id: int, producto_id: int, color: str, talla: str,
+                    cantidad: int, version: Optional[int] = None) -> Optional[Tuple[List[dict], int]]:
+        nueva = await crud.avanzar_version(db, usuario_id, version)
+        carrito = await crud.fijar_cantidad(db, usuario_id, producto_id, color, talla, cantidad)
+        if carrito is None:
+            # La línea no estaba: tampoco cambia la versión.
+            await db.rollback()
+            return None
+        await db.commit()
+        return carrito, nueva
+
+    async def eliminar(self, db: AsyncSession, usuario_id: int, producto_id: int, color: str,
+                       talla: str, version: Optional[int] = None) -> Tuple[List[dict], int]:
+        nueva = await crud.avanzar_version(db, usuario_id, version)
+        carrito = await crud.eliminar_item(db, usuario_id, producto_id, color, talla)
+        await db.commit()
+        return carrito, nueva
+
+    async def aplicar_lote(self, db: AsyncSession, usuario_id: int, operaciones: List[dict],
+                           version: Optional[int] = None) -> Tuple[List[dict], int]:
+        nueva = await crud.avanzar_version(db, usuario_id, version)
+        carrito = await crud.aplicar_operaciones(db, usuario_id, operaciones)
+        await db.commit()
+        return carrito, nueva
+
+    async def extraer(self, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        """
+        Quita el carrito del almacén y de los pendientes en un paso y devuelve
+        (líneas, versión), o None si no estaba. Se llama con la fila del usuario
+        bloqueada (crud.bloquear_carrito) antes de reemplazar o vaciar cart_items.
+        """
+        return None
+
+    async def reponer(self, usuario_id: int, extraido: Optional[Tuple[List[dict], int]]) -> None:
+        """Devuelve al almacén un carrito extraído si la transacción que lo usaba falló."""
+
+    async def iniciar(self) -> None:
+        pass
+
+    async def detener(self) -> None:
+        pass
+
+    async def stats(self) -> dict:
+        return {"backend": self.nombre}
+
+
+class _AlmacenDiferido(AlmacenCarritos, ABC):
+    """
+    Lógica común de la escritura diferida. Las subclases guardan los carritos como
+    listas de líneas con su versión y llevan el conjunto de pendientes con la hora
+    (time.time()) del primer cambio sin volcar.
+    """
+
+    def __init__(self, intervalo: float = CART_FLUSH_INTERVAL_SECONDS, lote: int = CART_FLUSH_BATCH):
+        self.intervalo = intervalo
+        self.lote = lote
+        self._tarea: Optional[asyncio.Task] = None
+        self._detener: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+        self.volcados = 0
+        self.lineas_volcadas = 0
+        self.transacciones = 0
+        self.errores = 0
+        self.lag_max = 0.0
+        self.ultimo_volcado: Optional[float] = None
+        self.ultima_duracion = 0.0
+
+    # Primitivas de cada almacén
+
+    @abstractmethod
+    async def _leer(self, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        ...
+
+    @abstractmethod
+    async def _cargar(self, usuario_id: int, lineas: List[dict], version: int) -> None:
+        """Guarda el carrito leído de la base, salvo que otra petición ya lo haya cargado."""
+
+    @abstractmethod
+    async def _mutar(self, usuario_id: int, operaciones: List[dict],
+                     esperada: Optional[int]) -> Optional[Tuple[List[dict], int, int]]:
+        """
+        Si la versión es `esperada` (o no hay), aplica las operaciones y, si cambiaron
+        el carrito, avanza la versión y lo marca pendiente. Devuelve (líneas,
+        afectadas, versión), con afectadas CONFLICTO si la versión no coincidió,
+        o None si el carrito no está cargado.
+        """
+
+    @abstractmethod
+    async def _tomar(self, limite: int) -> Dict[int, tuple]:
+        """Reserva carritos pendientes para volcarlos: {usuario_id: (pendiente desde, líneas, versión)}."""
+
+    @abstractmethod
+    async def _confirmar(self, usuario_ids: List[int]) -> None:
+        ...
+
+    @abstractmethod
+    async def _devolver(self, tomados: Dict[int, tuple]) -> None:
+        ...
+
+    @abstractmethod
+    async def _extraer(self, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        ...
+
+    @abstractmethod
+    async def _reponer(self, usuario_id: int, lineas: List[dict], version: int) -> None:
+        """Guarda el carrito como pendiente, salvo que otra petición ya lo haya cargado."""
+
+    @abstractmethod
+    async def _pendientes(self) -> Tuple[int, Optional[float]]:
+        """Cantidad de carritos pendientes y hora del cambio pendiente más antiguo."""
+
+    # Operaciones
+
+    async def _cargar_desde_db(self, db: AsyncSession, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        # FOR SHARE: espera a que termine un finalizar_orden en curso y lee su resultado.
+        resultado = await crud.obtener_carrito_versionado(db, usuario_id, bloquear=True)
+        if resultado is not None:
+            await self._cargar(usuario_id, *resultado)
+        return resultado
+
+    async def _aplicar(self, db: AsyncSession, usuario_id: int, operaciones: List[dict], version: Optional[int],
+                       lote: bool = False) -> Tuple[List[dict], int, int]:
+        invalidos = await crud.validar_referencias(
+            db, usuario_id, {op["producto_id"] for op in operaciones if op["op"] in ("add", "set")}
+        )
+        if invalidos:
+            if not lote:
+                raise HTTPException(status_code=404, detail="Producto no encontrado")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Los siguientes IDs de productos no existen: {sorted(invalidos)}"
+            )
+        resultado = await self._mutar(usuario_id, operaciones, version)
+        if resultado is None:
+            await self._cargar_desde_db(db, usuario_id)
+            resultado = await self._mutar(usuario_id, operaciones, version)
+        # Solo hubo lecturas: se devuelve la conexión al pool antes de responder.
+        await db.rollback()
+        if resultado[1] == CONFLICTO:
+            raise _conflicto()
+        return resultado
+
+    async def obtener(self, db: AsyncSession, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        resultado = await self._leer(usuario_id)
+        if resultado is None:
+            resultado = await self._cargar_desde_db(db, usuario_id)
+        return resultado
+
+    async def obtener_detallado(self, db: AsyncSession, usuario_id: int) -> Optional[Tuple[dict, int]]:
+        resultado = await self.obtener(db, usuario_id)
+        if resultado is None:
+            return None
+        lineas, version = resultado
+        return await crud.detallar_lineas(db, lineas), version
+
+    async def agregar(self, db, usuario_id, producto_id, color, talla, cantidad, version=None):
+        lineas, _, nueva = await self._aplicar(db, usuario_id, [_op("add", producto_id, color, talla, cantidad)],
+                                               version)
+        return lineas, nueva
+
+    async def fijar(self, db, usuario_id, producto_id, color, talla, cantidad, version=None):
+        lineas, afectadas, nueva = await self._aplicar(
+            db, usuario_id, [_op("update", producto_id, color, talla, cantidad)], version
+        )
+        return (lineas, nueva) if afectadas else None
+
+    async def eliminar(self, db, usuario_id, producto_id, color, talla, version=None):
+        lineas, _, nueva = await self._aplicar(db, usuario_id, [_op("remove", producto_id, color, talla)], version)
+        return lineas, nueva
+
+    async def aplicar_lote(self, db, usuario_id, operaciones, version=None):
+        lineas, _, nueva = await self._aplicar(db, usuario_id, operaciones, version, lote=True)
+        return lineas, nueva
+
+    async def volcar(self) -> int:
+        """Escribe en una transacción hasta `lote` carritos pendientes y devuelve cuántos escribió."""
+        async with self._lock:
+            tomados = await self._tomar(self.lote)
+            if not tomados:
+                return 0
+
+            inicio = time.perf_counter()
+            try:
+                async with async_session() as db:
+                    escribir = {u: (items, v) for u, (_, items, v) in tomados.items() if items is not None}
+                    lineas = await crud.reemplazar_carritos(
+                        db, {u: items for u, (items, _) in escribir.items()},
+                        omitir_inexistentes=True, versiones={u: v for u, (_, v) in escribir.items()}
+                    )
+                    await db.commit()
+            except Exception:
+                self.errores += 1
+                await self._devolver(tomados)
+                raise
+            await self._confirmar(list(tomados))
+
+            ahora = time.time()
+            self.lag_max = max(self.lag_max, max(ahora - tomado[0] for tomado in tomados.values()))
+            self.volcados += len(tomados)
+            self.lineas_volcadas += lineas
+            self.transacciones += 1
+            self.ultimo_volcado = ahora
+            self.ultima_duracion = time.perf_counter() - inicio
+            return len(tomados)
+
+    async def extraer(self, usuario_id: int) -> Optional[Tuple[List[dict], int]]:
+        return await self._extraer(usuario_id)
+
+    async def reponer(self, usuario_id: int, extraido: Optional[Tuple[List[dict], int]]) -> None:
+        if extraido is not None:
+            await self._reponer(usuario_id, *extraido)
+
+    async def _volcar_pendientes(self) -> None:
+        while await self.volcar() >= self.lote:
+            pass
+
+    async def _volcador(self) -> None:
+        while not self._detener.is_set():
+            try:
+                await asyncio.wait_for(self._detener.wait(), timeout=self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._volcar_pendientes()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error al volcar carritos: {e}")
+
+    async def iniciar(self) -> None:
+        self._detener = asyncio.Event()
+        self._tarea = asyncio.create_task(self._volcador())
+
+    async def detener(self) -> None:
+        """Detiene el volcador y vuelca lo pendiente (el _volcador hace la última pasada)."""
+        if self._tarea is None:
+            return
+        self._detener.set()
+        await self._tarea
+        self._tarea = None
+
+    async def stats(self) -> dict:
+        pendientes, mas_antiguo = await self._pendientes()
+        return {
+            "backend": self.nombre,
+            "pendientes": pendientes,
+            # Atraso actual: tiempo desde el cambio pendiente más antiguo
+            "lag_segundos": round(time.time() - mas_antiguo, 3) if mas_antiguo else 0.0,
+            "lag_max_segundos": round(self.lag_max, 3),
+            "carritos_volcados": self.volcados,
+            "lineas_volcadas": self.lineas_volcadas,
+            "transacciones": self.transacciones,
+            "errores": self.errores,
+            "ultimo_volcado": self.ultimo_volcado,
+            "ultima_duracion_segundos": round(self.ultima_duracion, 4),
+            "intervalo_segundos": self.intervalo,
+        }
+
+
+class AlmacenCarritosMemoria(_AlmacenDiferido):
+    nombre = "memoria"
+    # Clave del advisory lock que garantiza un solo proceso con este almacén por base
+    BLOQUEO = 0x63617274
+
+    def __init__(self, max_carritos: int = CART_STORE_MAX_CARTS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_carritos = max_carritos
+        self._carritos: "OrderedDict[int, List[dict]]" = OrderedDict()
+        self._versiones: Dict[int, int] = {}
+        # Orden de inserción = orden del primer cambio pendiente
+        self._sucios: Dict[int, float] = {}
+        self._volcando: set = set()
+        self._conexion: Optional[AsyncConnection] = None
+
+    @staticmethod
+    def _copia(lineas: List[dict]) -> List[dict]:
+        return [dict(linea) for linea in lineas]
+
+    async def _leer(self, usuario_id):
+        lineas = self._carritos.get(usuario_id)
+        if lineas is None:
+            return None
+        self._carritos.move_to_end(usuario_id)
+        return self._copia(lineas), self._versiones[usuario_id]
+
+    async def _cargar(self, usuario_id, lineas, version):
+        if usuario_id not in self._carritos:
+            self._carritos[usuario_id] = self._copia(lineas)
+            self._versiones[usuario_id] = version
+            # El recién cargado no se poda: _aplicar lo muta a continuación.
+            self._podar(excepto=usuario_id)
+
+    async def _mutar(self, usuario_id, operaciones, esperada):
+        lineas = self._carritos.get(usuario_id)
+        if lineas is None:
+            return None
+        self._carritos.move_to_end(usuario_id)
+        if esperada is not None and esperada != self._versiones[usuario_id]:
+            return self._copia(lineas), CONFLICTO, self._versiones[usuario_id]
+        afectadas = aplicar_en_lineas(lineas, operaciones)
+        if afectadas:
+            self._versiones[usuario_id] += 1
+            self._sucios.setdefault(usuario_id, time.time())
+        return self._copia(lineas), afectadas, self._versiones[usuario_id]
+
+    async def _tomar(self, limite):
+        # El lock de volcar ya serializa los volcados de este proceso.
+        tomados = {}
+        for uid in list(self._sucios)[:limite]:
+            tomados[uid] = (self._sucios.pop(uid), self._copia(self._carritos[uid]), self._versiones[uid])
+            self._volcando.add(uid)
+        return tomados
+
+    async def _confirmar(self, usuario_ids):
+        self._volcando.difference_update(usuario_ids)
+        self._podar()
+
+    async def _devolver(self, tomados):
+        for uid, (desde, *_) in tomados.items():
+            self._volcando.discard(uid)
+            if uid in self._carritos:
+                self._sucios[uid] = min(desde, self._sucios.get(uid, desde))
+
+    async def _extraer(self, usuario_id):
+        # Sin await en el medio: ninguna otra corrutina ve el carrito a medio quitar.
+        lineas = self._carritos.pop(usuario_id, None)
+        version = self._versiones.pop(usuario_id, None)
+        self._sucios.pop(usuario_id, None)
+        return None if lineas is None else (lineas, version)
+
+    async def _reponer(self, usuario_id, lineas, version):
+        if usuario_id not in self._carritos:
+            self._carritos[usuario_id] = self._copia(lineas)
+            self._versiones[usuario_id] = version
+            self._sucios.setdefault(usuario_id, time.time())
+
+    async def _pendientes(self):
+        return len(self._sucios), min(self._sucios.values(), default=None)
+
+    def _podar(self, excepto: Optional[int] = None) -> None:
+        """
+        Descarta los carritos limpios menos usados por encima de max_carritos. Si
+        todos los demás están pendientes o volcándose, el almacén queda excedido
+        hasta el próximo volcado.
+        """
+        exceso = len(self._carritos) - self.max_carritos
+        if exceso <= 0:
+            return
+        descartables = [u for u in self._carritos if u not in self._sucios and u not in self._volcando and u != excepto]
+        for uid in descartables[:exceso]:
+            del self._carritos[uid]
+            del self._versiones[uid]
+
+    async def iniciar(self) -> None:
+        # El lock de sesión dura lo que la conexión, que queda abierta hasta detener().
+        conexion = await engine.connect()
+        await conexion.execution_options(isolation_level="AUTOCOMMIT")
+        if not await conexion.scalar(select(func.pg_try_advisory_lock(self.BLOQUEO))):
+            await conexion.close()
+            raise ErrorAlmacenCarritos(
+                "CART_STORE=memoria admite un solo proceso y otro ya lo usa con esta base; "
+                "ejecute uvicorn sin --workers o use CART_STORE=redis"
+            )
+        self._conexion = conexion
+        await super().iniciar()
+
+    async def detener(self) -> None:
+        await super().detener()
+        if self._conexion is not None:
+            await self._conexion.close()
+            self._conexion = None
+
+    async def stats(self):
+        return {**await super().stats(), "carritos": len(self._carritos), "max_carritos": self.max_carritos}
+
+
+class ErrorRedis(ErrorAlmacenCarritos):
+    pass
+
+
+class ClienteRedis:
+    """Cliente mínimo del protocolo de Redis (RESP2) sobre asyncio, con un pool de conexiones."""
+
+    def __init__(self, url: str, conexiones: int):
+        partes = urlparse(url)
+        self.host = partes.hostname or "localhost"
+        self.port = partes.port or 6379
+        self.usuario = unquote(partes.username) if partes.username else None
+        self.password = unquote(partes.password) if partes.password else None
+        self.db = int(partes.path.lstrip("/") or 0)
+        self.ssl = ssl.create_default_context() if partes.scheme == "rediss" else None
+        self.max_conexiones = conexiones
+        self._libres: List[tuple] = []
+        self._abiertas = 0
+        self._disponible: Optional[asyncio.Condition] = None
+
+    @staticmethod
+    def _codificar(args) -> bytes:
+        partes = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            dato = arg if isinstance(arg, bytes) else str(arg).encode()
+            partes.append(b"$%d\r\n%s\r\n" % (len(dato), dato))
+        return b"".join(partes)
+
+    async def _respuesta(self, reader: asyncio.StreamReader):
+        linea = await reader.readline()
+        if not linea:
+            raise ConnectionError("Redis cerró la conexión")
+        tipo, dato = linea[:1], linea[1:-2]
+        if tipo == b"+":
+            return dato.decode()
+        if tipo == b"-":
+            return ErrorRedis(dato.decode())
+        if tipo == b":":
+            return int(dato)
+        if tipo == b"$":
+            largo = int(dato)
+            return None if largo < 0 else (await reader.readexactly(largo + 2))[:-2].decode()
+        if tipo == b"*":
+            largo = int(dato)
+            return None if largo < 0 else [await self._respuesta(reader) for _ in range(largo)]
+        raise ErrorRedis(f"Respuesta de Redis inesperada: {linea!r}")
+
+    async def _enviar(self, conexion: tuple, *args):
+        reader, writer = conexion
+        writer.write(self._codificar(args))
+        await writer.drain()
+        respuesta = await self._respuesta(reader)
+        if isinstance(respuesta, ErrorRedis):
+            raise respuesta
+        return respuesta
+
+    async def _conectar(self) -> tuple:
+        conexion = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        try:
+            if self.password:
+                await self._enviar(conexion, "AUTH", *([self.usuario] if self.usuario else []), self.password)
+            if self.db:
+                await self._enviar(conexion, "SELECT", self.db)
+        except BaseException:
+            conexion[1].close()
+            raise
+        return conexion
+
+    async def ejecutar(self, *args):
+        if self._disponible is None:
+            self._disponible = asyncio.Condition()
+        async with self._disponible:
+            await self._disponible.wait_for(lambda: self._libres or self._abiertas < self.max_conexiones)
+            conexion = self._libres.pop() if self._libres else None
+            if conexion is None:
+                self._abiertas += 1
+        try:
+            if conexion is None:
+                conexion = await self._conectar()
+            respuesta = await self._enviar(conexion, *args)
+        except ErrorRedis:
+            # Error del comando: la conexión sigue sirviendo.
+            if conexion is not None:
+                await self._liberar(conexion)
+                raise
+            async with self._disponible:
+                self._abiertas -= 1
+                self._disponible.notify()
+            raise
+        except BaseException:
+            # Conexión en estado desconocido (caída o cancelación a mitad de respuesta).
+            if conexion is not None:
+                conexion[1].close()
+            async with self._disponible:
+                self._abiertas -= 1
+                self._disponible.notify()
+            raise
+        await self._liberar(conexion)
+        return respuesta
+
+    async def _liberar(self, conexion: tuple) -> None:
+        async with self._disponible:
+            self._libres.append(conexion)
+            self._disponible.notify()
+
+    async def cerrar(self) -> None:
+        for _, writer in self._libres:
+            writer.close()
+        self._abiertas -= len(self._libres)
+        self._libres.clear()
+
+
+# KEYS: carrito, pendientes. ARGV: usuario_id, operaciones (JSON), ahora, TTL, versión esperada ('' sin If-Match).
+# El carrito se guarda como {"v": versión, "lineas": [...]}. Misma lógica que aplicar_en_lineas.
+# cjson codifica la tabla vacía como {}, de ahí que el JSON se arme a mano.
+_MUTAR = """
+local actual = redis.call('GET', KEYS[1])
+if not actual then return false end
+local carrito = cjson.decode(actual)
+local lineas = carrito.lineas
+local json = '[]'
+if ARGV[5] ~= '' and tonumber(ARGV[5]) ~= carrito.v then
+    if #lineas > 0 then json = cjson.encode(lineas) end
+    return {json, -1, carrito.v}
+end
+local afectadas = 0
+for _, op in ipairs(cjson.decode(ARGV[2])) do
+    local pos
+    for i, linea in ipairs(lineas) do
+        if linea.producto_id == op.producto_id and linea.color == op.color and linea.talla == op.talla then
+            pos = i
+            break
+        end
+    end
+    if op.op == 'remove' then
+        if pos then
+            table.remove(lineas, pos)
+            afectadas = afectadas + 1
+        end
+    elseif pos then
+        if op.op == 'add' then
+            lineas[pos].cantidad = lineas[pos].cantidad + op.cantidad
+        else
+            lineas[pos].cantidad = op.cantidad
+        end
+        afectadas = afectadas + 1
+    elseif op.op ~= 'update' then
+        table.insert(lineas, {producto_id = op.producto_id, cantidad = op.cantidad, color = op.color, talla = op.talla})
+        afectadas = afectadas + 1
+    end
+end
+if #lineas > 0 then json = cjson.encode(lineas) end
+if afectadas > 0 then
+    carrito.v = carrito.v + 1
+    redis.call('ZADD', KEYS[2], 'NX', ARGV[3], ARGV[1])
+end
+redis.call('SET', KEYS[1], '{"v":' .. string.format('%d', carrito.v) .. ',"lineas":' .. json .. '}', 'EX', ARGV[4])
+return {json, afectadas, carrito.v}
+"""
+
+# KEYS: pendientes, volcando. ARGV: ahora, segundos de reserva, límite.
+# Las reservas vencidas vuelven a pendientes; se saltean los carritos reservados por otro proceso.
+_TOMAR = """
+for _, uid in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[2], uid)
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], uid)
+end
+local candidatos = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[3]) - 1, 'WITHSCORES')
+local tomados = {}
+for i = 1, #candidatos, 2 do
+    local uid = candidatos[i]
+    if not redis.call('ZSCORE', KEYS[2], uid) then
+        redis.call('ZREM', KEYS[1], uid)
+        redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), uid)
+        table.insert(tomados, uid)
+        table.insert(tomados, candidatos[i + 1])
+    end
+end
+return tomados
+"""
+
+# KEYS: carrito, pendientes. ARGV: usuario_id.
+# Devuelve el carrito y lo borra junto con su marca de pendiente. Una reserva de
+# volcado en curso queda: ese volcado no escribe porque la versión ya no es mayor.
+_EXTRAER = """
+local actual = redis.call('GET', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return actual
+"""
+
+# KEYS: carrito, pendientes. ARGV: usuario_id, carrito (JSON), TTL, ahora.
+_REPONER = """
+if redis.call('SET', KEYS[1], ARGV[2], 'NX', 'EX', ARGV[3]) then
+    redis.call('ZADD', KEYS[2], 'NX', ARGV[4], ARGV[1])
+end
+return 1
+"""
+
+
+class AlmacenCarritosRedis(_AlmacenDiferido):
+    nombre = "redis"
+    PENDIENTES = "carritos:pendientes"
+    VOLCANDO = "carritos:volcando"
+
+    def __init__(self, url: str = CART_STORE_REDIS_URL, conexiones: int = CART_STORE_REDIS_POOL,
+                 ttl: int = CART_STORE_TTL_SECONDS, reserva: int = CART_STORE_LEASE_SECONDS,
+                 requerir_aof: bool = CART_STORE_REDIS_REQUIRE_AOF, **kwargs):
+        super().__init__(**kwargs)
+        self.redis = ClienteRedis(url, conexiones)
+        self.ttl = ttl
+        self.reserva = reserva
+        self.requerir_aof = requerir_aof
+        self._sha: Dict[str, str] = {}
+
+    @staticmethod
+    def _clave(usuario_id: int) -> str:
+        return f"carrito:{usuario_id}"
+
+    @staticmethod
+    def _lineas(texto: str) -> List[dict]:
+        lineas = json.loads(texto)
+        return lineas if isinstance(lineas, list) else []
+
+    @staticmethod
+    def _codificar(lineas: List[dict], version: int) -> str:
+        return json.dumps({"v": version, "lineas": lineas})
+
+    @staticmethod
+    def _decodificar(valor: Optional[str]) -> Optional[Tuple[List[dict], int]]:
+        if valor is None:
+            return None
+        # El script _MUTAR arma "lineas" a mano, así que siempre es una lista.
+        carrito = json.loads(valor)
+        return carrito["lineas"], carrito["v"]
+
+    async def _script(self, script: str, claves: list, args: list):
+        sha = self._sha.get(script)
+        if sha is None:
+            sha = self._sha[script] = await self.redis.ejecutar("SCRIPT", "LOAD", script)
+        try:
+            return await self.redis.ejecutar("EVALSHA", sha, len(claves), *claves, *args)
+        except ErrorRedis as e:
+            # El servidor se reinició o se vació la caché de scripts.
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            return await self.redis.ejecutar("EVAL", script, len(claves), *claves, *args)
+
+    async def _leer(self, usuario_id):
+        return self._decodificar(await self.redis.ejecutar("GET", self._clave(usuario_id)))
+
+    async def _cargar(self, usuario_id, lineas, version):
+        await self.redis.ejecutar("SET", self._clave(usuario_id), self._codificar(lineas, version), "NX", "EX", self.ttl)
+
+    async def _mutar(self, usuario_id, operaciones, esperada):
+        resultado = await self._script(
+            _MUTAR, [self._clave(usuario_id), self.PENDIENTES],
+            [usuario_id, json.dumps(operaciones), repr(time.time()), self.ttl, "" if esperada is None else esperada],
+        )
+        if resultado is None:
+            return None
+        return self._lineas(resultado[0]), resultado[1], resultado[2]
+
+    async def _tomar(self, limite):
+        resultado = await self._script(_TOMAR, [self.PENDIENTES, self.VOLCANDO], [repr(time.time()), self.reserva, limite])
+        reservados = {int(resultado[i]): float(resultado[i + 1]) for i in range(0, len(resultado), 2)}
+        if not reservados:
+            return {}
+        valores = await self.redis.ejecutar("MGET", *(self._clave(uid) for uid in reservados))
+        # Un carrito descartado o vencido queda con líneas None y no se escribe.
+        return {
+            uid: (desde, *(self._decodificar(valor) or (None, None)))
+            for (uid, desde), valor in zip(reservados.items(), valores)
+        }
+
+    async def _confirmar(self, usuario_ids):
+        await self.redis.ejecutar("ZREM", self.VOLCANDO, *usuario_ids)
+
+    async def _devolver(self, tomados):
+        for uid, (desde, *_) in tomados.items():
+            await self.redis.ejecutar("ZREM", self.VOLCANDO, uid)
+            await self.redis.ejecutar("ZADD", self.PENDIENTES, "NX", repr(desde), uid)
+
+    async def _extraer(self, usuario_id):
+        return self._decodificar(await self._script(_EXTRAER, [self._clave(usuario_id), self.PENDIENTES], [usuario_id]))
+
+    async def _reponer(self, usuario_id, lineas, version):
+        await self._script(
+            _REPONER, [self._clave(usuario_id), self.PENDIENTES],
+            [usuario_id, self._codificar(lineas, version), self.ttl, repr(time.time())],
+        )
+
+    async def _pendientes(self):
+        cantidad = await self.redis.ejecutar("ZCARD", self.PENDIENTES)
+        primero = await self.redis.ejecutar("ZRANGE", self.PENDIENTES, 0, 0, "WITHSCORES")
+        return cantidad, float(primero[1]) if primero else None
+
+    async def iniciar(self) -> None:
+        if self.requerir_aof:
+            info = await self.redis.ejecutar("INFO", "persistence")
+            if "aof_enabled:1" not in info:
+                raise ErrorAlmacenCarritos(
+                    "El servidor Redis de carritos no tiene appendonly activado; un reinicio perdería "
+                    "los carritos no volcados (configure appendonly yes o CART_STORE_REDIS_REQUIRE_AOF=false)"
+                )
+        await super().iniciar()
+
+    async def detener(self) -> None:
+        await super().detener()
+        await self.redis.cerrar()
+
+
+def crear_almacen_carritos(backend: str = CART_STORE) -> AlmacenCarritos:
+    if backend == "postgres":
+        return AlmacenCarritos()
+    if backend == "memoria":
+        return AlmacenCarritosMemoria()
+    if backend == "redis":
+        return AlmacenCarritosRedis()
+    raise ValueError(f"CART_STORE desconocido: {backend}")
+
+
+carritos = crear_almacen_carritos()
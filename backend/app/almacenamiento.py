@@ -0,0 +1,648 @@
+"""
+Almacenamiento de los archivos de uploads (imágenes de productos, blobs y spool).
+
+Cada archivo se identifica con una clave relativa (p. ej. "blobs/ab/<hash>.webp")
+y su URL pública es siempre "/uploads/<clave>", sea cual sea el backend, así que
+las URLs guardadas en la base no cambian al pasar de uno a otro:
+
+- local: la carpeta STORAGE_LOCAL_DIR, servida por UploadsStaticFiles. Solo sirve
+  a un nodo, o a varios que compartan la carpeta por red.
+- s3: un bucket de un servicio compatible con S3 (AWS, MinIO, R2...). /uploads
+  redirige a una URL firmada del bucket, o a STORAGE_S3_PUBLIC_URL si el bucket
+  es público. Las peticiones se firman con SigV4 sobre aiohttp, que ya es una
+  dependencia, sin agregar un SDK.
+
+La codificación de imágenes sigue trabajando sobre archivos locales
+(uploads/blobs/tmp), que se publican en el almacenamiento al terminar.
+"""
+import asyncio
+import datetime
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import quote
+
+import aiohttp
+from yarl import URL
+
+from app.config import (
+    STORAGE_BACKEND, STORAGE_LOCAL_DIR, STORAGE_S3_ENDPOINT, STORAGE_S3_BUCKET, STORAGE_S3_REGION,
+    STORAGE_S3_ACCESS_KEY, STORAGE_S3_SECRET_KEY, STORAGE_S3_PUBLIC_URL, STORAGE_PRESIGN_SECONDS,
+    STORAGE_MULTIPART_PART_SIZE, STORAGE_MULTIPART_CONCURRENCY, UPLOAD_CHUNK_SIZE,
+)
+from app.helpers import normalize_url
+
+URL_PREFIX = "/uploads/"
+
+
+class ErrorAlmacenamiento(Exception):
+    """El backend respondió con un error distinto de "no existe"."""
+
+
+@dataclass
+class Objeto:
+    clave: str
+    tamano: int
+    # Cambia si cambia el contenido: mtime_ns en local, ETag en S3.
+    version: str
+    modificado: float
+    # Metadatos guardados con put_file (solo S3; listar no los trae).
+    metadatos: Dict[str, str] = field(default_factory=dict)
+
+
+def recorrer(raiz: Path, desde: Tuple[str, ...] = (), excluir: Tuple[Path, ...] = ()) -> Iterator[Tuple[str, ...]]:
+    """
+    Rutas de archivo bajo raiz (como tuplas de componentes) en orden lexicográfico,
+    a partir de la siguiente a `desde`. Solo se lista un directorio a la vez, y se
+    saltan enteros los subárboles anteriores a `desde`.
+    """
+    def _recorrer(directorio: Path, prefijo: Tuple[str, ...], desde: Tuple[str, ...]):
+        try:
+            entradas = sorted(os.scandir(directorio), key=lambda e: e.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entrada in entradas:
+            ruta = prefijo + (entrada.name,)
+            tope = desde[:len(ruta)]
+            if desde and ruta < tope:
+                continue
+            if entrada.is_dir(follow_symlinks=False):
+                if Path(entrada.path) in excluir:
+                    continue
+                yield from _recorrer(Path(entrada.path), ruta, desde if ruta == tope else ())
+            elif entrada.is_file(follow_symlinks=False):
+                if ruta == desde:
+                    continue
+                yield ruta
+
+    yield from _recorrer(raiz, (), tuple(desde))
+
+
+class Almacenamiento(ABC):
+    """Operaciones comunes a los backends; las claves usan "/" como separador."""
+
+    local = False
+
+    def url(self, clave: str) -> str:
+        return URL_PREFIX + clave
+
+    def clave_de_url(self, url: str) -> Optional[str]:
+        """Clave de una URL de uploads (absoluta o relativa); None si no apunta a uploads."""
+        path = normalize_url(url)
+        if not path.startswith(URL_PREFIX):
+            return None
+        clave = path[len(URL_PREFIX):]
+        if not clave or any(parte in ("", ".", "..") for parte in clave.split("/")):
+            return None
+        return clave
+
+    async def url_publica(self, clave: str) -> str:
+        """URL a la que se redirige /uploads/<clave> cuando el backend no la sirve directamente."""
+        return self.url(clave)
+
+    @abstractmethod
+    async def put(self, clave: str, datos: Union[bytes, AsyncIterable[bytes]],
+                  content_type: Optional[str] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def put_file(self, clave: str, path: Path, content_type: Optional[str] = None,
+                       mover: bool = False, metadatos: Optional[Dict[str, str]] = None) -> None:
+        """
+        Sube un archivo local. Con mover=True el archivo deja de existir en path.
+        Los metadatos se devuelven en stat; el backend local no los guarda.
+        """
+
+    @abstractmethod
+    def get(self, clave: str) -> AsyncIterator[bytes]:
+        """Contenido en bloques de UPLOAD_CHUNK_SIZE. Lanza FileNotFoundError si no existe."""
+
+    @abstractmethod
+    async def stat(self, clave: str) -> Optional[Objeto]:
+        ...
+
+    @abstractmethod
+    async def delete(self, clave: str) -> None:
+        """Elimina la clave; no falla si no existe."""
+
+    @abstractmethod
+    def listar(self, prefijo: str, desde: Optional[str] = None) -> AsyncIterator[Objeto]:
+        """Objetos cuya clave empieza con prefijo, en orden y a partir del siguiente a `desde`."""
+
+    @abstractmethod
+    async def mover(self, origen: str, destino: str) -> None:
+        ...
+
+    @abstractmethod
+    async def tocar(self, clave: str) -> None:
+        """Renueva la fecha de modificación (la usa el período de gracia de la limpieza de huérfanos)."""
+
+    async def eliminar_prefijo(self, prefijo: str) -> int:
+        eliminados = 0
+        async for objeto in self.listar(prefijo):
+            await self.delete(objeto.clave)
+            eliminados += 1
+        return eliminados
+
+    async def descargar(self, clave: str, destino: Path) -> None:
+        with open(destino, "wb") as archivo:
+            async for chunk in self.get(clave):
+                await asyncio.to_thread(archivo.write, chunk)
+
+    @asynccontextmanager
+    async def archivo_local(self, clave: str, directorio: Optional[Path] = None):
+        """
+        Ruta local con el contenido de la clave, para Pillow y el pool de procesos.
+        En S3 se descarga a un temporal en `directorio` que se borra al salir.
+        """
+        fd, nombre = tempfile.mkstemp(dir=directorio, suffix=Path(clave).suffix)
+        os.close(fd)
+        path = Path(nombre)
+        try:
+            await self.descargar(clave, path)
+            yield path
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def cerrar(self) -> None:
+        pass
+
+
+class AlmacenamientoLocal(Almacenamiento):
+    local = True
+
+    def __init__(self, raiz: Union[str, Path]):
+        self.raiz = Path(raiz)
+        self.raiz.mkdir(parents=True, exist_ok=True)
+
+    def ruta(self, clave: str) -> Path:
+        return self.raiz / clave
+
+    def _temporal(self, destino: Path) -> Path:
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        return destino.with_name(f".{destino.name}.{uuid.uuid4().hex}.tmp")
+
+    async def put(self, clave, datos, content_type=None):
+        destino = self.ruta(clave)
+        tmp = self._temporal(destino)
+        try:
+            with open(tmp, "wb") as archivo:
+                if isinstance(datos, bytes):
+                    await asyncio.to_thread(archivo.write, datos)
+                else:
+                    async for chunk in datos:
+                        await asyncio.to_thread(archivo.write, chunk)
+            os.replace(tmp, destino)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    async def put_file(self, clave, path, content_type=None, mover=False, metadatos=None):
+        destino = self.ruta(clave)
+        tmp = self._temporal(destino)
+        try:
+            if mover:
+                try:
+                    os.replace(path, destino)
+                    return
+                except OSError:
+                    # Otro sistema de archivos: se copia y se borra el original.
+                    await asyncio.to_thread(shutil.copyfile, path, tmp)
+                    os.replace(tmp, destino)
+                    Path(path).unlink(missing_ok=True)
+                    return
+            await asyncio.to_thread(shutil.copyfile, path, tmp)
+            os.replace(tmp, destino)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    async def get(self, clave):
+        with open(self.ruta(clave), "rb") as archivo:
+            while chunk := await asyncio.to_thread(archivo.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    async def stat(self, clave):
+        try:
+            st = self.ruta(clave).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return Objeto(clave, st.st_size, str(st.st_mtime_ns), st.st_mtime)
+
+    async def delete(self, clave):
+        self.ruta(clave).unlink(missing_ok=True)
+
+    async def listar(self, prefijo, desde=None):
+        # El prefijo puede terminar a mitad de un nombre ("blobs/ab/<hash>"): se recorre
+        # su directorio y se filtra por nombre.
+        directorio, _, _ = prefijo.rpartition("/")
+        base = self.raiz / directorio if directorio else self.raiz
+        inicio = ()
+        if desde:
+            relativa = desde[len(directorio) + 1:] if directorio else desde
+            inicio = tuple(relativa.split("/"))
+        rutas = recorrer(base, inicio)
+        while True:
+            lote = await asyncio.to_thread(lambda: list(islice(rutas, 1000)))
+            if not lote:
+                return
+            for partes in lote:
+                clave = "/".join((directorio, *partes)) if directorio else "/".join(partes)
+                if not clave.startswith(prefijo):
+                    continue
+                objeto = await self.stat(clave)
+                if objeto is not None:
+                    yield objeto
+
+    async def mover(self, origen, destino):
+        path = self.ruta(destino)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.move, str(self.ruta(origen)), str(path))
+
+    async def tocar(self, clave):
+        try:
+            os.utime(self.ruta(clave))
+        except FileNotFoundError:
+            pass
+
+    async def eliminar_prefijo(self, prefijo):
+        # Una carpeta completa ("CarpetasDeProductos/<carpeta>/") se borra de una vez.
+        carpeta = self.ruta(prefijo)
+        if prefijo.endswith("/") and carpeta.is_dir():
+            archivos = sum(len(nombres) for _, _, nombres in os.walk(carpeta))
+            await asyncio.to_thread(shutil.rmtree, carpeta)
+            return archivos
+        return await super().eliminar_prefijo(prefijo)
+
+    @asynccontextmanager
+    async def archivo_local(self, clave, directorio=None):
+        path = self.ruta(clave)
+        if not path.is_file():
+            raise FileNotFoundError(clave)
+        yield path
+
+
+S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+S3_META = "x-amz-meta-"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+def _q(valor: str, safe: str = "-_.~") -> str:
+    return quote(valor, safe=safe)
+
+
+class AlmacenamientoS3(Almacenamiento):
+    """
+    Bucket S3 con direccionamiento por ruta (endpoint/bucket/clave), que es lo que
+    aceptan MinIO y los demás servicios compatibles.
+    Los archivos de más de STORAGE_MULTIPART_PART_SIZE se suben por partes, hasta
+    STORAGE_MULTIPART_CONCURRENCY partes a la vez.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, region: str, access_key: str, secret_key: str,
+                 public_url: Optional[str] = None, part_size: int = STORAGE_MULTIPART_PART_SIZE,
+                 concurrencia: int = STORAGE_MULTIPART_CONCURRENCY):
+        if not access_key or not secret_key:
+            raise ValueError("STORAGE_S3_ACCESS_KEY y STORAGE_S3_SECRET_KEY son obligatorias con STORAGE_BACKEND=s3")
+        self.endpoint = URL(endpoint)
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_url = public_url.rstrip("/") + "/" if public_url else None
+        # S3 exige al menos 5 MiB por parte, salvo la última.
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.concurrencia = concurrencia
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    # --- Firma SigV4 ---
+
+    def _host(self) -> str:
+        if self.endpoint.is_default_port():
+            return self.endpoint.raw_host
+        return f"{self.endpoint.raw_host}:{self.endpoint.port}"
+
+    def _path(self, clave: str = "") -> str:
+        return f"/{self.bucket}/{_q(clave, '/-_.~')}" if clave else f"/{self.bucket}"
+
+    def _firma(self, metodo: str, path: str, query: dict, headers: dict, fecha: datetime.datetime,
+               payload: str) -> Tuple[str, str, str]:
+        """Devuelve (credential scope, signed headers, signature)."""
+        dia = fecha.strftime("%Y%m%d")
+        scope = f"{dia}/{self.region}/s3/aws4_request"
+        canonical_query = "&".join(f"{_q(k)}={_q(str(v))}" for k, v in sorted(query.items()))
+        nombres = sorted(h.lower() for h in headers)
+        normalizados = {k.lower(): " ".join(str(v).split()) for k, v in headers.items()}
+        canonical_headers = "".join(f"{n}:{normalizados[n]}\n" for n in nombres)
+        signed_headers = ";".join(nombres)
+        canonical_request = "\n".join([metodo, path, canonical_query, canonical_headers, signed_headers, payload])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", fecha.strftime("%Y%m%dT%H%M%SZ"), scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        clave = ("AWS4" + self.secret_key).encode()
+        for parte in (dia, self.region, "s3", "aws4_request"):
+            clave = hmac.new(clave, parte.encode(), hashlib.sha256).digest()
+        firma = hmac.new(clave, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return scope, signed_headers, firma
+
+    def _url(self, path: str, query: dict) -> URL:
+        texto = f"{self.endpoint.scheme}://{self._host()}{path}"
+        if query:
+            texto += "?" + "&".join(f"{_q(k)}={_q(str(v))}" for k, v in sorted(query.items()))
+        return URL(texto, encoded=True)
+
+    async def _session_http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=60))
+        return self._session
+
+    def _headers_firmados(self, metodo: str, path: str, query: dict, headers: dict) -> dict:
+        headers = dict(headers)
+        fecha = datetime.datetime.now(datetime.timezone.utc)
+        headers.update({
+            "host": self._host(),
+            "x-amz-date": fecha.strftime("%Y%m%dT%H%M%SZ"),
+            "x-amz-content-sha256": UNSIGNED_PAYLOAD,
+        })
+        scope, signed_headers, firma = self._firma(metodo, path, query, headers, fecha, UNSIGNED_PAYLOAD)
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={firma}"
+        )
+        # aiohttp agrega Host a partir de la URL, con el mismo valor que se firmó.
+        del headers["host"]
+        return headers
+
+    async def _request(self, metodo: str, clave: str = "", query: Optional[dict] = None,
+                       headers: Optional[dict] = None, data=None,
+                       esperado=(200,)) -> Tuple[int, Mapping[str, str], bytes]:
+        query = query or {}
+        path = self._path(clave)
+        session = await self._session_http()
+        async with session.request(
+            metodo, self._url(path, query), headers=self._headers_firmados(metodo, path, query, headers or {}),
+            data=data
+        ) as resp:
+            cuerpo = await resp.read()
+            if resp.status == 404:
+                raise FileNotFoundError(clave)
+            if resp.status not in esperado:
+                raise ErrorAlmacenamiento(f"{metodo} {clave}: {resp.status} {cuerpo[:300].decode(errors='replace')}")
+            # resp.headers (CIMultiDict) y no un dict: los nombres de las cabeceras no
+            # distinguen mayúsculas y algunos servicios compatibles las envían en minúsculas.
+            return resp.status, resp.headers, cuerpo
+
+    def url_firmada(self, clave: str, expira: int = STORAGE_PRESIGN_SECONDS) -> str:
+        """
+        URL GET firmada. La fecha de firma se redondea a ventanas de `expira` segundos
+        y la firma vale dos ventanas: todas las solicitudes y todos los nodos generan
+        la misma URL durante la ventana, así el navegador reutiliza su caché.
+        """
+        ahora = int(time.time())
+        fecha = datetime.datetime.fromtimestamp(ahora - ahora % expira, datetime.timezone.utc)
+        dia = fecha.strftime("%Y%m%d")
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{dia}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": fecha.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(min(2 * expira, 7 * 24 * 3600)),
+            "X-Amz-SignedHeaders": "host",
+        }
+        path = self._path(clave)
+        _, _, firma = self._firma("GET", path, query, {"host": self._host()}, fecha, UNSIGNED_PAYLOAD)
+        query["X-Amz-Signature"] = firma
+        return str(self._url(path, query))
+
+    async def url_publica(self, clave):
+        if self.public_url:
+            return self.public_url + _q(clave, "/-_.~")
+        return self.url_firmada(clave)
+
+    # --- Objetos ---
+
+    @staticmethod
+    def _content_type(clave: str, content_type: Optional[str]) -> dict:
+        return {"content-type": content_type or mimetypes.guess_type(clave)[0] or "application/octet-stream"}
+
+    @staticmethod
+    def _metadatos(metadatos: Mapping[str, str]) -> dict:
+        return {f"{S3_META}{k}": str(v) for k, v in metadatos.items()}
+
+    async def put(self, clave, datos, content_type=None):
+        headers = self._content_type(clave, content_type)
+        if isinstance(datos, bytes):
+            await self._request("PUT", clave, headers=headers, data=datos)
+            return
+        # S3 no acepta cuerpos sin Content-Length: se acumulan bloques hasta una parte y,
+        # si el contenido no cabe en una, se sube por partes a medida que se llenan.
+        buffer = bytearray()
+        multipart = None
+        try:
+            async for chunk in datos:
+                buffer += chunk
+                while len(buffer) >= self.part_size:
+                    if multipart is None:
+                        multipart = _SubidaPorPartes(self, clave, headers)
+                        await multipart.iniciar()
+                    await multipart.agregar(bytes(buffer[:self.part_size]))
+                    del buffer[:self.part_size]
+            if multipart is not None and buffer:
+                await multipart.agregar(bytes(buffer))
+        except BaseException:
+            if multipart is not None:
+                await multipart.abortar()
+            raise
+        if multipart is None:
+            await self._request("PUT", clave, headers=headers, data=bytes(buffer))
+            return
+        await multipart.completar()
+
+    async def put_file(self, clave, path, content_type=None, mover=False, metadatos=None):
+        headers = {**self._content_type(clave, content_type), **self._metadatos(metadatos or {})}
+        tamano = os.path.getsize(path)
+        if tamano <= self.part_size:
+            await self._request("PUT", clave, headers=headers, data=await asyncio.to_thread(Path(path).read_bytes))
+        else:
+            multipart = _SubidaPorPartes(self, clave, headers)
+            await multipart.iniciar()
+
+            def leer(inicio: int) -> bytes:
+                with open(path, "rb") as archivo:
+                    archivo.seek(inicio)
+                    return archivo.read(self.part_size)
+
+            try:
+                for inicio in range(0, tamano, self.part_size):
+                    await multipart.agregar(await asyncio.to_thread(leer, inicio))
+            except BaseException:
+                await multipart.abortar()
+                raise
+            await multipart.completar()
+        if mover:
+            Path(path).unlink(missing_ok=True)
+
+    async def get(self, clave):
+        path = self._path(clave)
+        session = await self._session_http()
+        async with session.get(self._url(path, {}), headers=self._headers_firmados("GET", path, {}, {})) as resp:
+            if resp.status == 404:
+                raise FileNotFoundError(clave)
+            if resp.status != 200:
+                raise ErrorAlmacenamiento(f"GET {clave}: {resp.status}")
+            async for chunk in resp.content.iter_chunked(UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    async def stat(self, clave):
+        try:
+            _, headers, _ = await self._request("HEAD", clave)
+        except FileNotFoundError:
+            return None
+        modificado = parsedate_to_datetime(headers["Last-Modified"]).timestamp() if "Last-Modified" in headers else 0.0
+        metadatos = {k.lower()[len(S3_META):]: v for k, v in headers.items() if k.lower().startswith(S3_META)}
+        return Objeto(clave, int(headers.get("Content-Length", 0)), headers.get("ETag", "").strip('"'), modificado,
+                      metadatos)
+
+    async def delete(self, clave):
+        try:
+            await self._request("DELETE", clave, esperado=(200, 204))
+        except FileNotFoundError:
+            pass
+
+    async def listar(self, prefijo, desde=None):
+        query = {"list-type": "2", "prefix": prefijo, "max-keys": "1000"}
+        if desde:
+            query["start-after"] = desde
+        while True:
+            _, _, cuerpo = await self._request("GET", query=query)
+            raiz = ET.fromstring(cuerpo)
+            for contenido in raiz.iter(f"{S3_NS}Contents"):
+                yield Objeto(
+                    contenido.findtext(f"{S3_NS}Key"),
+                    int(contenido.findtext(f"{S3_NS}Size") or 0),
+                    (contenido.findtext(f"{S3_NS}ETag") or "").strip('"'),
+                    datetime.datetime.fromisoformat(
+                        contenido.findtext(f"{S3_NS}LastModified").replace("Z", "+00:00")
+                    ).timestamp(),
+                )
+            token = raiz.findtext(f"{S3_NS}NextContinuationToken")
+            if raiz.findtext(f"{S3_NS}IsTruncated") != "true" or not token:
+                return
+            query = {**query, "continuation-token": token}
+            query.pop("start-after", None)
+
+    async def _copiar(self, origen: str, destino: str, headers: Optional[dict] = None) -> None:
+        headers = {"x-amz-copy-source": _q(f"/{self.bucket}/{origen}", "/-_.~"), **(headers or {})}
+        await self._request("PUT", destino, headers=headers)
+
+    async def mover(self, origen, destino):
+        await self._copiar(origen, destino)
+        await self.delete(origen)
+
+    async def tocar(self, clave):
+        # Una copia sobre sí misma con REPLACE es la forma de renovar LastModified en S3;
+        # REPLACE descarta los metadatos, así que se vuelven a enviar.
+        objeto = await self.stat(clave)
+        if objeto is None:
+            return
+        try:
+            await self._copiar(clave, clave, {
+                "x-amz-metadata-directive": "REPLACE", **self._content_type(clave, None),
+                **self._metadatos(objeto.metadatos),
+            })
+        except FileNotFoundError:
+            pass
+
+    async def cerrar(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class _SubidaPorPartes:
+    """Multipart upload con hasta `concurrencia` partes subiéndose a la vez."""
+
+    def __init__(self, s3: AlmacenamientoS3, clave: str, headers: dict):
+        self.s3 = s3
+        self.clave = clave
+        self.headers = headers
+        self.upload_id: Optional[str] = None
+        self.etags: dict = {}
+        self.tareas: List[asyncio.Task] = []
+        self.cupos = asyncio.Semaphore(s3.concurrencia)
+
+    async def iniciar(self) -> None:
+        _, _, cuerpo = await self.s3._request("POST", self.clave, query={"uploads": ""}, headers=self.headers)
+        self.upload_id = ET.fromstring(cuerpo).findtext(f"{S3_NS}UploadId")
+
+    async def _subir(self, numero: int, datos: bytes) -> None:
+        try:
+            _, headers, _ = await self.s3._request(
+                "PUT", self.clave, query={"partNumber": numero, "uploadId": self.upload_id}, data=datos
+            )
+            self.etags[numero] = headers["ETag"]
+        finally:
+            self.cupos.release()
+
+    async def agregar(self, datos: bytes) -> None:
+        # Espera un cupo antes de aceptar otra parte, así la memoria en vuelo queda
+        # acotada a concurrencia x part_size.
+        await self.cupos.acquire()
+        fallidas = [t for t in self.tareas if t.done() and t.exception()]
+        if fallidas:
+            self.cupos.release()
+            raise fallidas[0].exception()
+        self.tareas.append(asyncio.create_task(self._subir(len(self.tareas) + 1, datos)))
+
+    async def completar(self) -> None:
+        try:
+            await asyncio.gather(*self.tareas)
+        except BaseException:
+            await self.abortar()
+            raise
+        partes = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>"
+            for n, etag in sorted(self.etags.items())
+        )
+        cuerpo = f"<CompleteMultipartUpload>{partes}</CompleteMultipartUpload>".encode()
+        _, _, respuesta = await self.s3._request(
+            "POST", self.clave, query={"uploadId": self.upload_id}, data=cuerpo
+        )
+        # S3 puede responder 200 con un error en el cuerpo si la unión de partes falla.
+        if b"<Error>" in respuesta:
+            await self.abortar()
+            raise ErrorAlmacenamiento(f"Multipart {self.clave}: {respuesta[:300].decode(errors='replace')}")
+
+    async def abortar(self) -> None:
+        for tarea in self.tareas:
+            tarea.cancel()
+        await asyncio.gather(*self.tareas, return_exceptions=True)
+        try:
+            await self.s3._request("DELETE", self.clave, query={"uploadId": self.upload_id}, esperado=(200, 204))
+        except Exception as e:
+            print(f"Error al abortar la subida por partes de {self.clave}: {e}")
+
+
+def crear_almacenamiento(backend: str = STORAGE_BACKEND) -> Almacenamiento:
+    if backend == "local":
+        return AlmacenamientoLocal(STORAGE_LOCAL_DIR)
+    if backend == "s3":
+        return AlmacenamientoS3(
+            STORAGE_S3_ENDPOINT, STORAGE_S3_BUCKET, STORAGE_S3_REGION,
+            STORAGE_S3_ACCESS_KEY, STORAGE_S3_SECRET_KEY, STORAGE_S3_PUBLIC_URL,
+        )
+    raise ValueError(f"STORAGE_BACKEND desconocido: {backend} (opciones: local, s3)")
+
+
+almacen = crear_almacenamiento()
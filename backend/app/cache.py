@@ -0,0 +1,193 @@
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Optional
+
+from app.config import (
+    CATALOG_CACHE_MAX_BYTES, CATALOG_CACHE_TTL, IMAGE_RESIZE_CACHE_DIR, IMAGE_RESIZE_CACHE_MAX_BYTES,
+    UPLOADS_HOT_CACHE_MAX_BYTES,
+)
+
+
+class QueryCache:
+    """
+    Caché LRU con expiración (TTL) para respuestas ya serializadas.
+    El tamaño se limita por la suma de bytes de los valores almacenados.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple[float, bytes]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expira, valor = entry
+        if expira < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return valor
+
+    def set(self, key: Hashable, valor: bytes) -> None:
+        if len(valor) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, valor)
+        self.size_bytes += len(valor)
+        while self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        _, valor = self._entries.pop(key)
+        self.size_bytes -= len(valor)
+
+
+class DiskLRUCache:
+    """
+    Caché LRU de archivos en un directorio, limitada por la suma de sus tamaños.
+    El orden de uso se guarda en memoria y en el mtime de cada archivo, de modo
+    que al reiniciar se reconstruye desde el disco.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # Claves usadas cuyo mtime falta renovar (ver pendientes).
+        self._por_tocar: set = set()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        archivos = sorted(
+            (f for f in self.directory.iterdir() if f.is_file() and not f.name.endswith(".tmp")),
+            key=lambda f: f.stat().st_mtime
+        )
+        for archivo in archivos:
+            self._entries[archivo.name] = archivo.stat().st_size
+            self.size_bytes += self._entries[archivo.name]
+        self._evict()
+
+    def path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.path(key)
+        if key not in self._entries or not path.exists():
+            # Otro proceso pudo haberlo desalojado.
+            if key in self._entries:
+                self._remove(key, unlink=False)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._por_tocar.add(key)
+        self.hits += 1
+        return path
+
+    def pendientes(self) -> set:
+        """
+        Devuelve y olvida las claves usadas desde la llamada anterior. El mtime solo
+        sirve para reconstruir el orden al reiniciar, así que se renueva en lote con
+        tocar, desde un hilo, y no en cada acierto dentro del event loop.
+        """
+        claves, self._por_tocar = self._por_tocar, set()
+        return claves
+
+    def tocar(self, claves) -> None:
+        for key in claves:
+            try:
+                os.utime(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def add(self, key: str) -> None:
+        """Registra un archivo ya escrito en path(key)."""
+        if key in self._entries:
+            self._remove(key, unlink=False)
+        self._entries[key] = self.path(key).stat().st_size
+        self.size_bytes += self._entries[key]
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self) -> None:
+        while self.size_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, unlink=True)
+            self.evictions += 1
+
+    def _remove(self, key: str, unlink: bool) -> None:
+        self.size_bytes -= self._entries.pop(key)
+        if unlink:
+            self.path(key).unlink(missing_ok=True)
+
+
+# Versión del catálogo: forma parte de cada clave. Al incrementarla se vacía la
+# caché, y una respuesta calculada antes del cambio que se guarde después queda
+# bajo la versión vieja, inalcanzable.
+_catalog_version = 0
+
+
+def get_catalog_version() -> int:
+    return _catalog_version
+
+
+def bump_catalog_version() -> int:
+    global _catalog_version
+    _catalog_version += 1
+    productos_cache.clear()
+    return _catalog_version
+
+
+productos_cache = QueryCache(CATALOG_CACHE_MAX_BYTES, CATALOG_CACHE_TTL)
+# Miniaturas más pedidas de /uploads; la clave incluye mtime y tamaño, así que el TTL solo acota la memoria ociosa.
+uploads_hot_cache = QueryCache(UPLOADS_HOT_CACHE_MAX_BYTES, ttl=3600)
+
+# Se crea con el primer uso: construirla recorre el directorio de la caché, y importar
+# este módulo (scripts, migraciones, workers) no debería tocar el disco.
+_imagenes_cache: Optional[DiskLRUCache] = None
+
+
+def get_imagenes_cache() -> DiskLRUCache:
+    global _imagenes_cache
+    if _imagenes_cache is None:
+        _imagenes_cache = DiskLRUCache(IMAGE_RESIZE_CACHE_DIR, IMAGE_RESIZE_CACHE_MAX_BYTES)
+    return _imagenes_cache
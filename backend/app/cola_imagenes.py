@@ -0,0 +1,275 @@
+"""
+Cola de procesamiento de imágenes de productos sobre la tabla trabajos_imagenes.
+
+Las rutas guardan las imágenes subidas en spool/ del almacenamiento (compartido
+entre nodos, así cualquier worker puede tomarlas) y registran un trabajo
+por imagen en la misma transacción que el producto, que queda con
+image_status = "procesando". Los workers (tareas asyncio arrancadas en el
+lifespan) toman trabajos con FOR UPDATE SKIP LOCKED, los codifican en el pool
+de procesos y, cuando termina el último trabajo de un producto, agregan las
+imágenes a image_url en orden de subida.
+
+Como los trabajos y los archivos están en la base y en el almacenamiento, sobreviven a un
+reinicio: un trabajo tomado por un proceso que murió se vuelve a tomar pasados
+IMAGE_QUEUE_STALE_SECONDS.
+"""
+import asyncio
+import uuid
+from datetime import timedelta
+from typing import List, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import and_, delete, or_, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.cache import bump_catalog_version
+from app.config import (
+    IMAGE_QUEUE_WORKERS, IMAGE_QUEUE_POLL_SECONDS, IMAGE_QUEUE_STALE_SECONDS, IMAGE_QUEUE_MAX_ATTEMPTS,
+)
+from app.almacenamiento import almacen
+from app.crud.imagenes import ajustar_referencias
+from app.database import async_session
+from app.helpers import parse_image_urls
+from app.imagenes import (
+    BASE_UPLOAD_DIR, BLOBS_TMP_DIR, SPOOL_PREFIX, ImagenRechazada, guardar_upload, store_blob, validar_tamanos,
+)
+from app.models.imagenes import TrabajoImagen
+from app.models.productos import Producto
+
+ACTIVOS = ("pendiente", "procesando")
+
+# Se crean en iniciar_workers, dentro del event loop del servidor.
+_hay_trabajo: Optional[asyncio.Event] = None
+_detener: Optional[asyncio.Event] = None
+_workers: List[asyncio.Task] = []
+
+
+async def recibir_imagenes(uploads: List[UploadFile]) -> List[dict]:
+    """
+    Guarda las imágenes subidas en el spool (en bloques, con fsync) y devuelve los
+    datos de sus trabajos. Si alguna supera los límites se descartan todas.
+    """
+    validar_tamanos(uploads)
+    recibidas = []
+    try:
+        for upload in uploads:
+            nombre = f"{uuid.uuid4().hex}.subida"
+            tmp_path = BLOBS_TMP_DIR / nombre
+            try:
+                _, digest = await guardar_upload(upload, tmp_path, fsync=True)
+                await almacen.put_file(SPOOL_PREFIX + nombre, tmp_path, mover=True)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            recibidas.append({
+                "archivo": SPOOL_PREFIX + nombre,
+                "hash": digest,
+                "convertir": upload.content_type != "image/webp",
+            })
+    except Exception:
+        await descartar_imagenes(recibidas)
+        raise
+    return recibidas
+
+
+def _clave_spool(archivo: str) -> str:
+    # Los trabajos encolados antes del almacenamiento guardaban la ruta local (uploads/spool/...).
+    return archivo.removeprefix(f"{BASE_UPLOAD_DIR.as_posix()}/")
+
+
+async def descartar_imagenes(recibidas: List[dict]) -> None:
+    for recibida in recibidas:
+        await almacen.delete(_clave_spool(recibida["archivo"]))
+
+
+async def encolar_imagenes(db: AsyncSession, db_producto: Producto, recibidas: List[dict]) -> None:
+    """Registra los trabajos de un producto ya agregado a la sesión. No hace commit."""
+    if not recibidas:
+        return
+    if db_producto.id is None:
+        await db.flush()
+    db.add_all([TrabajoImagen(producto_id=db_producto.id, **recibida) for recibida in recibidas])
+    db_producto.image_status = "procesando"
+
+
+def notificar_cola() -> None:
+    """Despierta a los workers de este proceso; los de otros procesos lo notan al sondear."""
+    if _hay_trabajo is not None:
+        _hay_trabajo.set()
+
+
+async def _tomar_trabajo(db: AsyncSession) -> Optional[TrabajoImagen]:
+    abandonado = func.now() - timedelta(seconds=IMAGE_QUEUE_STALE_SECONDS)
+    siguiente = (
+        select(TrabajoImagen.id)
+        .where(or_(
+            TrabajoImagen.estado == "pendiente",
+            and_(TrabajoImagen.estado == "procesando", TrabajoImagen.tomado_en < abandonado),
+        ))
+        .order_by(TrabajoImagen.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(TrabajoImagen)
+        .where(TrabajoImagen.id == siguiente)
+        .values(estado="procesando", tomado_en=func.now(), intentos=TrabajoImagen.intentos + 1)
+        .returning(TrabajoImagen)
+        .execution_options(synchronize_session=False)
+    )
+    trabajo = result.scalars().first()
+    await db.commit()
+    return trabajo
+
+
+async def _finalizar_producto(db: AsyncSession, producto_id: int) -> bool:
+    """
+    Si el producto ya no tiene trabajos activos, le agrega las imágenes listas y
+    fija image_status. El producto se bloquea para no pisar una edición en curso.
+    Devuelve True si modificó el producto.
+    """
+    result = await db.execute(
+        select(Producto).where(Producto.id == producto_id).with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    db_producto = result.scalars().first()
+    if not db_producto:
+        return False
+
+    result = await db.execute(
+        select(TrabajoImagen).where(TrabajoImagen.producto_id == producto_id).order_by(TrabajoImagen.id)
+        .execution_options(populate_existing=True)
+    )
+    trabajos = result.scalars().all()
+    if any(t.estado in ACTIVOS for t in trabajos):
+        return False
+
+    listos = [t for t in trabajos if t.estado == "listo"]
+    urls = parse_image_urls(db_producto.image_url) + [t.url for t in listos]
+    variantes = dict(db_producto.image_variants or {})
+    for trabajo in listos:
+        variantes[trabajo.url] = trabajo.variantes
+    await ajustar_referencias(db, [], [t.url for t in listos])
+
+    db_producto.image_url = urls or None
+    db_producto.image_variants = variantes or None
+    db_producto.image_status = "error" if any(t.estado == "error" for t in trabajos) else "listo"
+    # Los trabajos con error se conservan para que el panel de administración los muestre.
+    if listos:
+        await db.execute(delete(TrabajoImagen).where(TrabajoImagen.id.in_([t.id for t in listos])))
+    return True
+
+
+async def _marcar(db: AsyncSession, trabajo: TrabajoImagen, **valores) -> bool:
+    # Primero el producto y después el trabajo, el mismo orden en que los bloquean
+    # update_producto y delete_producto.
+    await db.execute(select(Producto.id).where(Producto.id == trabajo.producto_id).with_for_update())
+    await db.execute(
+        update(TrabajoImagen).where(TrabajoImagen.id == trabajo.id).values(**valores)
+        .execution_options(synchronize_session=False)
+    )
+    modificado = await _finalizar_producto(db, trabajo.producto_id)
+    await db.commit()
+    if modificado:
+        bump_catalog_version()
+    return modificado
+
+
+async def procesar_siguiente() -> bool:
+    """Procesa un trabajo de la cola. Devuelve False si no había ninguno disponible."""
+    async with async_session() as db:
+        trabajo = await _tomar_trabajo(db)
+        if trabajo is None:
+            return False
+
+        clave = _clave_spool(trabajo.archivo)
+        if trabajo.intentos > IMAGE_QUEUE_MAX_ATTEMPTS:
+            await _marcar(db, trabajo, estado="error", error="Se agotaron los intentos")
+            await almacen.delete(clave)
+            return True
+
+        try:
+            async with almacen.archivo_local(clave, BLOBS_TMP_DIR) as archivo:
+                url, variantes = await store_blob(archivo, trabajo.hash, trabajo.convertir)
+        except (ImagenRechazada, FileNotFoundError) as e:
+            await _marcar(db, trabajo, estado="error", error=str(e))
+            await almacen.delete(clave)
+            return True
+        except Exception as e:
+            # Error transitorio: vuelve a la cola hasta agotar los intentos.
+            print(f"Error al procesar el trabajo de imagen {trabajo.id}: {e}")
+            estado = "pendiente" if trabajo.intentos < IMAGE_QUEUE_MAX_ATTEMPTS else "error"
+            await _marcar(db, trabajo, estado=estado, error=str(e))
+            return True
+
+        await _marcar(db, trabajo, estado="listo", url=url, variantes=variantes, error=None)
+        # El archivo recibido se borra solo cuando el resultado ya está en la base.
+        await almacen.delete(clave)
+        return True
+
+
+async def _worker() -> None:
+    while not _detener.is_set():
+        try:
+            if await procesar_siguiente():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en el worker de imágenes: {e}")
+        try:
+            await asyncio.wait_for(_hay_trabajo.wait(), timeout=IMAGE_QUEUE_POLL_SECONDS)
+            _hay_trabajo.clear()
+        except asyncio.TimeoutError:
+            pass
+
+
+def iniciar_workers(cantidad: int = IMAGE_QUEUE_WORKERS) -> None:
+    global _hay_trabajo, _detener
+    _hay_trabajo = asyncio.Event()
+    _detener = asyncio.Event()
+    for _ in range(cantidad):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def detener_workers(timeout: float = 30) -> None:
+    """
+    Deja que cada worker termine el trabajo en curso; los que no alcanzan se
+    cancelan y su trabajo lo retoma otro proceso o el próximo arranque.
+    """
+    if not _workers:
+        return
+    _detener.set()
+    _hay_trabajo.set()
+    _, pendientes = await asyncio.wait(_workers, timeout=timeout)
+    for tarea in pendientes:
+        tarea.cancel()
+    _workers.clear()
+
+
+async def estado_imagenes(db: AsyncSession, producto_id: int) -> Optional[dict]:
+    result = await db.execute(select(Producto).where(Producto.id == producto_id))
+    db_producto = result.scalars().first()
+    if not db_producto:
+        return None
+    result = await db.execute(
+        select(TrabajoImagen).where(TrabajoImagen.producto_id == producto_id).order_by(TrabajoImagen.id)
+    )
+    return {
+        "producto_id": db_producto.id,
+        "image_status": db_producto.image_status,
+        "image_url": parse_image_urls(db_producto.image_url),
+        "trabajos": result.scalars().all(),
+    }
+
+
+async def resumen_cola(db: AsyncSession) -> dict:
+    result = await db.execute(
+        select(TrabajoImagen.estado, func.count(), func.min(TrabajoImagen.created_at))
+        .group_by(TrabajoImagen.estado)
+    )
+    return {
+        estado: {"total": total, "mas_antiguo": mas_antiguo}
+        for estado, total, mas_antiguo in result.all()
+    }
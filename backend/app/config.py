@@ -18,4 +18,133 @@ NGROK_TOKEN = os.getenv("NGROK_TOKEN")
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
 MERCADOPAGO_ACCESS_TOKEN = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
-MERCADOPAGO_NOTIFICATION_URL = os.getenv("MERCADOPAGO_NOTIFICATION_URL")
\ No newline at end of file
+MERCADOPAGO_NOTIFICATION_URL = os.getenv("MERCADOPAGO_NOTIFICATION_URL")
+
+# Caché en memoria del listado de productos
+CATALOG_CACHE_MAX_BYTES = int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+
+# Límites inferiores de los rangos de precio usados en las facetas del catálogo
+PRICE_FACET_EDGES = [float(v) for v in os.getenv("PRICE_FACET_EDGES", "0,10000,25000,50000,100000").split(",")]
+
+# Segundos tras los que otro proceso recarga el snapshot de categorías
+CATEGORIAS_SNAPSHOT_TTL = float(os.getenv("CATEGORIAS_SNAPSHOT_TTL", "300"))
+
+# Máximo de IDs aceptados por GET /api/productos/batch
+PRODUCTOS_BATCH_MAX = int(os.getenv("PRODUCTOS_BATCH_MAX", "100"))
+
+# Filas por lote leídas del cursor de servidor en GET /api/productos/export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Importación masiva de productos
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# Procesos del pool que codifica imágenes fuera del event loop. IMPORT_IMAGE_WORKERS
+# (el nombre anterior, de cuando solo la importación procesaba en paralelo) se sigue aceptando.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS") or os.getenv("IMPORT_IMAGE_WORKERS") or str(min(4, os.cpu_count() or 1)))
+
+# Anchos (px) de las variantes reducidas que se generan al subir cada imagen
+IMAGE_VARIANT_WIDTHS = [int(v) for v in os.getenv("IMAGE_VARIANT_WIDTHS", "200,400,800").split(",") if v.strip()]
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+
+# Perfiles de codificación WebP de las imágenes subidas:
+# - quality: 0-100 (en lossless, el esfuerzo de compresión)
+# - method: 0-6, más alto comprime mejor y tarda más
+# - max_dimension: lado mayor en px al que se reduce la imagen (0 = sin límite)
+# - lossless_alpha: PNG con transparencia se guarda sin pérdida
+# - auto_orient: aplica la orientación EXIF a los píxeles
+# - strip_exif: no copia los metadatos EXIF (GPS, cámara) al WebP
+# "original" reproduce la codificación anterior (quality=100, sin límite de tamaño).
+IMAGE_PROFILES = {
+    "original": {"quality": 100, "method": 4, "max_dimension": 0,
+                 "lossless_alpha": False, "auto_orient": False, "strip_exif": True},
+    "calidad": {"quality": 90, "method": 6, "max_dimension": 2400,
+                "lossless_alpha": True, "auto_orient": True, "strip_exif": True},
+    "equilibrado": {"quality": 82, "method": 4, "max_dimension": 2000,
+                    "lossless_alpha": True, "auto_orient": True, "strip_exif": True},
+    "rapido": {"quality": 75, "method": 2, "max_dimension": 1600,
+               "lossless_alpha": False, "auto_orient": True, "strip_exif": True},
+}
+IMAGE_PROFILE = os.getenv("IMAGE_PROFILE", "equilibrado")
+if IMAGE_PROFILE not in IMAGE_PROFILES:
+    raise ValueError(f"IMAGE_PROFILE desconocido: {IMAGE_PROFILE} (opciones: {', '.join(IMAGE_PROFILES)})")
+
+# Subida de imágenes: tamaño de bloque al escribir a disco y límites por archivo y por solicitud
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+
+# Máximo de píxeles (ancho x alto) que Pillow acepta decodificar
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+# Redimensionado bajo demanda (GET /api/img/...): caché en disco limitada por bytes
+IMAGE_RESIZE_CACHE_DIR = os.getenv("IMAGE_RESIZE_CACHE_DIR", "cache/img")
+IMAGE_RESIZE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_RESIZE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_RESIZE_MAX_WIDTH = int(os.getenv("IMAGE_RESIZE_MAX_WIDTH", "2400"))
+
+# Archivos de /uploads: max-age de los inmutables y caché en memoria de miniaturas
+UPLOADS_MAX_AGE = int(os.getenv("UPLOADS_MAX_AGE", str(365 * 24 * 3600)))
+UPLOADS_HOT_CACHE_MAX_BYTES = int(os.getenv("UPLOADS_HOT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+UPLOADS_HOT_CACHE_MAX_FILE_BYTES = int(os.getenv("UPLOADS_HOT_CACHE_MAX_FILE_BYTES", str(64 * 1024)))
+
+# Cola de procesamiento de imágenes: workers por proceso, espera entre sondeos,
+# segundos tras los que un trabajo tomado se da por abandonado y máximo de intentos
+IMAGE_QUEUE_WORKERS = int(os.getenv("IMAGE_QUEUE_WORKERS", str(IMAGE_WORKERS)))
+IMAGE_QUEUE_POLL_SECONDS = float(os.getenv("IMAGE_QUEUE_POLL_SECONDS", "2"))
+IMAGE_QUEUE_STALE_SECONDS = int(os.getenv("IMAGE_QUEUE_STALE_SECONDS", "120"))
+IMAGE_QUEUE_MAX_ATTEMPTS = int(os.getenv("IMAGE_QUEUE_MAX_ATTEMPTS", "3"))
+
+# Limpieza de imágenes huérfanas (scripts/reconciliar_imagenes.py): horas de gracia
+# desde la última modificación, prefijo de cuarentena en el almacenamiento (no se sirve) y archivos por lote
+ORPHAN_GRACE_HOURS = float(os.getenv("ORPHAN_GRACE_HOURS", "24"))
+ORPHAN_QUARANTINE_PREFIX = os.getenv("ORPHAN_QUARANTINE_PREFIX", "cuarentena").strip("/")
+ORPHAN_BATCH_SIZE = int(os.getenv("ORPHAN_BATCH_SIZE", "1000"))
+
+# Segundos desde la última publicación o reutilización de un blob durante los que
+# liberar_blobs no lo borra: cubre el tiempo entre store_blob y el commit que lo
+# referencia. Los que se saltan quedan para la limpieza de huérfanos
+BLOB_DELETE_GRACE_SECONDS = int(os.getenv("BLOB_DELETE_GRACE_SECONDS", "3600"))
+
+# Almacenamiento de uploads (ver app/almacenamiento.py): "local" (carpeta STORAGE_LOCAL_DIR)
+# o "s3" (AWS S3, MinIO u otro compatible). Con s3, /uploads redirige a URLs firmadas
+# válidas por STORAGE_PRESIGN_SECONDS, o a STORAGE_S3_PUBLIC_URL si el bucket es público
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "uploads")
+STORAGE_S3_ENDPOINT = os.getenv("STORAGE_S3_ENDPOINT", "http://localhost:9000")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "miuvuu")
+STORAGE_S3_REGION = os.getenv("STORAGE_S3_REGION", "us-east-1")
+STORAGE_S3_ACCESS_KEY = os.getenv("STORAGE_S3_ACCESS_KEY")
+STORAGE_S3_SECRET_KEY = os.getenv("STORAGE_S3_SECRET_KEY")
+STORAGE_S3_PUBLIC_URL = os.getenv("STORAGE_S3_PUBLIC_URL")
+STORAGE_PRESIGN_SECONDS = int(os.getenv("STORAGE_PRESIGN_SECONDS", "3600"))
+# Subidas por partes: tamaño de cada parte (mínimo 5 MiB) y partes en vuelo por archivo
+STORAGE_MULTIPART_PART_SIZE = int(os.getenv("STORAGE_MULTIPART_PART_SIZE", str(8 * 1024 * 1024)))
+STORAGE_MULTIPART_CONCURRENCY = int(os.getenv("STORAGE_MULTIPART_CONCURRENCY", "4"))
+
+# Carrito: máximo de operaciones por llamada a POST /api/carrito/{user_id}/batch
+CART_BATCH_MAX_OPERATIONS = int(os.getenv("CART_BATCH_MAX_OPERATIONS", "200"))
+
+# Almacén de carritos (ver app/almacen_carritos.py): "postgres" (cada mutación es una
+# transacción), "memoria" (un solo proceso) o "redis" (cualquier servidor con protocolo
+# Redis). Con memoria o redis los carritos modificados se vuelcan a PostgreSQL cada
+# CART_FLUSH_INTERVAL_SECONDS, de a CART_FLUSH_BATCH carritos por transacción
+CART_STORE = os.getenv("CART_STORE", "postgres")
+CART_FLUSH_INTERVAL_SECONDS = float(os.getenv("CART_FLUSH_INTERVAL_SECONDS", "2"))
+CART_FLUSH_BATCH = int(os.getenv("CART_FLUSH_BATCH", "500"))
+# memoria: carritos limpios que se conservan (los pendientes de volcar nunca se descartan)
+CART_STORE_MAX_CARTS = int(os.getenv("CART_STORE_MAX_CARTS", "10000"))
+# redis: URL, conexiones, expiración de carritos inactivos y segundos que un proceso
+# reserva un carrito mientras lo vuelca. Con CART_STORE_REDIS_REQUIRE_AOF la aplicación
+# no arranca si el servidor no tiene appendonly activado (sin AOF un reinicio de Redis
+# pierde todo lo no volcado); se recomienda además appendfsync everysec o always
+CART_STORE_REDIS_URL = os.getenv("CART_STORE_REDIS_URL", "redis://localhost:6379/0")
+CART_STORE_REDIS_POOL = int(os.getenv("CART_STORE_REDIS_POOL", "10"))
+CART_STORE_TTL_SECONDS = int(os.getenv("CART_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+CART_STORE_LEASE_SECONDS = int(os.getenv("CART_STORE_LEASE_SECONDS", "60"))
+CART_STORE_REDIS_REQUIRE_AOF = os.getenv("CART_STORE_REDIS_REQUIRE_AOF", "true").lower() in ["true", "1", "yes"]
+
+# Concurrencia optimista (favoritos y carrito): reintentos del servidor cuando otra
+# petición escribió entre la lectura y el UPDATE condicional, con espera aleatoria
+# de hasta OPTIMISTIC_RETRY_BACKOFF_MS * 2^intento milisegundos
+OPTIMISTIC_MAX_RETRIES = int(os.getenv("OPTIMISTIC_MAX_RETRIES", "5"))
+OPTIMISTIC_RETRY_BACKOFF_MS = float(os.getenv("OPTIMISTIC_RETRY_BACKOFF_MS", "5"))
@@ -0,0 +1,458 @@
+"""
+Carrito normalizado en cart_items: una fila por (usuario, producto, color, talla).
+
+Cada mutación es un solo statement (INSERT ... ON CONFLICT DO UPDATE, UPDATE o
+DELETE ... RETURNING) unido en un CTE al resto del carrito, así el carrito
+final vuelve en el mismo viaje y dos pestañas que agregan a la vez no pisan
+sus cambios: PostgreSQL serializa las escrituras sobre la misma línea.
+Ninguna función hace commit.
+
+usuarios.carrito_version es la versión del carrito que se expone como ETag:
+avanzar_version la incrementa (condicionada a la versión de If-Match) antes de
+cada mutación, y vaciar_carrito y reemplazar_carritos también la avanzan.
+
+Con escritura diferida (app.almacen_carritos) el carrito de la base se carga al
+almacén con obtener_carrito_versionado(bloquear=True), que toma FOR SHARE la
+fila del usuario. Quien reemplaza o vacía el carrito (finalizar_orden, edición
+de perfil, baja) toma antes bloquear_carrito (FOR UPDATE) y extrae el carrito
+del almacén, así ninguna carga lee las líneas que está por borrar.
+"""
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, column, delete, exists, func, literal, select, tuple_, union_all, update, values
+from sqlalchemy.dialects.postgresql import array_agg
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.helpers import parse_image_urls
+from app.models.carrito import ItemCarrito
+from app.models.productos import Producto
+from app.models.usuarios import Usuario
+
+COLUMNAS = (ItemCarrito.producto_id, ItemCarrito.cantidad, ItemCarrito.color, ItemCarrito.talla)
+CLAVE = (ItemCarrito.producto_id, ItemCarrito.color, ItemCarrito.talla)
+
+
+def _item(fila) -> dict:
+    return {"producto_id": fila.producto_id, "cantidad": fila.cantidad, "color": fila.color, "talla": fila.talla}
+
+
+async def usuario_existe(db: AsyncSession, usuario_id: int) -> bool:
+    return await db.scalar(select(exists().where(Usuario.id == usuario_id)))
+
+
+async def _mutar(db: AsyncSession, usuario_id: int, clave: tuple, mutacion) -> list:
+    """
+    Ejecuta la mutación sobre la línea `clave` y devuelve el carrito en orden, con
+    la columna `mutada` en las filas que devolvió la mutación. El resto se lee con
+    la foto previa al statement, que es el carrito final salvo por la línea mutada.
+    """
+    fila = mutacion.returning(*COLUMNAS, ItemCarrito.created_at).cte("fila")
+    resto = select(*COLUMNAS, ItemCarrito.created_at, literal(False).label("mutada")).where(
+        ItemCarrito.usuario_id == usuario_id,
+        tuple_(*CLAVE) != tuple_(*clave),
+    )
+    mutada = select(fila.c.producto_id, fila.c.cantidad, fila.c.color, fila.c.talla, fila.c.created_at,
+                    literal(True).label("mutada"))
+    carrito = union_all(resto, mutada).subquery()
+    try:
+        result = await db.execute(
+            select(carrito).order_by(carrito.c.created_at, carrito.c.producto_id)
+        )
+    except IntegrityError as e:
+        await db.rollback()
+        if "cart_items_producto_id_fkey" in str(e.orig):
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        if "cart_items_usuario_id_fkey" in str(e.orig):
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        raise
+    return result.all()
+
+
+async def avanzar_version(db: AsyncSession, usuario_id: int, esperada: Optional[int] = None) -> int:
+    """
+    Incrementa carrito_version y devuelve la nueva. Con `esperada` (If-Match) es
+    un UPDATE ... WHERE carrito_version = :esperada y lanza 412 si otra escritura
+    la avanzó. La fila del usuario queda bloqueada hasta el commit, así dos
+    mutaciones del mismo carrito no confirman con la misma versión.
+    """
+    stmt = update(Usuario).where(Usuario.id == usuario_id)
+    if esperada is not None:
+        stmt = stmt.where(Usuario.carrito_version == esperada)
+    version = await db.scalar(
+        stmt.values(carrito_version=Usuario.carrito_version + 1)
+        .returning(Usuario.carrito_version)
+        .execution_options(synchronize_session=False)
+    )
+    if version is None:
+        if not await usuario_existe(db, usuario_id):
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        raise HTTPException(status_code=412, detail="El carrito cambió desde la versión indicada (If-Match)")
+    return version
+
+
+async def bloquear_carrito(db: AsyncSession, usuario_id: int) -> Optional[int]:
+    """
+    Bloquea la fila del usuario (FOR UPDATE) hasta el fin de la transacción y
+    devuelve carrito_version, o None si el usuario no existe.
+    """
+    return await db.scalar(
+        select(Usuario.carrito_version).where(Usuario.id == usuario_id).with_for_update()
+    )
+
+
+async def superar_version(db: AsyncSession, usuario_id: int, version: int = 0) -> int:
+    """Deja carrito_version por encima de la actual y de `version` (la del almacén)."""
+    return await db.scalar(
+        update(Usuario).where(Usuario.id == usuario_id)
+        .values(carrito_version=func.greatest(Usuario.carrito_version, version) + 1)
+        .returning(Usuario.carrito_version)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def obtener_carrito_versionado(
+    db: AsyncSession, usuario_id: int, bloquear: bool = False
+) -> Optional[Tuple[List[dict], int]]:
+    """
+    Carrito y carrito_version en una consulta (LEFT JOIN desde usuarios).
+    Devuelve None si el usuario no existe. Con bloquear, toma FOR SHARE la fila
+    del usuario (carga al almacén de carritos).
+    """
+    stmt = (
+        select(Usuario.carrito_version, *COLUMNAS)
+        .select_from(Usuario)
+        .outerjoin(ItemCarrito, ItemCarrito.usuario_id == Usuario.id)
+        .where(Usuario.id == usuario_id)
+        .order_by(ItemCarrito.created_at, ItemCarrito.producto_id)
+    )
+    if bloquear:
+        stmt = stmt.with_for_update(read=True, of=Usuario)
+    result = await db.execute(stmt)
+    filas = result.all()
+    if not filas:
+        return None
+    return [_item(f) for f in filas if f.producto_id is not None], filas[0].carrito_version
+
+
+async def obtener_carrito(db: AsyncSession, usuario_id: int) -> Optional[List[dict]]:
+    """Devuelve None si el usuario no existe."""
+    resultado = await obtener_carrito_versionado(db, usuario_id)
+    return None if resultado is None else resultado[0]
+
+
+def _linea_detallada(fila) -> dict:
+    imagenes = parse_image_urls(fila.image_url)
+    return {
+        **_item(fila),
+        "nombre": fila.nombre,
+        "precio": fila.precio,
+        "subtotal": round(fila.precio * fila.cantidad, 2),
+        "imagen": imagenes[0] if imagenes else None,
+        "stock": fila.stock,
+        "disponible": fila.stock >= fila.cantidad,
+    }
+
+
+def totales(lineas: List[dict]) -> dict:
+    return {
+        "total": round(sum(linea["subtotal"] for linea in lineas), 2),
+        "cantidad_total": sum(linea["cantidad"] for linea in lineas),
+        "disponible": all(linea["disponible"] for linea in lineas),
+    }
+
+
+async def obtener_carrito_detallado(db: AsyncSession, usuario_id: int) -> Optional[Tuple[dict, int]]:
+    """
+    Carrito con los datos de cada producto (nombre, precio, primera imagen y stock),
+    subtotales y total, y su versión, en una sola consulta. Devuelve None si el
+    usuario no existe.
+    """
+    result = await db.execute(
+        select(
+            Usuario.carrito_version, *COLUMNAS, Producto.nombre, Producto.precio, Producto.image_url,
+            Producto.cantidad.label("stock"),
+        )
+        .select_from(Usuario)
+        .outerjoin(ItemCarrito, ItemCarrito.usuario_id == Usuario.id)
+        .outerjoin(Producto, Producto.id == ItemCarrito.producto_id)
+        .where(Usuario.id == usuario_id)
+        .order_by(ItemCarrito.created_at, ItemCarrito.producto_id)
+    )
+    filas = result.all()
+    if not filas:
+        return None
+    lineas = [_linea_detallada(f) for f in filas if f.producto_id is not None]
+    return {"carrito": lineas, **totales(lineas)}, filas[0].carrito_version
+
+
+async def detallar_lineas(db: AsyncSession, items: List[dict]) -> dict:
+    """
+    Como obtener_carrito_detallado, para un carrito que no se lee de cart_items
+    (el almacén de carritos en memoria). Omite las líneas de productos eliminados.
+    """
+    productos = {}
+    if items:
+        result = await db.execute(
+            select(Producto.id, Producto.nombre, Producto.precio, Producto.image_url,
+                   Producto.cantidad.label("stock"))
+            .where(Producto.id.in_(list({item["producto_id"] for item in items})))
+        )
+        productos = {f.id: f for f in result.all()}
+    lineas = [
+        _linea_detallada(SimpleNamespace(**item, **productos[item["producto_id"]]._mapping))
+        for item in items if item["producto_id"] in productos
+    ]
+    return {"carrito": lineas, **totales(lineas)}
+
+
+async def agregar_item(
+    db: AsyncSession, usuario_id: int, producto_id: int, color: str, talla: str, cantidad: int
+) -> List[dict]:
+    """Suma `cantidad` a la línea, creándola si no existe. Devuelve el carrito final."""
+    stmt = insert(ItemCarrito).values(
+        usuario_id=usuario_id, producto_id=producto_id, color=color, talla=talla, cantidad=cantidad
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ItemCarrito.usuario_id, *CLAVE],
+        set_={"cantidad": ItemCarrito.cantidad + stmt.excluded.cantidad, "updated_at": func.now()},
+    )
+    filas = await _mutar(db, usuario_id, (producto_id, color, talla), stmt)
+    return [_item(f) for f in filas]
+
+
+async def fijar_cantidad(
+    db: AsyncSession, usuario_id: int, producto_id: int, color: str, talla: str, cantidad: int
+) -> Optional[List[dict]]:
+    """Fija la cantidad de una línea existente. Devuelve None si la línea no está en el carrito."""
+    stmt = (
+        update(ItemCarrito)
+        .where(ItemCarrito.usuario_id == usuario_id, tuple_(*CLAVE) == tuple_(producto_id, color, talla))
+        .values(cantidad=cantidad, updated_at=func.now())
+    )
+    filas = await _mutar(db, usuario_id, (producto_id, color, talla), stmt)
+    if not any(f.mutada for f in filas):
+        if not filas and not await usuario_existe(db, usuario_id):
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        return None
+    return [_item(f) for f in filas]
+
+
+async def eliminar_item(db: AsyncSession, usuario_id: int, producto_id: int, color: str, talla: str) -> List[dict]:
+    """Elimina la línea (si estaba) y devuelve el carrito final."""
+    stmt = delete(ItemCarrito).where(
+        ItemCarrito.usuario_id == usuario_id, tuple_(*CLAVE) == tuple_(producto_id, color, talla)
+    )
+    filas = await _mutar(db, usuario_id, (producto_id, color, talla), stmt)
+    if not filas and not await usuario_existe(db, usuario_id):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return [_item(f) for f in filas if not f.mutada]
+
+
+async def vaciar_carrito(
+    db: AsyncSession, usuario_id: int, extraido: Optional[Tuple[List[dict], int]] = None
+) -> List[dict]:
+    """
+    Elimina todas las líneas y las devuelve en el orden del carrito, con el precio
+    vigente de cada producto, y deja carrito_version por encima de la anterior.
+    `extraido` es el carrito (líneas, versión) sacado del almacén de carritos,
+    más nuevo que cart_items: con él se arma el pedido y la versión queda por
+    encima de la suya, así un volcado atrasado no lo vuelve a escribir.
+    """
+    if extraido is not None:
+        lineas, version = extraido
+        await db.execute(delete(ItemCarrito).where(ItemCarrito.usuario_id == usuario_id))
+        await superar_version(db, usuario_id, version)
+        return (await detallar_lineas(db, lineas))["carrito"]
+
+    # DELETE ... USING productos RETURNING: toma y vacía el carrito en un paso.
+    result = await db.execute(
+        delete(ItemCarrito)
+        .where(ItemCarrito.usuario_id == usuario_id, Producto.id == ItemCarrito.producto_id)
+        .returning(
+            *COLUMNAS, ItemCarrito.created_at, Producto.nombre, Producto.precio, Producto.image_url,
+            Producto.cantidad.label("stock"),
+        )
+    )
+    await superar_version(db, usuario_id)
+    return [_linea_detallada(f) for f in sorted(result.all(), key=lambda f: (f.created_at, f.producto_id))]
+
+
+def validar_items(items: List[dict]) -> None:
+    """
+    Valida las líneas de un carrito completo (alta y edición de usuarios) antes de
+    escribirlas en cart_items: producto_id obligatorio y cantidad entera >= 1
+    (sin cantidad vale 1). Lanza 400.
+    """
+    for posicion, item in enumerate(items):
+        if not isinstance(item, dict) or item.get("producto_id") is None:
+            raise HTTPException(status_code=400, detail=f"La línea {posicion} del carrito no tiene producto_id")
+        cantidad = item.get("cantidad", 1)
+        if not isinstance(cantidad, int) or isinstance(cantidad, bool) or cantidad < 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"La cantidad de la línea {posicion} del carrito debe ser un entero mayor que 0"
+            )
+
+
+async def validar_referencias(db: AsyncSession, usuario_id: int, producto_ids) -> set:
+    """
+    Comprueba el usuario y los productos en una sola consulta. Lanza 404 si el
+    usuario no existe y devuelve los IDs de productos inexistentes.
+    """
+    producto_ids = set(producto_ids)
+    fila = (await db.execute(
+        select(
+            exists().where(Usuario.id == usuario_id).label("usuario_existe"),
+            select(array_agg(Producto.id)).where(Producto.id.in_(list(producto_ids))).scalar_subquery().label("ids"),
+        )
+    )).one()
+    if not fila.usuario_existe:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return producto_ids - set(fila.ids or [])
+
+
+def _resumir_operaciones(operaciones: List[dict]) -> dict:
+    """
+    Reduce las operaciones en orden a un efecto neto por línea:
+    ("sumar", n), ("fijar", n) o ("eliminar", None).
+    """
+    efectos = {}
+    for op in operaciones:
+        clave = (op["producto_id"], op["color"], op["talla"])
+        previo = efectos.get(clave)
+        if op["op"] == "remove":
+            efectos[clave] = ("eliminar", None)
+        elif op["op"] == "set":
+            efectos[clave] = ("fijar", op["cantidad"])
+        elif previo is None:
+            efectos[clave] = ("sumar", op["cantidad"])
+        elif previo[0] == "eliminar":
+            efectos[clave] = ("fijar", op["cantidad"])
+        else:
+            efectos[clave] = (previo[0], previo[1] + op["cantidad"])
+    return efectos
+
+
+async def aplicar_operaciones(db: AsyncSession, usuario_id: int, operaciones: List[dict]) -> List[dict]:
+    """
+    Aplica una lista de operaciones add/set/remove y devuelve el carrito final.
+    "set" crea la línea si no existe. El número de statements no depende de la
+    cantidad de operaciones: una validación, un DELETE, dos upserts y la lectura final.
+    """
+    efectos = _resumir_operaciones(operaciones)
+    producto_ids = sorted({clave[0] for clave in efectos})
+
+    invalidos = await validar_referencias(db, usuario_id, producto_ids)
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Los siguientes IDs de productos no existen: {sorted(invalidos)}"
+        )
+
+    # Claves ordenadas: dos lotes concurrentes bloquean las líneas en el mismo orden.
+    claves = sorted(efectos)
+    # Las líneas nuevas quedan en el orden en que aparecen en las operaciones.
+    orden = {clave: i for i, clave in enumerate(efectos)}
+    eliminar = [c for c in claves if efectos[c][0] == "eliminar"]
+    if eliminar:
+        await db.execute(
+            delete(ItemCarrito).where(ItemCarrito.usuario_id == usuario_id, tuple_(*CLAVE).in_(eliminar))
+        )
+    for tipo in ("sumar", "fijar"):
+        lineas = [
+            {"usuario_id": usuario_id, "producto_id": p, "color": c, "talla": t, "cantidad": efectos[(p, c, t)][1],
+             "created_at": func.now() + timedelta(microseconds=orden[(p, c, t)])}
+            for (p, c, t) in claves if efectos[(p, c, t)][0] == tipo
+        ]
+        if not lineas:
+            continue
+        stmt = insert(ItemCarrito).values(lineas)
+        cantidad = ItemCarrito.cantidad + stmt.excluded.cantidad if tipo == "sumar" else stmt.excluded.cantidad
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[ItemCarrito.usuario_id, *CLAVE],
+            set_={"cantidad": cantidad, "updated_at": func.now()},
+        ))
+
+    return await obtener_carrito(db, usuario_id)
+
+
+async def reemplazar_carrito(db: AsyncSession, usuario_id: int, items: List[dict], version_minima: int = 0) -> None:
+    """
+    Reemplaza el carrito completo (edición de perfil y alta de usuarios).
+    `version_minima` es la del carrito extraído del almacén, si había uno.
+    """
+    await reemplazar_carritos(db, {usuario_id: items}, version_minima=version_minima)
+
+
+async def reemplazar_carritos(db: AsyncSession, carritos: Dict[int, List[dict]], omitir_inexistentes: bool = False,
+                             versiones: Optional[Dict[int, int]] = None, version_minima: int = 0) -> int:
+    """
+    Reemplaza los carritos de varios usuarios con un DELETE y un INSERT. Con
+    omitir_inexistentes se descartan los usuarios y productos eliminados en vez
+    de fallar por la FK (volcado del almacén de carritos). Con `versiones` (las
+    que llevaba el almacén) solo se escriben los carritos cuya versión es mayor
+    que carrito_version, que pasa a ser esa; sin ellas carrito_version queda por
+    encima de la actual y de version_minima.
+    Devuelve las líneas escritas.
+    """
+    if not carritos:
+        return 0
+    if omitir_inexistentes:
+        result = await db.execute(select(Usuario.id).where(Usuario.id.in_(list(carritos))))
+        usuarios = {fila[0] for fila in result.all()}
+        ids = {item["producto_id"] for items in carritos.values() for item in items}
+        result = await db.execute(select(Producto.id).where(Producto.id.in_(list(ids))))
+        productos = {fila[0] for fila in result.all()}
+        carritos = {
+            usuario_id: [item for item in items if item["producto_id"] in productos]
+            for usuario_id, items in carritos.items() if usuario_id in usuarios
+        }
+        if not carritos:
+            return 0
+
+    # Primero usuarios y después cart_items, el mismo orden de bloqueo que las mutaciones.
+    if versiones:
+        # Un volcado atrasado (reserva de Redis vencida, o carrito ya extraído por
+        # finalizar_orden) no pisa uno posterior ni hace retroceder la versión.
+        nuevas = values(column("id", Integer), column("version", Integer), name="nuevas").data(
+            sorted((usuario_id, version) for usuario_id, version in versiones.items() if usuario_id in carritos)
+        )
+        result = await db.execute(
+            update(Usuario)
+            .where(Usuario.id == nuevas.c.id, Usuario.carrito_version < nuevas.c.version)
+            .values(carrito_version=nuevas.c.version)
+            .returning(Usuario.id)
+            .execution_options(synchronize_session=False)
+        )
+        vigentes = set(result.scalars())
+        carritos = {usuario_id: items for usuario_id, items in carritos.items() if usuario_id in vigentes}
+        if not carritos:
+            return 0
+    else:
+        await db.execute(
+            update(Usuario).where(Usuario.id.in_(list(carritos)))
+            .values(carrito_version=func.greatest(Usuario.carrito_version, version_minima) + 1)
+            .execution_options(synchronize_session=False)
+        )
+    await db.execute(delete(ItemCarrito).where(ItemCarrito.usuario_id.in_(list(carritos))))
+    filas = []
+    for usuario_id, items in carritos.items():
+        lineas = {}
+        for item in items:
+            clave = (item["producto_id"], item.get("color") or "", item.get("talla") or "")
+            lineas[clave] = lineas.get(clave, 0) + item.get("cantidad", 1)
+        # now() es el mismo para toda la transacción; el desfase conserva el orden recibido.
+        filas.extend(
+            {"usuario_id": usuario_id, "producto_id": p, "color": c, "talla": t, "cantidad": cantidad,
+             "created_at": func.now() + timedelta(microseconds=i)}
+            for i, ((p, c, t), cantidad) in enumerate(lineas.items())
+        )
+    # Por partes para no pasar el límite de parámetros por statement
+    for inicio in range(0, len(filas), 1000):
+        await db.execute(insert(ItemCarrito).values(filas[inicio:inicio + 1000]))
+    return len(filas)
@@ -3,6 +3,8 @@ from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
 from app.models.categorias import Categoria
 from app.schemas.categorias import CategoriaCreate
+from app.cache import bump_catalog_version
+from app.registro_categorias import refresh_categorias
 
 async def get_categorias(db: AsyncSession):
     result = await db.execute(select(Categoria))
@@ -24,6 +26,8 @@ async def create_categoria(db: AsyncSession, categoria: CategoriaCreate):
     )
     db.add(db_categoria)
     await db.commit()
+    bump_catalog_version()
+    await refresh_categorias(db)
     await db.refresh(db_categoria)
     return db_categoria
 
@@ -37,6 +41,8 @@ async def update_categoria(db: AsyncSession, categoria_id: int, categoria: Categ
     db_categoria.descripcion = categoria.descripcion
     db_categoria.genero = categoria.genero 
     await db.commit()
+    bump_catalog_version()
+    await refresh_categorias(db)
     await db.refresh(db_categoria)
     return db_categoria
 
@@ -47,4 +53,6 @@ async def delete_categoria(db: AsyncSession, categoria_id: int):
     if db_categoria:
         await db.delete(db_categoria)
         await db.commit()
+        bump_catalog_version()
+        await refresh_categorias(db)
     return db_categoria
@@ -0,0 +1,66 @@
+"""
+Favoritos con concurrencia optimista: se leen la lista y favoritos_version, se
+calcula la lista nueva y se escribe con UPDATE ... WHERE favoritos_version = :v.
+Si otra petición escribió en el medio el UPDATE no toca filas y se vuelve a
+leer (READ COMMITTED: cada statement ve lo último confirmado), hasta
+OPTIMISTIC_MAX_RETRIES veces. Ninguna función hace commit.
+"""
+import asyncio
+import random
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import OPTIMISTIC_MAX_RETRIES, OPTIMISTIC_RETRY_BACKOFF_MS
+from app.models.usuarios import Usuario
+
+
+async def obtener_favoritos(db: AsyncSession, usuario_id: int) -> Optional[Tuple[List[int], int]]:
+    """Devuelve (favoritos, versión), o None si el usuario no existe."""
+    fila = (await db.execute(
+        select(Usuario.favoritos, Usuario.favoritos_version).where(Usuario.id == usuario_id)
+    )).one_or_none()
+    if fila is None:
+        return None
+    return fila.favoritos or [], fila.favoritos_version
+
+
+async def modificar_favoritos(
+    db: AsyncSession, usuario_id: int, producto_id: int, agregar: bool, version: Optional[int] = None
+) -> Tuple[List[int], int]:
+    """
+    Agrega o quita `producto_id` y devuelve (favoritos, versión nueva). Con
+    `version` (If-Match) no se reintenta: si la versión actual es otra, 412.
+    """
+    for intento in range(OPTIMISTIC_MAX_RETRIES + 1):
+        actual = await obtener_favoritos(db, usuario_id)
+        if actual is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        favoritos, leida = actual
+        if version is not None and leida != version:
+            raise HTTPException(status_code=412, detail="Los favoritos cambiaron desde la versión indicada (If-Match)")
+
+        if agregar:
+            if producto_id in favoritos:
+                raise HTTPException(status_code=400, detail="Producto ya está en favoritos")
+            nuevos = favoritos + [producto_id]
+        else:
+            if producto_id not in favoritos:
+                raise HTTPException(status_code=400, detail="Producto no está en favoritos")
+            nuevos = [f for f in favoritos if f != producto_id]
+
+        nueva = await db.scalar(
+            update(Usuario)
+            .where(Usuario.id == usuario_id, Usuario.favoritos_version == leida)
+            .values(favoritos=nuevos, favoritos_version=Usuario.favoritos_version + 1)
+            .returning(Usuario.favoritos_version)
+            .execution_options(synchronize_session=False)
+        )
+        if nueva is not None:
+            return nuevos, nueva
+        # Espera aleatoria creciente para que las peticiones que chocaron no vuelvan a chocar.
+        await asyncio.sleep(random.uniform(0, OPTIMISTIC_RETRY_BACKOFF_MS * 2 ** intento) / 1000)
+
+    raise HTTPException(status_code=409, detail="Los favoritos cambiaron durante la actualización; intente de nuevo")
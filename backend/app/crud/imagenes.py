@@ -0,0 +1,79 @@
+import time
+from collections import Counter
+from typing import Iterable, List
+
+from sqlalchemy import case, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.almacenamiento import almacen
+from app.config import BLOB_DELETE_GRACE_SECONDS
+from app.imagenes import blob_clave, blob_hash, blob_url, bloqueo_blob, delete_blob
+from app.models.imagenes import Imagen, TrabajoImagen
+
+
+async def ajustar_referencias(db: AsyncSession, anteriores: Iterable[str], nuevas: Iterable[str]) -> List[str]:
+    """
+    Aplica a la tabla imagenes la diferencia entre las URLs que tenía un producto y
+    las que tiene ahora. No hace commit: corre en la transacción del producto.
+    Devuelve los hashes que quedaron sin referencias; sus filas se borran aquí y
+    sus archivos con liberar_blobs después del commit.
+    """
+    delta = Counter(h for h in map(blob_hash, nuevas or []) if h)
+    delta.subtract(Counter(h for h in map(blob_hash, anteriores or []) if h))
+    # Orden fijo para que dos transacciones no se bloqueen en orden cruzado.
+    suma = {h: n for h, n in sorted(delta.items()) if n > 0}
+    resta = {h: -n for h, n in sorted(delta.items()) if n < 0}
+
+    if suma:
+        stmt = insert(Imagen).values([
+            {"hash": h, "url": blob_url(f"{h}.webp"), "referencias": n} for h, n in suma.items()
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[Imagen.hash],
+            set_={"referencias": Imagen.referencias + stmt.excluded.referencias}
+        ))
+    if not resta:
+        return []
+
+    await db.execute(
+        update(Imagen)
+        .where(Imagen.hash.in_(resta))
+        .values(referencias=Imagen.referencias - case(resta, value=Imagen.hash))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(Imagen)
+        .where(Imagen.hash.in_(resta), Imagen.referencias <= 0)
+        .returning(Imagen.hash)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
+
+
+async def liberar_blobs(hashes: List[str]) -> None:
+    """
+    Borra del almacenamiento los blobs que ajustar_referencias dejó sin referencias.
+    Cada uno se vuelve a revisar con su lock (ver bloqueo_blob): se conserva si otra
+    solicitud lo volvió a referenciar después del commit, si lo usa un trabajo de la
+    cola (un trabajo listo guarda su URL hasta que termina el resto del producto) o
+    si se publicó o reutilizó hace menos de BLOB_DELETE_GRACE_SECONDS, porque el
+    commit que lo referencia puede estar en curso.
+    """
+    limite = time.time() - BLOB_DELETE_GRACE_SECONDS
+    for digest in hashes:
+        async with bloqueo_blob(digest) as conn:
+            if await conn.scalar(select(Imagen.hash).where(Imagen.hash == digest)) is not None:
+                continue
+            en_cola = await conn.scalar(
+                select(TrabajoImagen.id)
+                .where(TrabajoImagen.hash == digest, TrabajoImagen.estado != "error")
+                .limit(1)
+            )
+            if en_cola is not None:
+                continue
+            objeto = await almacen.stat(blob_clave(f"{digest}.webp"))
+            if objeto is not None and objeto.modificado > limite:
+                continue
+            await delete_blob(digest)
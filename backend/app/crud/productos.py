@@ -2,56 +2,300 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models.productos import Producto
 from app.schemas.productos import ProductoCreate
-from app.models.categorias import Categoria
 from sqlalchemy.sql import func
+from sqlalchemy import tuple_, or_, literal_column, text, case, delete
+from datetime import datetime
+from app.helpers import encode_cursor, decode_cursor, normalize_url, parse_image_urls
+from app.cache import bump_catalog_version, get_catalog_version, productos_cache
+from app.config import PRICE_FACET_EDGES
+from app.registro_categorias import get_snapshot, ensure_categorias
+from app.crud.imagenes import ajustar_referencias, liberar_blobs
+from app.imagenes import blob_hash, delete_image_files
+from app.cola_imagenes import encolar_imagenes, notificar_cola, descartar_imagenes, ACTIVOS
+from app.models.imagenes import TrabajoImagen
 
 async def get_producto(db: AsyncSession, producto_id: int):
     query = select(Producto).where(Producto.id == producto_id)
     result = await db.execute(query)
     return result.scalars().first()
 
-async def get_productos(db: AsyncSession, categoria: str = None, genero: str = None, 
-                    search_query: str = None, page: int = 1, limit: int = 15, 
-                    sortBy: str = "default"):
-    query = select(Producto).join(Categoria)
-    
-    if categoria:
-        query = query.filter(Categoria.nombre == categoria)
-    if genero:
-        query = query.filter(Categoria.genero == genero)
+async def get_productos_by_ids(db: AsyncSession, producto_ids: list):
+    """Productos con los IDs dados en una sola consulta, en el mismo orden; omite los inexistentes."""
+    result = await db.execute(select(Producto).where(Producto.id.in_(producto_ids)))
+    por_id = {p.id: p for p in result.scalars().all()}
+    return [por_id[i] for i in producto_ids if i in por_id]
+
+# sortBy -> (columna de ordenamiento, descendente). Todas se desempatan por id.
+# "relevance" se resuelve aparte porque depende del texto buscado.
+ORDENAMIENTOS = {
+    "default": (Producto.id, False),
+    "price_asc": (Producto.precio, False),
+    "price_desc": (Producto.precio, True),
+    "name_asc": (Producto.nombre, False),
+    "name_desc": (Producto.nombre, True),
+    "created_at_desc": (Producto.created_at, True),
+}
+SORT_OPTIONS = set(ORDENAMIENTOS) | {"relevance"}
+
+# Configuración creada por la migración de búsqueda: stemming en español sin acentos.
+TS_CONFIG = literal_column("'es_unaccent'::regconfig")
+
+def _escape_like(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_expressions(search_query: str):
+    """
+    Devuelve (filtro, relevancia) para una búsqueda. El filtro combina el índice
+    GIN de texto completo (nombre y descripción) con el índice de trigramas sobre
+    el nombre, que cubre coincidencias parciales como el antiguo ILIKE.
+    """
+    ts_query = func.websearch_to_tsquery(TS_CONFIG, search_query)
+    nombre_normalizado = func.f_unaccent(func.lower(Producto.nombre))
+    patron = func.concat("%", func.f_unaccent(func.lower(_escape_like(search_query))), "%")
+
+    filtro = or_(Producto.search_vector.op("@@")(ts_query), nombre_normalizado.like(patron))
+    relevancia = (
+        func.ts_rank_cd(Producto.search_vector, ts_query)
+        + func.similarity(nombre_normalizado, func.f_unaccent(func.lower(search_query)))
+    )
+    return filtro, relevancia
+
+def build_productos_query(categoria: str = None, genero: str = None, search_query: str = None):
+    query = select(Producto)
+
+    # Los filtros de categoría se resuelven contra el snapshot en memoria, así
+    # que el listado nunca necesita unir la tabla categorias.
+    if categoria or genero:
+        query = query.filter(Producto.categoria_id.in_(get_snapshot().ids(categoria, genero)))
     if search_query:
-        query = query.filter(Producto.nombre.ilike(f"%{search_query}%"))
+        query = query.filter(search_expressions(search_query)[0])
+    return query
+
+def _sort_key(sortBy: str, search_query: str = None):
+    if sortBy == "relevance":
+        if search_query:
+            return search_expressions(search_query)[1], True
+        sortBy = "default"
+    return ORDENAMIENTOS.get(sortBy, ORDENAMIENTOS["default"])
+
+def apply_ordering(query, sortBy: str = "default", search_query: str = None):
+    """Ordena la consulta y agrega la clave de orden como columna "orden" (usada por el cursor)."""
+    clave, descendente = _sort_key(sortBy, search_query)
+    query = query.add_columns(clave.label("orden"))
+    if descendente:
+        return query.order_by(clave.desc(), Producto.id.desc())
+    return query.order_by(clave.asc(), Producto.id.asc())
+
+def _encode_producto_cursor(row, sortBy: str) -> str:
+    producto, orden = row[0], row.orden
+    return encode_cursor({"s": sortBy, "v": orden, "id": producto.id})
+
+def _apply_cursor(query, payload: dict, sortBy: str, search_query: str = None):
+    if payload.get("s") != sortBy or "id" not in payload or "v" not in payload:
+        raise ValueError("El cursor no corresponde al ordenamiento solicitado")
+
+    clave, descendente = _sort_key(sortBy, search_query)
+    valor = payload["v"]
     if sortBy == "created_at_desc":
-        query = query.order_by(Producto.created_at.desc())
-    
-    if sortBy and sortBy != "default":
-        if sortBy == "price_asc":
-            query = query.order_by(Producto.precio.asc(), Producto.id.asc())
-        elif sortBy == "price_desc":
-            query = query.order_by(Producto.precio.desc(), Producto.id.desc())
-        elif sortBy == "name_asc":
-            query = query.order_by(Producto.nombre.asc(), Producto.id.asc())
-        elif sortBy == "name_desc":
-            query = query.order_by(Producto.nombre.desc(), Producto.id.desc())
-        elif sortBy == "createdAt_desc": 
-            query = query.order_by(Producto.createdAt.desc(), Producto.id.desc())
+        # created_at es NOT NULL: un cursor sin fecha no sale de esta consulta.
+        if not isinstance(valor, str):
+            raise ValueError("Cursor inválido")
+        valor = datetime.fromisoformat(valor)
+
+    # Comparación de filas (clave, id): la consulta arranca justo después de
+    # la última fila entregada y puede usar un índice (clave, id) sin OFFSET.
+    posicion = tuple_(clave, Producto.id)
+    if descendente:
+        return query.filter(posicion < tuple_(valor, payload["id"]))
+    return query.filter(posicion > tuple_(valor, payload["id"]))
+
+# Conteos exactos por categoria_id, recalculados una vez por versión del catálogo.
+_conteos_categoria = {"version": None, "conteos": {}}
+
+async def _conteos_por_categoria(db: AsyncSession) -> dict:
+    version = get_catalog_version()
+    if _conteos_categoria["version"] != version:
+        result = await db.execute(
+            select(Producto.categoria_id, func.count()).group_by(Producto.categoria_id)
+        )
+        _conteos_categoria["conteos"] = dict(result.all())
+        _conteos_categoria["version"] = version
+    return _conteos_categoria["conteos"]
+
+async def estimate_productos_total(db: AsyncSession, categoria: str = None, genero: str = None):
+    """
+    Total aproximado para listados sin filtros (estimación del planificador) o
+    filtrados solo por categoría/género (conteos en caché). Devuelve None si no
+    hay estimación disponible.
+    """
+    await ensure_categorias(db)
+    if not categoria and not genero:
+        # reltuples vale -1 si la tabla aún no se ha analizado.
+        estimado = await db.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'productos'::regclass")
+        )
+        if estimado is not None and estimado >= 0:
+            return estimado
+
+    conteos = await _conteos_por_categoria(db)
+    return sum(conteos.get(categoria_id, 0) for categoria_id in get_snapshot().ids(categoria, genero))
+
+async def contar_productos(db: AsyncSession, categoria: str = None, genero: str = None,
+                           search_query: str = None, total: int = None) -> int:
+    """
+    Total exacto del listado filtrado, en caché hasta el próximo cambio del catálogo:
+    las páginas con cursor no recuentan. Con `total` solo lo guarda en la caché.
+    """
+    clave = ("total", get_catalog_version(), categoria, genero, search_query)
+    if total is None:
+        cacheado = productos_cache.get(clave)
+        if cacheado is not None:
+            return int(cacheado)
+        total = await db.scalar(
+            select(func.count()).select_from(build_productos_query(categoria, genero, search_query))
+        )
+    productos_cache.set(clave, str(total).encode())
+    return total
+
+def build_page_query(categoria: str = None, genero: str = None, search_query: str = None,
+                     sortBy: str = "default", page: int = 1, limit: int = 15,
+                     cursor_payload: dict = None, with_total: bool = True):
+    """Consulta de una página del listado, tal como la ejecuta get_productos."""
+    query = build_productos_query(categoria, genero, search_query)
+    if with_total and not cursor_payload:
+        # El total sale de la misma consulta que la página (una sola ida a la BD). Después
+        # de un cursor la ventana solo contaría las filas siguientes.
+        query = query.add_columns(func.count().over().label("total"))
+
+    query = apply_ordering(query, sortBy, search_query)
+    if cursor_payload:
+        query = _apply_cursor(query, cursor_payload, sortBy, search_query)
+    else:
+        query = query.offset((page - 1) * limit)
 
+    # Se pide una fila extra para saber si existe una página siguiente.
+    return query.limit(limit + 1)
 
-    count_query = select(func.count()).select_from(query)
-    total = await db.scalar(count_query)
+async def get_productos(db: AsyncSession, categoria: str = None, genero: str = None, 
+                    search_query: str = None, page: int = 1, limit: int = 15, 
+                    sortBy: str = "default", cursor: str = None, total_mode: str = "exact"):
+    if sortBy not in SORT_OPTIONS:
+        sortBy = "default"
 
-    offset = (page - 1) * limit
-    query = query.offset(offset).limit(limit)
+    await ensure_categorias(db)
+    payload = decode_cursor(cursor) if cursor else None
+    total = None
+    if total_mode == "estimate" and not search_query:
+        total = await estimate_productos_total(db, categoria, genero)
+    if total is None and payload:
+        total = await contar_productos(db, categoria, genero, search_query)
 
+    query = build_page_query(
+        categoria, genero, search_query, sortBy, page, limit,
+        cursor_payload=payload, with_total=total is None
+    )
     result = await db.execute(query)
-    productos = result.scalars().all()
-    
+    rows = result.all()
+
+    if total is None:
+        if rows:
+            total = await contar_productos(db, categoria, genero, search_query, total=rows[0].total)
+        elif page > 1:
+            # Página fuera de rango: la ventana no devolvió filas de las que leer el total.
+            total = await contar_productos(db, categoria, genero, search_query)
+        else:
+            total = 0
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_producto_cursor(rows[-1], sortBy)
+
     return {
-        "products": productos,
-        "total": total
+        "products": [row[0] for row in rows],
+        "total": total,
+        "next_cursor": next_cursor
     }
 
-async def create_producto(db: AsyncSession, producto: ProductoCreate):
+EXPORT_COLUMNS = [
+    Producto.id, Producto.nombre, Producto.descripcion, Producto.precio,
+    Producto.cantidad, Producto.categoria_id, Producto.image_url, Producto.image_variants,
+    Producto.created_at,
+]
+
+async def stream_productos(db: AsyncSession, categoria: str = None, genero: str = None,
+                           search_query: str = None, batch_size: int = 1000):
+    """
+    Recorre los productos filtrados con un cursor de servidor y entrega lotes de
+    filas (sin objetos ORM), así la memoria usada no depende del total exportado.
+    """
+    await ensure_categorias(db)
+    query = (
+        build_productos_query(categoria, genero, search_query)
+        .with_only_columns(*EXPORT_COLUMNS)
+        .order_by(Producto.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(query)
+    async for filas in result.mappings().partitions(batch_size):
+        yield filas
+
+def _rango_precio(edges):
+    """Índice del rango de precio de cada producto según los límites inferiores `edges`."""
+    return case(
+        *[(Producto.precio < limite, i) for i, limite in enumerate(edges[1:])],
+        else_=len(edges) - 1
+    )
+
+async def get_facetas(db: AsyncSession, categoria: str = None, genero: str = None,
+                      search_query: str = None, edges=PRICE_FACET_EDGES):
+    snapshot = await ensure_categorias(db)
+    filtrados = build_productos_query(categoria, genero, search_query).with_only_columns(
+        Producto.categoria_id,
+        _rango_precio(edges).label("rango"),
+    ).subquery()
+
+    # Una sola agregación con GROUPING SETS: por categoria_id y por rango de precio.
+    # Nombre y género salen del snapshot de categorías.
+    query = select(
+        filtrados.c.categoria_id,
+        filtrados.c.rango,
+        func.grouping(filtrados.c.categoria_id).label("sin_categoria"),
+        func.count().label("total"),
+    ).group_by(func.grouping_sets(
+        tuple_(filtrados.c.categoria_id),
+        tuple_(filtrados.c.rango),
+    ))
+    result = await db.execute(query)
+
+    por_nombre, por_genero, por_rango = {}, {}, {}
+    for row in result.all():
+        if row.sin_categoria:
+            por_rango[row.rango] = row.total
+            continue
+        cat = snapshot.get(row.categoria_id)
+        if not cat:
+            continue
+        por_nombre[cat["nombre"]] = por_nombre.get(cat["nombre"], 0) + row.total
+        por_genero[cat["genero"]] = por_genero.get(cat["genero"], 0) + row.total
+
+    precios = [
+        {
+            "min": limite,
+            "max": edges[i + 1] if i + 1 < len(edges) else None,
+            "total": por_rango.get(i, 0),
+        }
+        for i, limite in enumerate(edges)
+    ]
+    return {
+        "categorias": [{"valor": k, "total": v} for k, v in sorted(por_nombre.items())],
+        "generos": [{"valor": k, "total": v} for k, v in sorted(por_genero.items())],
+        "precios": precios,
+        "total": sum(por_rango.values()),
+    }
+
+async def create_producto(db: AsyncSession, producto: ProductoCreate, imagenes_recibidas: list = None):
+    """imagenes_recibidas (ver app.cola_imagenes.recibir_imagenes) se encolan en la misma transacción."""
     print("Datos recibidos:", producto) 
 
     db_producto = Producto(
@@ -61,14 +305,31 @@ async def create_producto(db: AsyncSession, producto: ProductoCreate):
         cantidad=producto.cantidad,
         categoria_id=producto.categoria_id,
         image_url=producto.image_url,
+        image_variants=producto.image_variants,
     )
     db.add(db_producto)
+    await ajustar_referencias(db, [], producto.image_url)
+    await encolar_imagenes(db, db_producto, imagenes_recibidas or [])
     await db.commit()
+    bump_catalog_version()
+    if imagenes_recibidas:
+        notificar_cola()
     await db.refresh(db_producto)
     return db_producto
 
-async def update_producto(db: AsyncSession, producto_id: int, producto: ProductoCreate):
-    query = select(Producto).where(Producto.id == producto_id)
+async def update_producto(db: AsyncSession, producto_id: int, producto: ProductoCreate,
+                          imagenes_recibidas: list = None, imagenes_quitadas: list = None):
+    """
+    Las imágenes se calculan sobre la fila bloqueada: se quitan las URLs de
+    imagenes_quitadas y se conservan las demás, incluidas las que un worker de la
+    cola agregó después de que el cliente leyó el producto. Las recibidas se encolan
+    y se agregan al final cuando terminan de codificarse.
+    """
+    # FOR UPDATE: un worker de la cola puede estar agregando imágenes a este producto.
+    query = (
+        select(Producto).where(Producto.id == producto_id).with_for_update()
+        .execution_options(populate_existing=True)
+    )
     result = await db.execute(query)
     db_producto = result.scalars().first()
 
@@ -81,15 +342,42 @@ async def update_producto(db: AsyncSession, producto_id: int, producto: Producto
     db_producto.cantidad = producto.cantidad
     db_producto.categoria_id = producto.categoria_id
     
-    if producto.image_url is not None:
-        db_producto.image_url = producto.image_url
+    liberados, quitadas = [], []
+    variantes = dict(db_producto.image_variants or {})
+    if imagenes_quitadas:
+        quitar = {normalize_url(url) for url in imagenes_quitadas}
+        actuales = parse_image_urls(db_producto.image_url)
+        quitadas = [url for url in actuales if normalize_url(url) in quitar]
+        conservadas = [url for url in actuales if normalize_url(url) not in quitar]
+        liberados = await ajustar_referencias(db, actuales, conservadas)
+        db_producto.image_url = conservadas
+        db_producto.image_variants = {url: variantes[url] for url in conservadas if url in variantes}
+
+    # Los errores de la cola de una edición anterior dejan de aplicar.
+    await db.execute(
+        delete(TrabajoImagen).where(TrabajoImagen.producto_id == producto_id, TrabajoImagen.estado == "error")
+    )
+    activos = await db.execute(
+        select(func.count()).select_from(TrabajoImagen)
+        .where(TrabajoImagen.producto_id == producto_id, TrabajoImagen.estado.in_(ACTIVOS))
+    )
+    db_producto.image_status = "procesando" if activos.scalar() else "listo"
+    await encolar_imagenes(db, db_producto, imagenes_recibidas or [])
 
     await db.commit()
+    bump_catalog_version()
+    if imagenes_recibidas:
+        notificar_cola()
+    await liberar_blobs(liberados)
+    # Las imágenes anteriores al almacén por contenido están en la carpeta del producto.
+    for url in quitadas:
+        if not blob_hash(url):
+            await delete_image_files(url, variantes.get(url))
     await db.refresh(db_producto)
     return db_producto
 
 async def delete_producto(db: AsyncSession, producto_id: int):
-    query = select(Producto).where(Producto.id == producto_id)
+    query = select(Producto).where(Producto.id == producto_id).with_for_update()
     result = await db.execute(query)
     db_producto = result.scalars().first()
     
@@ -97,7 +385,14 @@ async def delete_producto(db: AsyncSession, producto_id: int):
         print(f"Producto con ID {producto_id} no encontrado")
         return None
 
+    liberados = await ajustar_referencias(db, parse_image_urls(db_producto.image_url), [])
+    # Los trabajos de la cola se borran en cascada; sus archivos recibidos, después del commit.
+    result = await db.execute(select(TrabajoImagen.archivo).where(TrabajoImagen.producto_id == producto_id))
+    archivos_en_cola = result.scalars().all()
     await db.delete(db_producto)
     await db.commit()
+    bump_catalog_version()
+    await liberar_blobs(liberados)
+    await descartar_imagenes([{"archivo": archivo} for archivo in archivos_en_cola])
     print(f"Producto con ID {producto_id} eliminado correctamente")
     return db_producto
@@ -6,6 +6,8 @@ from passlib.context import CryptContext
 from fastapi import HTTPException
 from sqlalchemy.dialects.postgresql import ARRAY
 from app.models.productos import Producto
+from app.crud.carrito import reemplazar_carrito, bloquear_carrito, validar_items, validar_referencias
+from app.almacen_carritos import carritos
 
 pwd_context = CryptContext(
     schemes=["bcrypt"],
@@ -22,7 +24,7 @@ async def create_usuario(db: AsyncSession, usuario: UsuarioCreate):
         usuario_dict['metodo_pago'] = usuario_dict.get('metodo_pago', []) or []
         usuario_dict['rol'] = usuario_dict.get('rol', 'usuario')
         usuario_dict['favoritos'] = usuario_dict.get('favoritos', [])
-        usuario_dict['carrito'] = usuario_dict.get('carrito', [])
+        usuario_dict['carrito'] = usuario_dict.get('carrito') or []
 
         if not isinstance(usuario_dict['metodo_pago'], list):
             raise ValueError("El campo 'metodo_pago' debe ser una lista.")
@@ -41,6 +43,7 @@ async def create_usuario(db: AsyncSession, usuario: UsuarioCreate):
 
         # Validar carrito
         if usuario_dict['carrito']:
+            validar_items(usuario_dict['carrito'])
             carrito_ids = [item['producto_id'] for item in usuario_dict['carrito']]
             query_carrito = select(Producto.id).filter(Producto.id.in_(carrito_ids))
             productos_carrito = await db.execute(query_carrito)
@@ -53,12 +56,17 @@ async def create_usuario(db: AsyncSession, usuario: UsuarioCreate):
                 )
 
         # Crear usuario
+        carrito = usuario_dict.pop('carrito')
         db_usuario = Usuario(**usuario_dict)
         db.add(db_usuario)
+        await db.flush()
+        await reemplazar_carrito(db, db_usuario.id, carrito)
         await db.commit()
         await db.refresh(db_usuario)
         return db_usuario
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error al crear usuario: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno: {e}")
@@ -69,7 +77,6 @@ async def get_usuario_by_id(db: AsyncSession, usuario_id: int):
     
     if usuario:
         usuario.favoritos = usuario.favoritos or []
-        usuario.carrito = usuario.carrito or []
         usuario.metodo_pago = usuario.metodo_pago or []
     
     return usuario
@@ -80,7 +87,6 @@ async def get_usuarios(db: AsyncSession):
     
     for usuario in usuarios:
         usuario.favoritos = usuario.favoritos or []
-        usuario.carrito = usuario.carrito or []
         usuario.metodo_pago = usuario.metodo_pago or []
     
     return usuarios
@@ -105,8 +111,16 @@ async def delete_usuario(db: AsyncSession, usuario_id: int):
     usuario = usuario.scalar_one_or_none()
 
     if usuario:
-        await db.delete(usuario)
-        await db.commit()
+        # Con la fila bloqueada, el carrito sale del almacén para que no se vuelva a cargar ni a volcar.
+        await bloquear_carrito(db, usuario_id)
+        extraido = await carritos.extraer(usuario_id)
+        try:
+            await db.delete(usuario)
+            await db.commit()
+        except BaseException:
+            await carritos.reponer(usuario_id, extraido)
+            await db.rollback()
+            raise
         return usuario
     return None
 
@@ -140,11 +154,32 @@ async def update_usuario_profile(db: AsyncSession, usuario_id: int, update_data:
         usuario.rol = update_data.rol
     if update_data.favoritos is not None:
         usuario.favoritos = update_data.favoritos
+        # Invalida los ETag de favoritos entregados antes de la edición.
+        usuario.favoritos_version = Usuario.favoritos_version + 1
+    extraido = None
     if update_data.carrito is not None:
-        usuario.carrito = update_data.carrito
+        # cart_items tiene FK a productos y cantidad > 0: se valida antes de escribir.
+        validar_items(update_data.carrito)
+        invalidos = await validar_referencias(db, usuario.id, [item["producto_id"] for item in update_data.carrito])
+        if invalidos:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Los siguientes IDs de productos en el carrito no existen: {sorted(invalidos)}"
+            )
+        # Como en finalizar_orden: con la fila bloqueada, el carrito del almacén se
+        # reemplaza y un volcado atrasado no lo vuelve a escribir.
+        await bloquear_carrito(db, usuario.id)
+        extraido = await carritos.extraer(usuario.id)
 
-    db.add(usuario)
-    await db.commit()
+    try:
+        if update_data.carrito is not None:
+            await reemplazar_carrito(db, usuario.id, update_data.carrito, extraido[1] if extraido else 0)
+        db.add(usuario)
+        await db.commit()
+    except BaseException:
+        await carritos.reponer(usuario.id, extraido)
+        await db.rollback()
+        raise
     await db.refresh(usuario)
     return usuario
 
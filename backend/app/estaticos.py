@@ -0,0 +1,110 @@
+import hashlib
+import stat
+from email.utils import formatdate
+from mimetypes import guess_type
+from pathlib import Path
+
+import anyio
+from fastapi import APIRouter
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.almacenamiento import almacen
+from app.cache import uploads_hot_cache
+from app.config import UPLOADS_MAX_AGE, UPLOADS_HOT_CACHE_MAX_FILE_BYTES, ORPHAN_QUARANTINE_PREFIX, STORAGE_PRESIGN_SECONDS
+
+# Archivos que nunca se sobrescriben: los blobs llevan el hash de su contenido en el
+# nombre y las imágenes de las carpetas de producto, fecha y número aleatorio.
+INMUTABLES = ("blobs/", "CarpetasDeProductos/")
+PRIVADOS = ("blobs/tmp/", "spool/", f"{ORPHAN_QUARANTINE_PREFIX}/")
+
+
+class UploadsStaticFiles(StaticFiles):
+    """
+    StaticFiles para /uploads con cabeceras de caché: los archivos inmutables se
+    sirven con Cache-Control immutable y un ETag fuerte (el hash del blob cuando
+    lo hay), y las miniaturas más pedidas se responden desde memoria.
+    FileResponse ya resuelve If-None-Match, Range y, si el servidor ofrece la
+    extensión http.response.pathsend, el envío del archivo sin copiarlo al proceso.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if path.startswith(PRIVADOS):
+            raise HTTPException(status_code=404)
+        if scope["method"] in ("GET", "HEAD") and path.startswith(INMUTABLES):
+            request_headers = Headers(scope=scope)
+            if "range" not in request_headers:
+                response = await self._respuesta_en_memoria(path, request_headers)
+                if response is not None:
+                    return response
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result,
+            headers=self._cabeceras(self.get_path(scope), stat_result)
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def _respuesta_en_memoria(self, path: str, request_headers: Headers):
+        # lookup_path solo hace stat/realpath; se llama sin pasar a un hilo para que
+        # un acierto en memoria no pague el salto al threadpool.
+        full_path, stat_result = self.lookup_path(path)
+        if (
+            stat_result is None
+            or not stat.S_ISREG(stat_result.st_mode)
+            or stat_result.st_size > UPLOADS_HOT_CACHE_MAX_FILE_BYTES
+        ):
+            return None
+
+        headers = self._cabeceras(path, stat_result)
+        if self.is_not_modified(Headers(headers=headers), request_headers):
+            return NotModifiedResponse(Headers(headers=headers))
+
+        clave = (full_path, stat_result.st_mtime_ns, stat_result.st_size)
+        body = uploads_hot_cache.get(clave)
+        if body is None:
+            body = await anyio.to_thread.run_sync(Path(full_path).read_bytes)
+            uploads_hot_cache.set(clave, body)
+        return Response(
+            body, media_type=guess_type(full_path)[0] or "text/plain",
+            headers={**headers, "accept-ranges": "bytes"}
+        )
+
+    @staticmethod
+    def _cabeceras(path: str, stat_result) -> dict:
+        if path.startswith("blobs/"):
+            etag = f'"{Path(path).stem}"'
+        else:
+            etag = '"' + hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode()).hexdigest() + '"'
+        if path.startswith(INMUTABLES):
+            cache_control = f"public, max-age={UPLOADS_MAX_AGE}, immutable"
+        else:
+            cache_control = "no-cache"
+        return {
+            "cache-control": cache_control,
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        }
+
+
+# Con un backend remoto /uploads/<clave> responde con una redirección al bucket. La URL
+# firmada se repite durante una ventana de STORAGE_PRESIGN_SECONDS, así que la
+# redirección se puede cachear por media ventana sin que el destino expire.
+redireccion_uploads = APIRouter()
+
+
+@redireccion_uploads.api_route("/uploads/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def redirigir_upload(path: str):
+    clave = almacen.clave_de_url(f"/uploads/{path}")
+    if not clave or clave.startswith(PRIVADOS):
+        raise HTTPException(status_code=404)
+    return RedirectResponse(
+        await almacen.url_publica(clave), status_code=307,
+        headers={"cache-control": f"public, max-age={STORAGE_PRESIGN_SECONDS // 2}"}
+    )
@@ -1,32 +1,7 @@
+import base64
+import json
+from typing import Optional
 from urllib.parse import urlparse
-from pathlib import Path
-
-def extract_folder_from_url(url: str) -> str:
-    """
-    Dada una URL (que puede ser absoluta o relativa) de imagen,
-    extrae el nombre de la carpeta, que se asume es el primer
-    directorio después de '/uploads/CarpetasDeProductos/'.
-    """
-    # Si la URL es absoluta, obtenemos la parte de la ruta
-    if url.startswith("http://") or url.startswith("https://"):
-        parsed = urlparse(url)
-        url = parsed.path  # quedarnos solo con la ruta
-    prefix = "/uploads/CarpetasDeProductos/"
-    if url.startswith(prefix):
-        # Extraemos el nombre de la carpeta: lo que esté inmediatamente después del prefix
-        return url[len(prefix):].split("/")[0]
-    return ""
-
-def extract_file_path_from_url(url: str) -> Path:
-    """
-    Convierte una URL (absoluta o relativa) en un objeto Path relativo al servidor.
-    Por ejemplo, '/uploads/CarpetasDeProductos/mi_carpeta/imagen.webp'
-    se convertirá en Path("uploads/CarpetasDeProductos/mi_carpeta/imagen.webp")
-    """
-    if url.startswith("http://") or url.startswith("https://"):
-        parsed = urlparse(url)
-        url = parsed.path
-    return Path(url.lstrip("/"))
 
 
 def normalize_url(url: str) -> str:
@@ -37,3 +12,58 @@ def normalize_url(url: str) -> str:
         return parsed.path  # extrae solo la parte de la ruta
     return url
 
+
+
+def encode_cursor(payload: dict) -> str:
+    """Serializa la posición de la última fila de una página en un cursor opaco
+    (JSON en base64 url-safe, sin relleno)."""
+    raw = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Operación inversa de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+    if not isinstance(payload, dict):
+        raise ValueError("Cursor inválido")
+    return payload
+
+
+def parse_image_urls(value) -> list:
+    """Normaliza el campo image_url (lista, JSON en texto o una sola URL) a una lista de rutas."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+            value = parsed if isinstance(parsed, list) else [value]
+        except json.JSONDecodeError:
+            value = [value]
+    return [normalize_url(url) for url in value if isinstance(url, str)]
+
+
+def etag_version(version: int) -> str:
+    """ETag fuerte de un recurso versionado (favoritos, carrito): la versión entre comillas."""
+    return f'"{version}"'
+
+
+def parse_if_match(valor: Optional[str]) -> Optional[int]:
+    """
+    Versión esperada según el encabezado If-Match; None si no vino o es "*".
+    Lanza ValueError si no es un ETag generado por etag_version.
+    """
+    if valor is None or valor.strip() == "*":
+        return None
+    etag = valor.strip()
+    if etag.startswith("W/"):
+        # If-Match usa comparación fuerte: un ETag débil nunca coincide.
+        raise ValueError("If-Match no admite ETags débiles")
+    if len(etag) >= 2 and etag[0] == etag[-1] == '"':
+        etag = etag[1:-1]
+    if not etag.isdigit():
+        raise ValueError(f"If-Match inválido: {valor}")
+    return int(etag)
@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import func, select
+
+from app.config import (
+    IMAGE_WORKERS, IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_QUALITY, IMAGE_MAX_PIXELS, IMAGE_PROFILES, IMAGE_PROFILE,
+    UPLOAD_CHUNK_SIZE, UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_REQUEST_BYTES, STORAGE_LOCAL_DIR,
+)
+from app.almacenamiento import Objeto, almacen
+from app.database import engine
+
+# Prefijos de las claves en el almacenamiento (ver app/almacenamiento.py)
+# Imágenes anteriores al almacén por contenido: CarpetasDeProductos/<carpeta>/<archivo>
+PRODUCTS_PREFIX = "CarpetasDeProductos/"
+# Almacén por contenido: blobs/<2 primeros caracteres del hash>/<sha256 de los bytes subidos>.webp
+BLOBS_PREFIX = "blobs/"
+# Imágenes recibidas que esperan en la cola de procesamiento (no se sirven)
+SPOOL_PREFIX = "spool/"
+
+# Directorio local de trabajo de la codificación. Con el backend local está dentro de
+# la misma carpeta, así publicar un archivo es un os.replace.
+BASE_UPLOAD_DIR = Path(STORAGE_LOCAL_DIR)
+BLOBS_TMP_DIR = BASE_UPLOAD_DIR / "blobs" / "tmp"
+BLOBS_TMP_DIR.mkdir(parents=True, exist_ok=True)
+
+# Pillow lanza DecompressionBombError al abrir imágenes de más del doble de este valor;
+# abrir_imagen aplica el límite exacto antes de decodificar.
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+
+class ImagenRechazada(ValueError):
+    """La imagen no es válida o sus dimensiones superan IMAGE_MAX_PIXELS."""
+
+
+class ArchivoDemasiadoGrande(ValueError):
+    pass
+
+
+def abrir_imagen(image_path: Path) -> Image.Image:
+    """
+    Abre una imagen comprobando sus dimensiones. Image.open solo lee la cabecera,
+    así que una imagen enorme se rechaza sin reservar memoria para sus píxeles.
+    """
+    try:
+        img = Image.open(image_path)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ImagenRechazada(f"{image_path.name}: {e}") from None
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        img.close()
+        raise ImagenRechazada(
+            f"{image_path.name}: {img.width}x{img.height} supera el máximo de {IMAGE_MAX_PIXELS} píxeles"
+        )
+    return img
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def prepare_image(img: Image.Image, perfil: dict) -> Image.Image:
+    """Aplica la orientación EXIF, el lado máximo y el modo de color (RGB/RGBA) del perfil."""
+    alpha = has_alpha(img)
+    if perfil["auto_orient"]:
+        img = ImageOps.exif_transpose(img)
+    lado = perfil["max_dimension"]
+    if lado and max(img.size) > lado:
+        img.thumbnail((lado, lado), Image.LANCZOS)
+    if img.mode not in ("RGB", "RGBA"):
+        cmyk = img.mode == "CMYK"
+        img = img.convert("RGBA" if alpha else "RGB")
+        if cmyk:
+            # El perfil ICC de origen describe el espacio CMYK: aplicado a los píxeles
+            # RGB convertidos alteraría los colores.
+            img.info.pop("icc_profile", None)
+    return img
+
+
+def encode_webp(img: Image.Image, destino, perfil: dict, quality: Optional[int] = None) -> None:
+    """Codifica img como WebP en destino (ruta o archivo) con las opciones del perfil."""
+    lossless = perfil["lossless_alpha"] and img.format == "PNG" and has_alpha(img)
+    img = prepare_image(img, perfil)
+    opciones = {
+        "format": "WEBP",
+        "quality": quality if quality is not None else perfil["quality"],
+        "method": perfil["method"],
+        "lossless": lossless,
+        # exif_transpose ya dejó la orientación en 1, así que el EXIF conservado no la vuelve a aplicar.
+        "exif": b"" if perfil["strip_exif"] else img.getexif().tobytes(),
+    }
+    if img.info.get("icc_profile"):
+        opciones["icc_profile"] = img.info["icc_profile"]
+    img.save(destino, **opciones)
+
+
+def get_profile(nombre: str = IMAGE_PROFILE) -> dict:
+    return IMAGE_PROFILES[nombre]
+
+
+def convert_to_webp(image_path: Path, perfil: Optional[dict] = None) -> Path:
+    """Convierte una imagen a formato .webp con el perfil de codificación configurado."""
+    with abrir_imagen(image_path) as img:
+        webp_path = image_path.with_suffix('.webp')
+        encode_webp(img, webp_path, perfil or get_profile())
+    return webp_path
+
+
+def blob_clave(file_name: str) -> str:
+    return f"{BLOBS_PREFIX}{file_name[:2]}/{file_name}"
+
+
+def blob_url(file_name: str) -> str:
+    return almacen.url(blob_clave(file_name))
+
+
+def blob_hash(url: str) -> Optional[str]:
+    """Hash del blob al que apunta una URL (original o variante); None si no es del almacén."""
+    clave = almacen.clave_de_url(url)
+    if not clave or not clave.startswith(BLOBS_PREFIX):
+        return None
+    return Path(clave).stem.split("_", 1)[0]
+
+
+def build_variants(image_path: Path, widths: List[int] = IMAGE_VARIANT_WIDTHS) -> Dict[str, str]:
+    """
+    Genera copias reducidas de una imagen junto al archivo original
+    (<nombre>_w<ancho>.webp). Devuelve {ancho: nombre de archivo}, incluido el
+    original con su ancho real; no se generan variantes más anchas que el original.
+    """
+    variantes = {}
+    with abrir_imagen(image_path) as img:
+        ancho, alto = img.size
+        variantes[str(ancho)] = image_path.name
+        for w in sorted(widths):
+            if w >= ancho:
+                continue
+            destino = image_path.with_name(f"{image_path.stem}_w{w}.webp")
+            copia = img.resize((w, max(1, round(alto * w / ancho))), Image.LANCZOS)
+            encode_webp(copia, destino, get_profile(), quality=IMAGE_VARIANT_QUALITY)
+            variantes[str(w)] = destino.name
+    return variantes
+
+
+def variant_urls(image_url: str, variantes: Dict[str, str]) -> Dict[str, str]:
+    """{ancho: archivo} -> {ancho: URL}; las variantes están junto a la imagen original."""
+    base = image_url.rsplit("/", 1)[0]
+    return {w: f"{base}/{nombre}" for w, nombre in variantes.items()}
+
+
+async def existing_variants(digest: str, objeto: Optional[Objeto] = None) -> Dict[str, str]:
+    """
+    Reconstruye {ancho: archivo} de un blob ya publicado a partir de las claves del
+    almacenamiento. El ancho del original sale del metadato "ancho" que guarda
+    store_blob (objeto es su stat); si no lo tiene (backend local o blobs anteriores)
+    se lee de la cabecera de la imagen, lo que en S3 obliga a descargarla.
+    """
+    nombre = f"{digest}.webp"
+    ancho = objeto.metadatos.get("ancho") if objeto else None
+    if ancho:
+        variantes = {ancho: nombre}
+    else:
+        async with almacen.archivo_local(blob_clave(nombre), BLOBS_TMP_DIR) as path:
+            with abrir_imagen(path) as img:
+                variantes = {str(img.width): nombre}
+    async for objeto in almacen.listar(blob_clave(f"{digest}_w")):
+        archivo = objeto.clave.rsplit("/", 1)[1]
+        variantes[Path(archivo).stem.rsplit("_w", 1)[1]] = archivo
+    return variantes
+
+
+def process_image(image_path: Path, convertir: bool) -> Tuple[Path, Dict[str, str]]:
+    """Convierte a WebP (si hace falta) y genera las variantes. Se ejecuta en el pool de procesos."""
+    if convertir:
+        webp_path = convert_to_webp(image_path)
+        if webp_path != image_path:
+            try:
+                image_path.unlink()
+            except Exception as e:
+                print(f"Error al eliminar el archivo original: {e}")
+        image_path = webp_path
+    return image_path, build_variants(image_path)
+
+
+def resize_image(origen: Path, destino: Path, ancho: int, calidad: int) -> None:
+    """
+    Escribe en destino una copia WebP de origen con el ancho pedido; nunca agranda.
+    Se escribe a un temporal y se publica con os.replace. Se ejecuta en el pool de procesos.
+    """
+    tmp_path = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    with abrir_imagen(origen) as img:
+        if ancho < img.width:
+            copia = img.resize((ancho, max(1, round(img.height * ancho / img.width))), Image.LANCZOS)
+        else:
+            copia = img
+        encode_webp(copia, tmp_path, get_profile(), quality=calidad)
+    os.replace(tmp_path, destino)
+
+
+def encode_blob(tmp_path: Path, digest: str, convertir: bool) -> Tuple[Path, Dict[str, str]]:
+    """
+    Codifica una imagen recibida y sus variantes en un directorio de trabajo propio
+    bajo BLOBS_TMP_DIR. Devuelve (directorio, {ancho: archivo}); quien llama publica
+    los archivos y borra el directorio. No borra tmp_path. Se ejecuta en el pool de procesos.
+    """
+    trabajo = Path(tempfile.mkdtemp(dir=BLOBS_TMP_DIR))
+    try:
+        origen = trabajo / (f"{digest}.original" if convertir else f"{digest}.webp")
+        try:
+            os.link(tmp_path, origen)
+        except OSError:
+            shutil.copyfile(tmp_path, origen)
+        _, variantes = process_image(origen, convertir)
+    except BaseException:
+        shutil.rmtree(trabajo, ignore_errors=True)
+        raise
+    return trabajo, variantes
+
+
+@asynccontextmanager
+async def bloqueo_blob(digest: str):
+    """
+    Lock advisory de PostgreSQL por hash, hasta el final de su transacción: ordena
+    entre procesos y nodos la reutilización o publicación de un blob (store_blob)
+    con su eliminación (liberar_blobs). Devuelve la conexión que lo tiene.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(select(func.pg_advisory_xact_lock(int(digest[:15], 16))))
+        yield conn
+
+
+async def store_blob(tmp_path: Path, digest: str, convertir: bool) -> Tuple[str, Dict[str, str]]:
+    """
+    Publica una imagen recibida en el almacén por contenido y devuelve (URL, {ancho: URL}).
+    Si ya hay un blob con el mismo hash se reutiliza sin volver a codificar.
+    No borra tmp_path: quien llama lo elimina cuando el resultado quedó registrado,
+    así un reintento tras una caída vuelve a encontrar el archivo.
+    """
+    nombre = f"{digest}.webp"
+    url = blob_url(nombre)
+    async with bloqueo_blob(digest):
+        objeto = await almacen.stat(blob_clave(nombre))
+        if objeto is not None:
+            variantes = await existing_variants(digest, objeto)
+            # Se renueva la fecha para que ni liberar_blobs ni la limpieza de huérfanos
+            # (que respetan un período de gracia) borren un blob que se está volviendo a
+            # usar antes de que quien llama confirme su referencia.
+            await asyncio.gather(*[almacen.tocar(blob_clave(n)) for n in set(variantes.values())])
+            return url, variant_urls(url, variantes)
+
+    loop = asyncio.get_running_loop()
+    trabajo, variantes = await loop.run_in_executor(get_image_executor(), encode_blob, tmp_path, digest, convertir)
+    # Dos subidas simultáneas de los mismos bytes publican archivos idénticos, y cada
+    # archivo se publica completo. El original va al final porque su presencia es la
+    # que marca el blob como completo; las variantes se suben en paralelo.
+    try:
+        async with bloqueo_blob(digest):
+            await asyncio.gather(*[
+                almacen.put_file(blob_clave(n), trabajo / n, mover=True)
+                for n in set(variantes.values()) if n != nombre
+            ])
+            ancho = next(w for w, n in variantes.items() if n == nombre)
+            await almacen.put_file(blob_clave(nombre), trabajo / nombre, mover=True, metadatos={"ancho": ancho})
+    finally:
+        shutil.rmtree(trabajo, ignore_errors=True)
+    return url, variant_urls(url, variantes)
+
+
+async def delete_blob(digest: str) -> None:
+    """Elimina del almacenamiento un blob y sus variantes."""
+    try:
+        eliminados = await almacen.eliminar_prefijo(blob_clave(digest))
+        print(f"Se eliminaron {eliminados} archivos del blob {digest}")
+    except Exception as e:
+        print(f"Error al eliminar el blob {digest}: {e}")
+
+
+async def delete_image_files(image_url: str, variantes: Optional[Dict[str, str]] = None) -> None:
+    """Elimina del almacenamiento una imagen y sus variantes."""
+    urls = {image_url, *(variantes or {}).values()}
+    for url in urls:
+        clave = almacen.clave_de_url(url)
+        if not clave:
+            continue
+        try:
+            await almacen.delete(clave)
+            print(f"Se eliminó el archivo: {clave}")
+        except Exception as e:
+            print(f"Error al eliminar {clave}: {e}")
+
+
+# Pool de procesos para la codificación: Pillow ocupa la CPU durante segundos y,
+# dentro del event loop, detendría todas las demás solicitudes del worker.
+_image_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_image_executor(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """`workers` (por defecto IMAGE_WORKERS) solo cuenta al crear el pool."""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ProcessPoolExecutor(max_workers=workers or IMAGE_WORKERS)
+    return _image_executor
+
+
+def shutdown_image_executor() -> None:
+    global _image_executor
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=True)
+        _image_executor = None
+
+
+def copy_in_chunks(origen: BinaryIO, destino: Path, max_bytes: Optional[int] = None,
+                   fsync: bool = False) -> Tuple[int, str]:
+    """Copia en bloques calculando el sha256 al vuelo. Devuelve (bytes escritos, hash)."""
+    escritos = 0
+    digest = hashlib.sha256()
+    with open(destino, "wb") as buffer:
+        while chunk := origen.read(UPLOAD_CHUNK_SIZE):
+            escritos += len(chunk)
+            if max_bytes is not None and escritos > max_bytes:
+                raise ArchivoDemasiadoGrande()
+            digest.update(chunk)
+            buffer.write(chunk)
+        if fsync:
+            buffer.flush()
+            os.fsync(buffer.fileno())
+    return escritos, digest.hexdigest()
+
+
+def _limite_excedido(nombre: str, max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"La imagen {nombre} supera el máximo de {max_bytes // (1024 * 1024)} MB"
+    )
+
+
+async def guardar_upload(upload: UploadFile, destino: Path,
+                         max_bytes: int = UPLOAD_MAX_FILE_BYTES, fsync: bool = False) -> Tuple[int, str]:
+    """
+    Copia un archivo subido a disco en bloques de UPLOAD_CHUNK_SIZE desde un hilo,
+    sin cargarlo entero en memoria ni bloquear el event loop.
+    Devuelve (bytes escritos, sha256 del contenido).
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise _limite_excedido(upload.filename, max_bytes)
+    await upload.seek(0)
+    try:
+        return await asyncio.to_thread(copy_in_chunks, upload.file, destino, max_bytes, fsync)
+    except ArchivoDemasiadoGrande:
+        destino.unlink(missing_ok=True)
+        raise _limite_excedido(upload.filename, max_bytes) from None
+
+
+def validar_tamanos(uploads: List[UploadFile]) -> None:
+    """Rechaza la solicitud antes de escribir nada si algún archivo o el total superan los límites."""
+    total = 0
+    for upload in uploads:
+        if upload.size is None:
+            continue
+        if upload.size > UPLOAD_MAX_FILE_BYTES:
+            raise _limite_excedido(upload.filename, UPLOAD_MAX_FILE_BYTES)
+        total += upload.size
+    if total > UPLOAD_MAX_REQUEST_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Las imágenes suman más de {UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB"
+        )
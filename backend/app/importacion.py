@@ -0,0 +1,241 @@
+import asyncio
+import csv
+import json
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Iterator, Optional, TextIO
+
+from pydantic_core import PydanticCustomError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import bump_catalog_version
+from app.config import IMPORT_BATCH_SIZE
+from app.crud.imagenes import ajustar_referencias
+from app.imagenes import BLOBS_TMP_DIR, copy_in_chunks, store_blob, get_image_executor
+from app.models.productos import Producto
+from app.registro_categorias import ensure_categorias
+from app.validators.productos import ProductoValidator
+
+# Columnas que se cargan con COPY; created_at y search_vector los completa PostgreSQL.
+COPY_COLUMNS = ["nombre", "descripcion", "precio", "cantidad", "categoria_id", "image_url", "image_variants"]
+JSON_COLUMNS = ("image_url", "image_variants")
+
+
+def detectar_formato(nombre_archivo: str) -> Optional[str]:
+    sufijo = Path(nombre_archivo or "").suffix.lower()
+    if sufijo == ".csv":
+        return "csv"
+    if sufijo in (".ndjson", ".jsonl"):
+        return "ndjson"
+    return None
+
+
+def leer_filas(archivo: TextIO, formato: str) -> Iterator[tuple]:
+    """Entrega (número de fila, dict) o (número de fila, error) sin cargar todo el archivo."""
+    if formato == "csv":
+        for numero, fila in enumerate(csv.DictReader(archivo), start=1):
+            yield numero, fila
+        return
+    for numero, linea in enumerate(archivo, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except json.JSONDecodeError as e:
+            yield numero, ValueError(f"JSON inválido: {e}")
+            continue
+        if not isinstance(fila, dict):
+            yield numero, ValueError("Cada línea debe ser un objeto JSON")
+            continue
+        yield numero, fila
+
+
+def validar_fila(fila: dict, categorias_validas: set, imagenes_disponibles: set) -> tuple:
+    """Devuelve (datos normalizados, lista de errores) para una fila del archivo."""
+    errores = []
+    datos = {}
+
+    nombre = (fila.get("nombre") or "").strip()
+    try:
+        ProductoValidator.validate_nombre(nombre)
+        datos["nombre"] = nombre
+    except PydanticCustomError as e:
+        errores.append(f"nombre: {e}")
+
+    datos["descripcion"] = (fila.get("descripcion") or "").strip()
+    if len(datos["descripcion"]) > 500:
+        errores.append("descripcion: no puede superar los 500 caracteres")
+
+    # PydanticCustomError es un ValueError: se captura antes que el error de conversión.
+    try:
+        datos["precio"] = ProductoValidator.validate_precio(float(fila.get("precio")))
+    except PydanticCustomError as e:
+        errores.append(f"precio: {e}")
+    except (TypeError, ValueError):
+        errores.append("precio: debe ser un número")
+
+    try:
+        datos["cantidad"] = int(fila.get("cantidad"))
+        ProductoValidator.validate_cantidad(datos["cantidad"])
+    except PydanticCustomError as e:
+        errores.append(f"cantidad: {e}")
+    except (TypeError, ValueError):
+        errores.append("cantidad: debe ser un número entero")
+
+    try:
+        datos["categoria_id"] = int(fila.get("categoria_id"))
+        if datos["categoria_id"] not in categorias_validas:
+            errores.append(f"categoria_id: la categoría {datos['categoria_id']} no existe")
+    except (TypeError, ValueError):
+        errores.append("categoria_id: debe ser un número entero")
+
+    imagenes = fila.get("imagenes") or []
+    if isinstance(imagenes, str):
+        imagenes = [i.strip() for i in imagenes.split(";") if i.strip()]
+    faltantes = [i for i in imagenes if i not in imagenes_disponibles]
+    if faltantes:
+        errores.append(f"imagenes: no están en el archivo de imágenes: {faltantes}")
+    datos["imagenes"] = imagenes
+
+    return datos, errores
+
+
+def _extraer_imagenes_fila(zip_path: Optional[str], nombres: list) -> list:
+    """
+    Copia las imágenes de una fila desde el ZIP a BLOBS_TMP_DIR calculando su hash.
+    Devuelve [(ruta, hash, convertir)]. Cada llamada abre su propio ZipFile.
+    """
+    extraidas = []
+    if not nombres:
+        return extraidas
+    tmp_path = None
+    try:
+        with zipfile.ZipFile(zip_path) as archivo_zip:
+            for nombre in nombres:
+                tmp_path = BLOBS_TMP_DIR / f"{uuid.uuid4().hex}.subida"
+                with archivo_zip.open(nombre) as origen:
+                    _, digest = copy_in_chunks(origen, tmp_path)
+                extraidas.append((tmp_path, digest, Path(nombre).suffix.lower() != ".webp"))
+    except BaseException:
+        for path in [p for p, _, _ in extraidas] + [tmp_path]:
+            if path:
+                path.unlink(missing_ok=True)
+        raise
+    return extraidas
+
+
+async def _procesar_imagenes_fila(zip_path: Optional[str], nombres: list) -> tuple:
+    """
+    Publica las imágenes de una fila en el almacén por contenido (las repetidas no
+    se vuelven a codificar) con sus variantes. Devuelve (URLs, {URL: variantes}).
+    """
+    loop = asyncio.get_running_loop()
+    extraidas = await loop.run_in_executor(get_image_executor(), _extraer_imagenes_fila, zip_path, nombres)
+    urls, variantes = [], {}
+    try:
+        for tmp_path, digest, convertir in extraidas:
+            url, por_ancho = await store_blob(tmp_path, digest, convertir)
+            urls.append(url)
+            variantes[url] = por_ancho
+    finally:
+        for tmp_path, _, _ in extraidas:
+            tmp_path.unlink(missing_ok=True)
+    return urls, variantes
+
+
+async def _insertar_lote(db: AsyncSession, filas: list) -> None:
+    """Carga un lote con COPY si el driver es asyncpg; si no, con un INSERT de varias filas."""
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    if hasattr(driver, "copy_records_to_table"):
+        registros = [
+            tuple(
+                json.dumps(f[c]) if c in JSON_COLUMNS and f[c] is not None else f[c]
+                for c in COPY_COLUMNS
+            )
+            for f in filas
+        ]
+        await driver.copy_records_to_table("productos", records=registros, columns=COPY_COLUMNS)
+    else:
+        await db.execute(insert(Producto), filas)
+
+
+async def _procesar_lote(db: AsyncSession, lote: list, zip_path: Optional[str], resumen: dict) -> None:
+    resultados = await asyncio.gather(*[
+        _procesar_imagenes_fila(zip_path, datos["imagenes"]) for _, datos in lote
+    ], return_exceptions=True)
+
+    # Si una fila falla, sus blobs ya publicados se quedan: pueden ser compartidos.
+    filas = []
+    for (numero, datos), resultado in zip(lote, resultados):
+        if isinstance(resultado, Exception):
+            resumen["errores"].append({"fila": numero, "errores": [f"imagenes: {resultado}"]})
+            continue
+        urls, variantes = resultado
+        fila = {c: datos[c] for c in COPY_COLUMNS if c not in JSON_COLUMNS}
+        fila["image_url"] = urls or None
+        fila["image_variants"] = variantes or None
+        filas.append((numero, fila))
+
+    if not filas:
+        return
+    try:
+        await _insertar_lote(db, [f for _, f in filas])
+        await ajustar_referencias(db, [], [url for _, f in filas for url in f["image_url"] or []])
+        await db.commit()
+        resumen["insertados"] += len(filas)
+        return
+    except Exception:
+        await db.rollback()
+
+    # El lote falló completo: se reintenta fila por fila para informar qué filas fallan.
+    for numero, fila in filas:
+        try:
+            await db.execute(insert(Producto), [fila])
+            await ajustar_referencias(db, [], fila["image_url"])
+            await db.commit()
+            resumen["insertados"] += 1
+        except Exception as e:
+            await db.rollback()
+            resumen["errores"].append({"fila": numero, "errores": [str(getattr(e, "orig", e))]})
+
+
+async def importar_productos(db: AsyncSession, archivo: TextIO, formato: str,
+                             zip_path: Optional[str] = None,
+                             batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """
+    Importa productos desde un archivo CSV o NDJSON (columnas: nombre, descripcion,
+    precio, cantidad, categoria_id, imagenes) y, opcionalmente, un ZIP con las
+    imágenes referenciadas en "imagenes" (separadas por ';' en CSV).
+    Las filas válidas se cargan por lotes; las inválidas se informan por número de fila.
+    """
+    snapshot = await ensure_categorias(db)
+    categorias_validas = set(snapshot.por_id)
+    imagenes_disponibles = set()
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as archivo_zip:
+            imagenes_disponibles = {n for n in archivo_zip.namelist() if not n.endswith("/")}
+
+    resumen = {"insertados": 0, "errores": []}
+    lote = []
+    for numero, fila in leer_filas(archivo, formato):
+        if isinstance(fila, Exception):
+            resumen["errores"].append({"fila": numero, "errores": [str(fila)]})
+            continue
+        datos, errores = validar_fila(fila, categorias_validas, imagenes_disponibles)
+        if errores:
+            resumen["errores"].append({"fila": numero, "errores": errores})
+            continue
+        lote.append((numero, datos))
+        if len(lote) >= batch_size:
+            await _procesar_lote(db, lote, zip_path, resumen)
+            lote = []
+    if lote:
+        await _procesar_lote(db, lote, zip_path, resumen)
+
+    if resumen["insertados"]:
+        bump_catalog_version()
+    return resumen
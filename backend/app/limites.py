@@ -0,0 +1,48 @@
+from typing import Iterable
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+
+class LimiteCuerpoMiddleware:
+    """
+    Rechaza con 413 las solicitudes cuyo cuerpo supera max_bytes antes de que
+    Starlette termine de leer el formulario: primero por Content-Length y, si no
+    viene (transferencia por bloques), contando los bytes a medida que llegan.
+    """
+
+    def __init__(self, app, max_bytes: int, exentas: Iterable[str] = ()):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.exentas = tuple(exentas)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("POST", "PUT", "PATCH")
+            or scope["path"].startswith(self.exentas)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": self._mensaje()})
+            await response(scope, receive, send)
+            return
+
+        recibidos = 0
+
+        async def receive_limitado():
+            nonlocal recibidos
+            message = await receive()
+            if message["type"] == "http.request":
+                recibidos += len(message.get("body", b""))
+                if recibidos > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._mensaje())
+            return message
+
+        await self.app(scope, receive_limitado, send)
+
+    def _mensaje(self) -> str:
+        return f"La solicitud supera el máximo de {self.max_bytes // (1024 * 1024)} MB"
@@ -4,20 +4,29 @@ from fastapi import FastAPI, Request, HTTPException, Body
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import smtplib
 import re
+from contextlib import asynccontextmanager
 
-from app.config import FRONTEND_URL, NGROK_TOKEN, EMAIL_PASS, EMAIL_USER
+from app.config import FRONTEND_URL, NGROK_TOKEN, EMAIL_PASS, EMAIL_USER, UPLOAD_MAX_REQUEST_BYTES
+from app.database import async_session
+from app.registro_categorias import refresh_categorias
+from app.imagenes import shutdown_image_executor
+from app.almacenamiento import almacen
+from app.cola_imagenes import iniciar_workers, detener_workers
+from app.almacen_carritos import carritos
+from app.limites import LimiteCuerpoMiddleware
+from app.estaticos import UploadsStaticFiles, redireccion_uploads
 from app.routes import usuarios, categorias, productos
 from app.routes.authentication import router as auth_router
 from app.routes.authGoogle import router as google_auth_router
 from app.routes.favorites import router as favorites_router
 from app.routes.carrito import router as carrito_router
 from app.routes.pagos import router as pagos_router
+from app.routes.imagenes import router as imagenes_router
 
 load_dotenv()
 
@@ -30,9 +39,32 @@ if os.getenv("DEVELOPMENT", "false").lower() in ["true", "1", "yes"]:
     os.environ["MERCADOPAGO_NOTIFICATION_URL"] = tunnel.public_url + "/api/pagos/notification"
     print("Ngrok tunnel started:", tunnel.public_url)
 
-app = FastAPI(title="Miuvuu API", version="0.1.0", debug=True)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Snapshot de categorías usado por el listado de productos y GET /api/categorias
+    async with async_session() as db:
+        await refresh_categorias(db)
+    # Workers de la cola de imágenes; retoman los trabajos que quedaron de antes del reinicio.
+    iniciar_workers()
+    # Volcador de carritos (solo con CART_STORE=memoria o redis); al detenerse vuelca lo pendiente.
+    await carritos.iniciar()
+    yield
+    await carritos.detener()
+    await detener_workers()
+    shutdown_image_executor()
+    await almacen.cerrar()
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app = FastAPI(title="Miuvuu API", version="0.1.0", debug=True, lifespan=lifespan)
+
+# Con el backend local los archivos se sirven desde la carpeta; con uno remoto, /uploads redirige al bucket.
+if almacen.local:
+    app.mount("/uploads", UploadsStaticFiles(directory=almacen.raiz), name="uploads")
+else:
+    app.include_router(redireccion_uploads)
+
+# Se registra antes que CORS para que las respuestas 413 también lleven sus cabeceras.
+# La importación masiva queda fuera: su ZIP de imágenes puede ser mucho más grande.
+app.add_middleware(LimiteCuerpoMiddleware, max_bytes=UPLOAD_MAX_REQUEST_BYTES, exentas=("/api/productos/import",))
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +72,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # Sin esto el navegador oculta el ETag de carrito y favoritos, que el cliente
+    # devuelve en If-Match.
+    expose_headers=["ETag"],
 )
 
 app.include_router(usuarios.router, prefix="/api", tags=["usuarios"])
@@ -50,6 +85,7 @@ app.include_router(google_auth_router, prefix="/api/auth/google", tags=["autenti
 app.include_router(favorites_router, prefix="/api", tags=["favoritos"])
 app.include_router(carrito_router, prefix="/api", tags=["carrito"])
 app.include_router(pagos_router, prefix="/api/pagos", tags=["pagos"])
+app.include_router(imagenes_router, prefix="/api", tags=["imagenes"])
 
 # Rutas básicas
 @app.get("/")
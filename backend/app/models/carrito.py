@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, CheckConstraint, Index, func
+from app.database import Base
+
+class ItemCarrito(Base):
+    """Línea del carrito de un usuario; reemplaza al arreglo JSONB usuarios.carrito."""
+    __tablename__ = "cart_items"
+
+    usuario_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    producto_id = Column(Integer, ForeignKey("productos.id", ondelete="CASCADE"), primary_key=True)
+    # "" cuando la línea no tiene color o talla (carritos creados desde /usuarios)
+    color = Column(String(50), primary_key=True, server_default="")
+    talla = Column(String(20), primary_key=True, server_default="")
+    cantidad = Column(Integer, nullable=False)
+    # Orden de las líneas en el carrito; no cambia al sumar cantidad a una línea existente.
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        CheckConstraint("cantidad > 0", name="ck_cart_items_cantidad"),
+        # Para el ON DELETE CASCADE al eliminar productos
+        Index("ix_cart_items_producto_id", "producto_id"),
+    )
+
+    def a_dict(self) -> dict:
+        return {"producto_id": self.producto_id, "cantidad": self.cantidad, "color": self.color, "talla": self.talla}
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
+from app.database import Base
+
+class Imagen(Base):
+    """Blob del almacén por contenido (uploads/blobs): una fila por hash de los bytes subidos."""
+    __tablename__ = "imagenes"
+
+    hash = Column(String(64), primary_key=True)
+    url = Column(String, unique=True, nullable=False)
+    # Apariciones de la URL en productos.image_url; con 0 el blob se elimina.
+    referencias = Column(Integer, nullable=False, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TrabajoImagen(Base):
+    """Imagen subida pendiente de codificar; la procesan los workers de app.cola_imagenes."""
+    __tablename__ = "trabajos_imagenes"
+
+    id = Column(Integer, primary_key=True)
+    producto_id = Column(Integer, ForeignKey("productos.id", ondelete="CASCADE"), nullable=False, index=True)
+    # pendiente | procesando | listo | error
+    estado = Column(String(20), nullable=False, server_default="pendiente")
+    archivo = Column(String, nullable=False)
+    hash = Column(String(64), nullable=False)
+    convertir = Column(Boolean, nullable=False, server_default="true")
+    url = Column(String, nullable=True)
+    variantes = Column(JSONB, nullable=True)
+    intentos = Column(Integer, nullable=False, server_default="0")
+    error = Column(String, nullable=True)
+    tomado_en = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_trabajos_imagenes_estado_id", "estado", "id"),
+    )
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, func
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Computed, Index, func
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import deferred
 from app.database import Base
 
 class Producto(Base):
@@ -12,4 +13,34 @@ class Producto(Base):
     cantidad = Column(Integer, nullable=False)
     categoria_id = Column(Integer, ForeignKey("categorias.id"), nullable=False)
     image_url = Column(JSONB, nullable=True) 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    # {URL de la imagen: {ancho: URL de la variante}}, incluye el original con su ancho real
+    image_variants = Column(JSONB, nullable=True)
+    # listo | procesando (hay imágenes en la cola) | error (alguna imagen falló)
+    image_status = Column(String(20), nullable=False, server_default="listo")
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Generada por PostgreSQL (ver migración de búsqueda); no se escribe desde la aplicación.
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('es_unaccent', coalesce(nombre, '')), 'A') || "
+        "setweight(to_tsvector('es_unaccent', coalesce(descripcion, '')), 'B')",
+        persisted=True
+    )))
+
+    __table_args__ = (
+        Index("ix_productos_search_vector", "search_vector", postgresql_using="gin"),
+        # Similitud por trigramas del nombre (ver migración aea82d9ceca4); misma expresión
+        # que usa search_expressions para que el planificador la elija.
+        Index(
+            "ix_productos_nombre_trgm", func.f_unaccent(func.lower(nombre)).label("nombre_unaccent"),
+            postgresql_using="gin", postgresql_ops={"nombre_unaccent": "gin_trgm_ops"},
+        ),
+        # Ordenamientos del listado (ver migración 2eb38e448bfe)
+        Index("ix_productos_categoria_id_id", "categoria_id", "id"),
+        Index("ix_productos_categoria_precio_id", "categoria_id", "precio", "id"),
+        Index("ix_productos_categoria_nombre_id", "categoria_id", "nombre", "id"),
+        Index("ix_productos_categoria_created_at_id", "categoria_id", "created_at", "id"),
+        Index("ix_productos_precio_id", "precio", "id"),
+        Index("ix_productos_nombre_id", "nombre", "id"),
+        Index("ix_productos_created_at_id", "created_at", "id"),
+        # Búsqueda de URLs del reconciliador de huérfanos (ver migración e3f9a6b2c8d1)
+        Index("ix_productos_image_url", "image_url", postgresql_using="gin"),
+    )
\ No newline at end of file
@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, String, ARRAY
-from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship 
 from app.database import Base
+from app.models.carrito import ItemCarrito
 
 class Usuario(Base):
     __tablename__ = "usuarios"
@@ -13,6 +13,18 @@ class Usuario(Base):
     metodo_pago = Column("metodo_pago", ARRAY(String(100)))
     rol = Column(String(50))
     favoritos = Column(ARRAY(Integer), default=[])
-    carrito = Column(JSONB, default=[])
+    # Versiones para la concurrencia optimista (ETag / If-Match de favoritos y carrito):
+    # toda escritura las incrementa, y las de favoritos son UPDATE ... WHERE favoritos_version = :v.
+    favoritos_version = Column(Integer, nullable=False, server_default="0")
+    carrito_version = Column(Integer, nullable=False, server_default="0")
 
-    pedidos = relationship("Pedido", back_populates="usuario")
\ No newline at end of file
+    pedidos = relationship("Pedido", back_populates="usuario")
+    # Solo lectura: el carrito se modifica con app.crud.carrito (upserts atómicos por línea).
+    items_carrito = relationship(
+        ItemCarrito, lazy="selectin", viewonly=True,
+        order_by=(ItemCarrito.created_at, ItemCarrito.producto_id),
+    )
+
+    @property
+    def carrito(self) -> list:
+        return [item.a_dict() for item in self.items_carrito]
@@ -0,0 +1,252 @@
+"""
+Limpieza incremental de imágenes huérfanas en uploads.
+
+Recorre cada árbol del almacenamiento en orden de clave y en lotes. Por cada lote
+consulta a la base qué archivos siguen referenciados, así que la memoria no
+crece con el tamaño del árbol. Los archivos sin referencias y con más de
+ORPHAN_GRACE_HOURS desde su última modificación se mueven al prefijo de
+cuarentena o se eliminan. Después de cada lote se guarda un checkpoint con la
+última clave procesada, de modo que una ejecución interrumpida continúa donde quedó.
+
+Árboles:
+- productos: CarpetasDeProductos/. Una imagen está referenciada si su URL
+  está en productos.image_url. Una variante <nombre>_w<ancho>.webp lo está si lo
+  está su original.
+- blobs: blobs/. Un blob está referenciado si su hash tiene fila en imagenes o
+  un trabajo en trabajos_imagenes que todavía no se agregó al producto.
+- spool: spool/. Un archivo está referenciado si algún trabajo de la cola lo usa.
+- tmp: el directorio local de trabajo de la codificación (uploads/blobs/tmp) de
+  este nodo. Son restos de codificaciones interrumpidas; siempre se eliminan.
+"""
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import String, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.almacenamiento import Objeto, almacen, recorrer
+from app.imagenes import BLOBS_PREFIX, BLOBS_TMP_DIR, PRODUCTS_PREFIX, SPOOL_PREFIX
+
+ARBOLES = {
+    "productos": PRODUCTS_PREFIX,
+    "blobs": BLOBS_PREFIX,
+    "spool": SPOOL_PREFIX,
+    "tmp": None,
+}
+
+VARIANTE = re.compile(r"^(?P<base>.+)_w\d+\.webp$")
+
+_URLS_REFERENCIADAS = text(
+    "SELECT DISTINCT e FROM productos, jsonb_array_elements_text(image_url) AS e "
+    "WHERE jsonb_typeof(image_url) = 'array' AND image_url ?| :urls AND e = ANY(:urls)"
+).bindparams(bindparam("urls", type_=ARRAY(String)))
+
+_HASHES_REFERENCIADOS = text(
+    "SELECT hash FROM imagenes WHERE hash = ANY(:hashes) "
+    "UNION SELECT hash FROM trabajos_imagenes WHERE hash = ANY(:hashes)"
+).bindparams(bindparam("hashes", type_=ARRAY(String)))
+
+_ARCHIVOS_EN_COLA = text(
+    "SELECT archivo FROM trabajos_imagenes WHERE archivo = ANY(:archivos)"
+).bindparams(bindparam("archivos", type_=ARRAY(String)))
+
+
+async def _listar(arbol: str, desde: Optional[str]):
+    """Objetos de un árbol en orden, a partir del siguiente a `desde`."""
+    if arbol == "tmp":
+        for partes in recorrer(BLOBS_TMP_DIR, tuple(desde.split("/")) if desde else ()):
+            try:
+                st = BLOBS_TMP_DIR.joinpath(*partes).stat()
+            except FileNotFoundError:
+                continue
+            yield Objeto("/".join(partes), st.st_size, str(st.st_mtime_ns), st.st_mtime)
+        return
+    async for objeto in almacen.listar(ARBOLES[arbol], desde):
+        # El directorio local de trabajo vive bajo blobs/ y tiene su propio árbol.
+        if arbol == "blobs" and objeto.clave.startswith(f"{BLOBS_PREFIX}tmp/"):
+            continue
+        yield objeto
+
+
+async def verificar_urls(db: AsyncSession) -> List[str]:
+    """
+    Problemas que harían ver como huérfanas imágenes en uso: la comparación con
+    image_url es exacta y espera URLs relativas (/uploads/...) dentro de un arreglo.
+    """
+    result = await db.execute(text(
+        "SELECT count(*) FILTER (WHERE jsonb_typeof(image_url) <> 'array'), "
+        "(SELECT count(*) FROM productos, jsonb_array_elements_text(image_url) AS e "
+        " WHERE jsonb_typeof(image_url) = 'array' AND e NOT LIKE '/uploads/%') "
+        "FROM productos WHERE image_url IS NOT NULL"
+    ))
+    no_arreglo, absolutas = result.one()
+    problemas = []
+    if no_arreglo:
+        problemas.append(f"{no_arreglo} productos tienen image_url que no es un arreglo JSON")
+    if absolutas:
+        problemas.append(f"{absolutas} URLs de image_url no empiezan con /uploads/")
+    return problemas
+
+
+async def _referenciados(db: AsyncSession, arbol: str, claves: List[str]) -> set:
+    """Subconjunto de claves que siguen en uso."""
+    if arbol == "productos":
+        candidatas = {}
+        for clave in claves:
+            candidatas.setdefault(almacen.url(clave), set()).add(clave)
+            carpeta, _, nombre = clave.rpartition("/")
+            variante = VARIANTE.match(nombre)
+            if variante:
+                candidatas.setdefault(almacen.url(f"{carpeta}/{variante['base']}.webp"), set()).add(clave)
+        result = await db.execute(_URLS_REFERENCIADAS, {"urls": list(candidatas)})
+        return {clave for url in result.scalars() for clave in candidatas[url]}
+
+    if arbol == "blobs":
+        por_hash = {}
+        for clave in claves:
+            nombre = clave.rsplit("/", 1)[-1]
+            por_hash.setdefault(nombre.split(".", 1)[0].split("_", 1)[0], set()).add(clave)
+        result = await db.execute(_HASHES_REFERENCIADOS, {"hashes": list(por_hash)})
+        return {clave for digest in result.scalars() for clave in por_hash[digest]}
+
+    if arbol == "spool":
+        result = await db.execute(_ARCHIVOS_EN_COLA, {"archivos": claves})
+        return set(result.scalars())
+
+    return set()
+
+
+async def _retirar(arbol: str, clave: str, modo: str, cuarentena: str) -> None:
+    if arbol == "tmp":
+        BLOBS_TMP_DIR.joinpath(clave).unlink(missing_ok=True)
+    elif modo == "eliminar":
+        await almacen.delete(clave)
+    else:
+        await almacen.mover(clave, f"{cuarentena}/{clave}")
+
+
+def _podar_directorios(ruta: Path, raiz: Path) -> int:
+    """Elimina los directorios que quedaron vacíos entre ruta y raiz (sin incluirla)."""
+    eliminados = 0
+    directorio = ruta.parent
+    while directorio != raiz and raiz in directorio.parents:
+        try:
+            directorio.rmdir()
+        except OSError:
+            break
+        eliminados += 1
+        directorio = directorio.parent
+    return eliminados
+
+
+def leer_checkpoint(path: Path) -> dict:
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def guardar_checkpoint(path: Path, datos: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(datos, ensure_ascii=False, indent=2))
+    os.replace(tmp, path)
+
+
+async def reconciliar_arbol(db: AsyncSession, arbol: str, *, modo: str, dry_run: bool, gracia_horas: float,
+                            lote: int, cuarentena: str, checkpoint: Optional[Path] = None,
+                            estado: Optional[dict] = None, informar=print) -> dict:
+    """
+    Reconcilia un árbol de uploads. `estado` es lo guardado en el checkpoint para
+    este árbol ({"ultimo": clave, "metricas": {...}}); se actualiza y se persiste
+    tras cada lote salvo en dry-run.
+    """
+    estado = estado or {}
+    metricas = estado.get("metricas") or {
+        "revisados": 0, "referenciados": 0, "en_gracia": 0, "huerfanos": 0,
+        "bytes_huerfanos": 0, "directorios_eliminados": 0, "segundos": 0.0, "segundos_db": 0.0,
+    }
+    limite = time.time() - gracia_horas * 3600
+    objetos = _listar(arbol, estado.get("ultimo"))
+    # Las carpetas de producto y de trabajo quedan vacías al retirar su último archivo.
+    # Las de blobs/<hh> se reutilizan entre subidas, así que no se eliminan.
+    if arbol == "tmp":
+        podar = BLOBS_TMP_DIR
+    elif arbol == "productos" and almacen.local:
+        podar = almacen.ruta(PRODUCTS_PREFIX)
+    else:
+        podar = None
+
+    terminado = False
+    while not terminado:
+        inicio = time.perf_counter()
+        pagina = []
+        async for objeto in objetos:
+            pagina.append(objeto)
+            if len(pagina) >= lote:
+                break
+        else:
+            terminado = True
+        if not pagina:
+            break
+
+        # Solo se consulta a la base por los archivos fuera del período de gracia.
+        viejos = []
+        for objeto in pagina:
+            if objeto.modificado > limite:
+                metricas["en_gracia"] += 1
+            else:
+                viejos.append(objeto)
+
+        inicio_db = time.perf_counter()
+        usados = await _referenciados(db, arbol, [o.clave for o in viejos]) if viejos else set()
+        await db.rollback()
+        metricas["segundos_db"] += time.perf_counter() - inicio_db
+
+        huerfanos = [o for o in viejos if o.clave not in usados]
+        metricas["referenciados"] += len(viejos) - len(huerfanos)
+        for objeto in huerfanos:
+            metricas["huerfanos"] += 1
+            metricas["bytes_huerfanos"] += objeto.tamano
+            if dry_run:
+                informar(f"[dry-run] {arbol}: {objeto.clave} ({objeto.tamano} bytes)")
+                continue
+            try:
+                await _retirar(arbol, objeto.clave, modo, cuarentena)
+            except FileNotFoundError:
+                continue
+            if podar is not None:
+                ruta = BLOBS_TMP_DIR / objeto.clave if arbol == "tmp" else almacen.ruta(objeto.clave)
+                metricas["directorios_eliminados"] += _podar_directorios(ruta, podar)
+
+        metricas["revisados"] += len(pagina)
+        metricas["segundos"] += time.perf_counter() - inicio
+        estado = {"ultimo": pagina[-1].clave, "metricas": metricas}
+        if checkpoint and not dry_run:
+            datos = leer_checkpoint(checkpoint)
+            datos[arbol] = estado
+            guardar_checkpoint(checkpoint, datos)
+        informar(resumen_metricas(arbol, metricas, pagina[-1].clave))
+
+    estado["terminado"] = True
+    estado["metricas"] = metricas
+    if checkpoint and not dry_run:
+        datos = leer_checkpoint(checkpoint)
+        datos[arbol] = estado
+        guardar_checkpoint(checkpoint, datos)
+    return metricas
+
+
+def resumen_metricas(arbol: str, metricas: dict, ultimo=None) -> str:
+    segundos = metricas["segundos"] or 1e-9
+    texto = (
+        f"{arbol}: {metricas['revisados']} revisados ({metricas['revisados'] / segundos:.0f} archivos/s), "
+        f"{metricas['huerfanos']} huérfanos ({metricas['bytes_huerfanos'] / 1024 / 1024:.1f} MB), "
+        f"{metricas['en_gracia']} en gracia, DB {metricas['segundos_db'] / segundos:.0%} del tiempo"
+    )
+    if ultimo:
+        texto += f" | último: {ultimo}"
+    return texto
@@ -0,0 +1,62 @@
+import time
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.cache import bump_catalog_version
+from app.config import CATEGORIAS_SNAPSHOT_TTL
+from app.models.categorias import Categoria
+
+
+class CategoriasSnapshot:
+    """Copia inmutable de la tabla categorias (es pequeña y casi no cambia)."""
+
+    def __init__(self, categorias: List[dict], version: int):
+        self.categorias = categorias
+        self.version = version
+        self.cargado_en = time.monotonic()
+        self.por_id = {c["id"]: c for c in categorias}
+
+    def get(self, categoria_id: int) -> Optional[dict]:
+        return self.por_id.get(categoria_id)
+
+    def ids(self, categoria: str = None, genero: str = None) -> List[int]:
+        """IDs de las categorías que cumplen los filtros del listado de productos."""
+        return [
+            c["id"] for c in self.categorias
+            if (not categoria or c["nombre"] == categoria) and (not genero or c["genero"] == genero)
+        ]
+
+
+_snapshot = CategoriasSnapshot([], version=0)
+_cargado = False
+
+
+def get_snapshot() -> CategoriasSnapshot:
+    return _snapshot
+
+
+async def refresh_categorias(db: AsyncSession) -> CategoriasSnapshot:
+    global _snapshot, _cargado
+    result = await db.execute(select(Categoria).order_by(Categoria.id))
+    categorias = [
+        {"id": c.id, "nombre": c.nombre, "descripcion": c.descripcion, "genero": c.genero}
+        for c in result.scalars().all()
+    ]
+    if _cargado and categorias != _snapshot.categorias:
+        # Cambios hechos por otro proceso: las respuestas en caché ya no sirven.
+        bump_catalog_version()
+    _snapshot = CategoriasSnapshot(categorias, version=_snapshot.version + 1)
+    _cargado = True
+    return _snapshot
+
+
+async def ensure_categorias(db: AsyncSession) -> CategoriasSnapshot:
+    """
+    Devuelve el snapshot vigente. Solo consulta la BD si aún no se cargó o si
+    superó el TTL (cambios hechos por otro proceso).
+    """
+    if not _cargado or time.monotonic() - _snapshot.cargado_en > CATEGORIAS_SNAPSHOT_TTL:
+        return await refresh_categorias(db)
+    return _snapshot
@@ -1,78 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.models.usuarios import Usuario
-from app.models.productos import Producto
-from pydantic import BaseModel
-from sqlalchemy.future import select
-from sqlalchemy import update
+from app.config import CART_BATCH_MAX_OPERATIONS
+from app.almacen_carritos import carritos
+from app.helpers import etag_version
+from app.routes.dependencias import version_if_match
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Literal, Optional
 
 router = APIRouter(tags=['Carrito'])
 
 class CartItem(BaseModel):
     user_id: int
-    cantidad: int = 1
-    color: str  
-    talla: str 
+    cantidad: int = Field(1, ge=1)
+    color: str = Field(..., max_length=50)
+    talla: str = Field(..., max_length=20)
 
-async def verify_product_exists(product_id: int, db: AsyncSession):
-    producto = await db.execute(select(Producto).filter(Producto.id == product_id))
-    return producto.scalar_one_or_none()
+class CartOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    producto_id: int
+    color: str = Field(..., max_length=50)
+    talla: str = Field(..., max_length=20)
+    cantidad: Optional[int] = Field(None, ge=1)
+
+    @model_validator(mode="after")
+    def validar_cantidad(self):
+        if self.op != "remove" and self.cantidad is None:
+            raise ValueError(f"La operación '{self.op}' requiere 'cantidad'")
+        return self
+
+class CartBatch(BaseModel):
+    operaciones: List[CartOperation] = Field(..., max_length=CART_BATCH_MAX_OPERATIONS)
+
+@router.get("/carrito/store/stats", summary="Métricas del almacén de carritos (pendientes y atraso del volcado)")
+async def estadisticas_carritos():
+    return await carritos.stats()
 
 @router.get("/carrito/{user_id}", summary="Obtener carrito del usuario")
-async def get_cart(user_id: int, db: AsyncSession = Depends(get_db)):
-    user = await db.execute(select(Usuario).filter(Usuario.id == user_id))
-    user = user.scalar_one_or_none()
-    if not user:
+async def get_cart(
+    user_id: int,
+    response: Response,
+    expand: Optional[str] = Query(
+        default=None,
+        pattern="^products$",
+        description="products: incluye nombre, precio, imagen y stock de cada línea, subtotales y total"
+    ),
+    db: AsyncSession = Depends(get_db)
+):
+    # El ETag es la versión del carrito; enviándolo como If-Match, las mutaciones
+    # responden 412 en vez de aplicarse sobre un carrito que cambió en otra pestaña.
+    if expand == "products":
+        resultado = await carritos.obtener_detallado(db, user_id)
+        if resultado is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        detalle, version = resultado
+        response.headers["ETag"] = etag_version(version)
+        return detalle
+
+    resultado = await carritos.obtener(db, user_id)
+    if resultado is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return {"carrito": user.carrito}
+    carrito, version = resultado
+    response.headers["ETag"] = etag_version(version)
+    return {"carrito": carrito}
 
 @router.post("/carrito/agregar/{product_id}", summary="Agregar producto al carrito")
 async def add_to_cart(
     product_id: int,
     payload: dict,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
     db: AsyncSession = Depends(get_db)
 ):
     try:
         cart_item = CartItem(**payload["cart_item"])
-        producto = await verify_product_exists(product_id, db)
-        if not producto:
-            raise HTTPException(status_code=404, detail="Producto no encontrado")
-        
-        user = await db.execute(select(Usuario).filter(Usuario.id == cart_item.user_id))
-        user = user.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        nuevo_carrito = user.carrito.copy() if user.carrito else []
-        encontrado = False
-        
-        for item in nuevo_carrito:
-            if (
-                item["producto_id"] == product_id and
-                item["color"] == cart_item.color and
-                item["talla"] == cart_item.talla
-            ):
-                item["cantidad"] += cart_item.cantidad
-                encontrado = True
-                break
-        
-        if not encontrado:
-            nuevo_carrito.append({
-                "producto_id": product_id,
-                "cantidad": cart_item.cantidad,
-                "color": cart_item.color,
-                "talla": cart_item.talla 
-            })
-        
-        await db.execute(
-            update(Usuario)
-            .where(Usuario.id == cart_item.user_id)
-            .values(carrito=nuevo_carrito)
+        # Con CART_STORE=postgres es un solo INSERT ... ON CONFLICT; la existencia del
+        # producto y del usuario la validan las FK.
+        nuevo_carrito, version = await carritos.agregar(
+            db, cart_item.user_id, product_id, cart_item.color, cart_item.talla, cart_item.cantidad, if_match
         )
-        await db.commit()
+        response.headers["ETag"] = etag_version(version)
         
         return {"message": "Producto agregado al carrito", "carrito": nuevo_carrito}
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,76 +94,79 @@ async def add_to_cart(
 async def remove_from_cart(
     product_id: int,
     payload: dict,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
     db: AsyncSession = Depends(get_db)
 ):
     try:
         cart_item = CartItem(**payload["cart_item"])
-        user = await db.execute(select(Usuario).filter(Usuario.id == cart_item.user_id))
-        user = user.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        nuevo_carrito = [
-            item for item in user.carrito
-            if not (
-                item["producto_id"] == product_id and
-                item["color"] == cart_item.color and
-                item["talla"] == cart_item.talla
-            )
-        ]
-        
-        await db.execute(
-            update(Usuario)
-            .where(Usuario.id == cart_item.user_id)
-            .values(carrito=nuevo_carrito)
+        nuevo_carrito, version = await carritos.eliminar(
+            db, cart_item.user_id, product_id, cart_item.color, cart_item.talla, if_match
         )
-        await db.commit()
+        response.headers["ETag"] = etag_version(version)
         
         return {"message": "Producto eliminado del carrito", "carrito": nuevo_carrito}
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
 @router.put("/carrito/actualizar/{product_id}", summary="Actualizar cantidad de un producto en el carrito")
 async def update_cart(
     product_id: int,
     payload: dict,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
     db: AsyncSession = Depends(get_db)
 ):
     try:
         cart_item = CartItem(**payload["cart_item"])
-        
-        producto = await verify_product_exists(product_id, db)
-        if not producto:
-            raise HTTPException(status_code=404, detail="Producto no encontrado")
-        
-        user = await db.execute(select(Usuario).filter(Usuario.id == cart_item.user_id))
-        user = user.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        nuevo_carrito = []
-        encontrado = False
-        for item in user.carrito:
-            if (
-                item["producto_id"] == product_id and
-                item["color"] == cart_item.color and
-                item["talla"] == cart_item.talla
-            ):
-                item["cantidad"] = cart_item.cantidad
-                encontrado = True
-            nuevo_carrito.append(item)
-        
-        if not encontrado:
-            raise HTTPException(status_code=404, detail="Producto no encontrado en el carrito")
-        
-        await db.execute(
-            update(Usuario)
-            .where(Usuario.id == cart_item.user_id)
-            .values(carrito=nuevo_carrito)
+        resultado = await carritos.fijar(
+            db, cart_item.user_id, product_id, cart_item.color, cart_item.talla, cart_item.cantidad, if_match
         )
-        await db.commit()
+        if resultado is None:
+            raise HTTPException(status_code=404, detail="Producto no encontrado en el carrito")
+        nuevo_carrito, version = resultado
+        response.headers["ETag"] = etag_version(version)
         
         return {"message": "Cantidad actualizada correctamente", "carrito": nuevo_carrito}
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/carrito/{user_id}/batch", summary="Aplicar varias operaciones al carrito en una transacción")
+async def batch_cart(
+    user_id: int,
+    batch: CartBatch,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Aplica en orden operaciones add (suma), set (fija la cantidad, creando la
+    línea si no existe) y remove. Si algún producto no existe no se aplica ninguna.
+    Con If-Match, si el carrito cambió desde esa versión tampoco (412).
+    """
+    try:
+        nuevo_carrito, version = await carritos.aplicar_lote(
+            db, user_id, [op.model_dump() for op in batch.operaciones], if_match
+        )
+        response.headers["ETag"] = etag_version(version)
+
+        return {
+            "message": "Carrito actualizado",
+            "operaciones": len(batch.operaciones),
+            "carrito": nuevo_carrito,
+        }
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
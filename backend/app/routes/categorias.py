@@ -2,23 +2,24 @@ from fastapi import APIRouter, Depends, HTTPException
 from app.database import get_db
 from app.schemas.categorias import Categoria, CategoriaCreate
 from app.crud.categorias import (
-    get_categorias,
-    get_categoria,
     create_categoria,
     delete_categoria,
     update_categoria
 )
+from app.registro_categorias import ensure_categorias
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/categorias", tags=["categorias"])
 
 @router.get("/", response_model=list[Categoria])
 async def listar_categorias(db: AsyncSession = Depends(get_db)):
-    return await get_categorias(db)
+    snapshot = await ensure_categorias(db)
+    return snapshot.categorias
 
 @router.get("/{categoria_id}", response_model=Categoria)
 async def obtener_categoria(categoria_id: int, db: AsyncSession = Depends(get_db)):
-    categoria = await get_categoria(db, categoria_id)
+    snapshot = await ensure_categorias(db)
+    categoria = snapshot.get(categoria_id)
     if not categoria:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     return categoria
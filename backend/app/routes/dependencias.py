@@ -0,0 +1,13 @@
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from app.helpers import parse_if_match
+
+
+def version_if_match(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """Dependencia de los endpoints versionados: If-Match malformado es un 400."""
+    try:
+        return parse_if_match(if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
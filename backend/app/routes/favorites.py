@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.models.usuarios import Usuario as User
-from app.models.productos import Producto 
+from app.models.productos import Producto
+from app.crud.favoritos import obtener_favoritos, modificar_favoritos
+from app.helpers import etag_version
+from app.routes.dependencias import version_if_match
 from sqlalchemy.future import select
-from sqlalchemy import update
 from pydantic import BaseModel
+from typing import Optional
 
 class FavoriteRequest(BaseModel):
     user_id: int
@@ -19,17 +21,21 @@ async def verify_product_exists(product_id: int, db: AsyncSession) -> bool:
     return product is not None
 
 @router.get("/favorites/{user_id}", summary="Obtener favoritos del usuario")
-async def get_favorites(user_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).filter(User.id == user_id))
-    user = result.scalars().first()
-    if not user:
+async def get_favorites(user_id: int, response: Response, db: AsyncSession = Depends(get_db)):
+    favoritos = await obtener_favoritos(db, user_id)
+    if favoritos is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return {"favorites": user.favoritos if user.favoritos else []}
+    favorites, version = favoritos
+    # El ETag se puede enviar como If-Match en POST/DELETE para no pisar cambios de otra pestaña.
+    response.headers["ETag"] = etag_version(version)
+    return {"favorites": favorites}
 
 @router.post("/favorites/{product_id}", summary="Agregar producto a favoritos")
 async def add_favorite(
     product_id: int,
     favorite_request: FavoriteRequest,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
     db: AsyncSession = Depends(get_db)
 ):
     if not await verify_product_exists(product_id, db):
@@ -38,34 +44,18 @@ async def add_favorite(
             detail=f"El producto con ID {product_id} no existe"
         )
 
-    result = await db.execute(select(User).filter(User.id == favorite_request.user_id))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    current_favorites = user.favoritos if user.favoritos else []
-    
-    if product_id in current_favorites:
-        raise HTTPException(status_code=400, detail="Producto ya está en favoritos")
-    
-    new_favorites = current_favorites + [product_id]
-    
-    stmt = (
-        update(User)
-        .where(User.id == favorite_request.user_id)
-        .values(favoritos=new_favorites)
-    )
-    await db.execute(stmt)
+    new_favorites, version = await modificar_favoritos(db, favorite_request.user_id, product_id, True, if_match)
     await db.commit()
-    
-    await db.refresh(user)
-    
+
+    response.headers["ETag"] = etag_version(version)
     return {"message": "Producto agregado a favoritos", "favorites": new_favorites}
 
 @router.delete("/favorites/{product_id}", summary="Eliminar producto de favoritos")
 async def remove_favorite(
     product_id: int,
     favorite_request: FavoriteRequest,
+    response: Response,
+    if_match: Optional[int] = Depends(version_if_match),
     db: AsyncSession = Depends(get_db)
 ):
     if not await verify_product_exists(product_id, db):
@@ -74,26 +64,8 @@ async def remove_favorite(
             detail=f"El producto con ID {product_id} no existe"
         )
 
-    result = await db.execute(select(User).filter(User.id == favorite_request.user_id))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    current_favorites = user.favoritos if user.favoritos else []
-    
-    if product_id not in current_favorites:
-        raise HTTPException(status_code=400, detail="Producto no está en favoritos")
-    
-    new_favorites = [f for f in current_favorites if f != product_id]
-    
-    stmt = (
-        update(User)
-        .where(User.id == favorite_request.user_id)
-        .values(favoritos=new_favorites)
-    )
-    await db.execute(stmt)
+    new_favorites, version = await modificar_favoritos(db, favorite_request.user_id, product_id, False, if_match)
     await db.commit()
-    
-    await db.refresh(user)
-    
-    return {"message": "Producto eliminado de favoritos", "favorites": new_favorites}
\ No newline at end of file
+
+    response.headers["ETag"] = etag_version(version)
+    return {"message": "Producto eliminado de favoritos", "favorites": new_favorites}
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.almacenamiento import Objeto, almacen
+from app.cache import get_imagenes_cache
+from app.config import IMAGE_RESIZE_MAX_WIDTH, IMAGE_VARIANT_QUALITY, UPLOAD_CHUNK_SIZE
+from app.imagenes import (
+    BLOBS_PREFIX, BLOBS_TMP_DIR, PRODUCTS_PREFIX, ImagenRechazada, get_image_executor, resize_image,
+)
+
+router = APIRouter(prefix="/img", tags=["imagenes"])
+
+# Prefijos de uploads desde los que se puede redimensionar
+ORIGENES = (PRODUCTS_PREFIX, BLOBS_PREFIX)
+
+# Codificaciones en curso por clave de caché: las solicitudes simultáneas de la
+# misma variante esperan a la misma tarea en lugar de codificarla otra vez.
+_en_curso: Dict[str, asyncio.Task] = {}
+
+# Renovación en lote del mtime de las entradas usadas (orden LRU tras un reinicio).
+TOQUES_CADA_SEGUNDOS = 5
+_toques: Optional[asyncio.Task] = None
+
+
+async def _resolver_origen(path: str) -> Objeto:
+    clave = almacen.clave_de_url(f"/uploads/{path}")
+    if clave and clave.startswith(ORIGENES) and not clave.startswith(f"{BLOBS_PREFIX}tmp/"):
+        objeto = await almacen.stat(clave)
+        if objeto is not None:
+            return objeto
+    raise HTTPException(status_code=404, detail="Imagen no encontrada")
+
+
+async def _codificar(origen: str, clave: str, ancho: int, calidad: int) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        # Con S3 el original se descarga a un temporal solo mientras se codifica.
+        async with almacen.archivo_local(origen, BLOBS_TMP_DIR) as path:
+            await loop.run_in_executor(
+                get_image_executor(), resize_image, path, get_imagenes_cache().path(clave), ancho, calidad
+            )
+    except ImagenRechazada as e:
+        raise HTTPException(status_code=400, detail=f"Imagen no válida: {e}")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    get_imagenes_cache().add(clave)
+
+
+async def _generar(origen: str, clave: str, ancho: int, calidad: int) -> None:
+    tarea = _en_curso.get(clave)
+    if tarea is None:
+        tarea = asyncio.ensure_future(_codificar(origen, clave, ancho, calidad))
+        _en_curso[clave] = tarea
+        tarea.add_done_callback(lambda _: _en_curso.pop(clave, None))
+    # shield: si un cliente se desconecta no se cancela la codificación que esperan los demás.
+    await asyncio.shield(tarea)
+
+
+async def _tocar_en_lote() -> None:
+    await asyncio.sleep(TOQUES_CADA_SEGUNDOS)
+    cache = get_imagenes_cache()
+    await asyncio.to_thread(cache.tocar, cache.pendientes())
+
+
+def _programar_toques() -> None:
+    global _toques
+    if _toques is None or _toques.done():
+        _toques = asyncio.ensure_future(_tocar_en_lote())
+
+
+def _abrir(path: Path) -> Optional[Tuple[BinaryIO, int]]:
+    # Abierto, el archivo se puede leer aunque otra solicitud lo desaloje y lo borre.
+    try:
+        archivo = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    return archivo, os.fstat(archivo.fileno()).st_size
+
+
+async def _contenido(archivo: BinaryIO):
+    try:
+        while chunk := await asyncio.to_thread(archivo.read, UPLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        archivo.close()
+
+
+@router.get("/cache/stats", summary="Métricas de la caché de imágenes redimensionadas")
+async def estadisticas_cache_imagenes():
+    return {**get_imagenes_cache().stats(), "en_curso": len(_en_curso)}
+
+
+@router.get("/{path:path}", summary="Imagen redimensionada bajo demanda",
+            responses={404: {"description": "Imagen no encontrada"}})
+async def imagen_redimensionada(
+    path: str,
+    w: int = Query(..., ge=16, le=IMAGE_RESIZE_MAX_WIDTH, description="Ancho en píxeles"),
+    q: int = Query(IMAGE_VARIANT_QUALITY, ge=30, le=95, description="Calidad WebP"),
+):
+    """
+    Sirve una copia WebP de una imagen de uploads (CarpetasDeProductos o blobs)
+    con el ancho pedido, desde el backend de almacenamiento configurado. La primera solicitud la codifica en el pool de procesos
+    y la guarda en una caché en disco con desalojo LRU.
+    """
+    origen = await _resolver_origen(path)
+    # La versión (mtime o ETag) forma parte de la clave: si el original cambia, la copia vieja deja de usarse.
+    clave = hashlib.sha1(f"{origen.clave}:{origen.version}:{w}:{q}".encode()).hexdigest() + ".webp"
+
+    cache = get_imagenes_cache()
+    abierto = None
+    if cache.get(clave) is not None:
+        _programar_toques()
+        abierto = await asyncio.to_thread(_abrir, cache.path(clave))
+    # Con la caché llena, otra solicitud puede desalojar la copia entre que se codifica
+    # y se abre: se vuelve a generar una vez.
+    for _ in range(2):
+        if abierto is not None:
+            break
+        await _generar(origen.clave, clave, w, q)
+        abierto = await asyncio.to_thread(_abrir, cache.path(clave))
+    if abierto is None:
+        raise HTTPException(status_code=503, detail="La caché de imágenes está saturada; intente de nuevo")
+
+    archivo, tamano = abierto
+    return StreamingResponse(_contenido(archivo), media_type="image/webp", headers={
+        "Cache-Control": "public, max-age=86400", "Content-Length": str(tamano),
+    })
@@ -4,6 +4,8 @@ from sqlalchemy.future import select
 from app.database import get_db
 from app.models.pedidos import Pedido
 from app.models.usuarios import Usuario 
+from app.crud.carrito import bloquear_carrito, vaciar_carrito, totales
+from app.almacen_carritos import carritos
 import asyncio
 
 router = APIRouter()
@@ -35,27 +37,34 @@ async def finalizar_orden(
     background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(select(Usuario).filter(Usuario.id == usuario_id))
-    usuario = result.scalar_one_or_none()
-    if not usuario:
+    if await bloquear_carrito(db, usuario_id) is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    cart = usuario.carrito
-    if not cart:
-        raise HTTPException(status_code=400, detail="El carrito está vacío")
+    # La fila del usuario queda bloqueada hasta el commit. Con escritura diferida el
+    # carrito sale del almacén en un paso: una mutación anterior entra en el pedido,
+    # y una posterior espera a esta transacción para cargar el carrito y queda para
+    # la próxima orden. vaciar_carrito trae el precio vigente de cada producto.
+    extraido = await carritos.extraer(usuario_id)
+    try:
+        cart = await vaciar_carrito(db, usuario_id, extraido)
+        if not cart:
+            raise HTTPException(status_code=400, detail="El carrito está vacío")
 
-    total = sum(item['precio'] * item['cantidad'] for item in cart)
+        total = totales(cart)["total"]
 
-    nuevo_pedido = Pedido(
-        detalles=cart,
-        total=total,
-        estado="en proceso",
-        usuario_id=usuario_id
-    )
-    db.add(nuevo_pedido)
-
-    usuario.carrito = []  
-    await db.commit()
+        nuevo_pedido = Pedido(
+            detalles=cart,
+            total=total,
+            estado="en proceso",
+            usuario_id=usuario_id
+        )
+        db.add(nuevo_pedido)
+        await db.commit()
+    except BaseException:
+        # Antes del rollback, mientras la fila sigue bloqueada.
+        await carritos.reponer(usuario_id, extraido)
+        await db.rollback()
+        raise
     await db.refresh(nuevo_pedido)
 
     background_tasks.add_task(update_order_status, nuevo_pedido.id, db, "en camino", 600)
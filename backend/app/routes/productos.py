@@ -1,49 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, File, Form, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, status, Query, File, Form, UploadFile, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
+from app.database import get_db, async_session
 from app.models.productos import Producto as ProductoModel
-from app.schemas.productos import Producto as ProductoSchema, ProductoCreate, ProductoResponse
-from app.crud.productos import get_productos, get_producto, create_producto, update_producto, delete_producto
+from app.schemas.productos import Producto as ProductoSchema, ProductoCreate, ProductoResponse, ProductoFacetasResponse, ProductoBatchResponse, ProductoImagenesEstado
+from app.crud.productos import get_productos, get_producto, create_producto, update_producto, delete_producto, get_facetas, get_productos_by_ids, stream_productos, SORT_OPTIONS, EXPORT_COLUMNS
+from app.cache import productos_cache, get_catalog_version
+from app.config import PRODUCTOS_BATCH_MAX, EXPORT_BATCH_SIZE
 from app.validators.productos import ProductoValidator
 from typing import Optional, List
-from PIL import Image
 from pathlib import Path
-from datetime import datetime
 import shutil
-import random
-import re
 import json 
+import csv
+import io
+import asyncio
+import tempfile
+import time
+import zipfile
 from sqlalchemy import select
-from app.helpers import extract_file_path_from_url, extract_folder_from_url, normalize_url
+from app.helpers import normalize_url, parse_image_urls
+from app.importacion import importar_productos, detectar_formato
+from app.almacenamiento import almacen
+from app.imagenes import PRODUCTS_PREFIX, blob_hash
+from app.cola_imagenes import recibir_imagenes, descartar_imagenes, estado_imagenes, resumen_cola
 
 
 router = APIRouter(prefix="/productos", tags=["productos"])
 
-BASE_UPLOAD_DIR = Path("uploads")
-BASE_IMAGE_DIR = Path("uploads/CarpetasDeProductos")
-BASE_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-PRODUCTS_UPLOAD_DIR = BASE_UPLOAD_DIR / "CarpetasDeProductos"
-PRODUCTS_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-def convert_to_webp(image_path: Path) -> Path:
-    """Convierte una imagen a formato .webp si no está ya en ese formato."""
-    with Image.open(image_path) as img:
-        webp_path = image_path.with_suffix('.webp')
-        img.save(webp_path, format="WEBP", quality=100)
-    return webp_path
-
-def generate_unique_name(original_name: str) -> str:
-    sanitized_name = re.sub(r'[^a-zA-Z0-9_-]', '_', original_name.rsplit('.', 1)[0])
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    random_number = random.randint(1, 1000)
-    return f"{sanitized_name}_{timestamp}_{random_number}"
-
-def generate_folder_name(product_name: str) -> str:
-    sanitized = re.sub(r'[^a-zA-Z0-9_-]', '_', product_name)
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    rand = random.randint(1, 1000)
-    return f"{sanitized}_{timestamp}_{rand}"
-
 @router.get("/", response_model=ProductoResponse)
 async def listar_productos(
     categoria: Optional[str] = None,
@@ -51,15 +35,35 @@ async def listar_productos(
     searchQuery: Optional[str] = None,
     sortBy: Optional[str] = Query(
         default="default", 
-        description="Ordenamiento: price_asc, price_desc, name_asc, name_desc, newest"
+        description="Ordenamiento: price_asc, price_desc, name_asc, name_desc, newest, relevance (requiere searchQuery)"
     ),
     page: Optional[int] = Query(default=1, ge=1, description="Número de página"),
     limit: Optional[int] = Query(default=30, ge=1, le=100, description="Límite de productos por página"),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="Cursor opaco (next_cursor de la respuesta anterior). Si se envía, se ignora page"
+    ),
+    total_mode: Optional[str] = Query(
+        default="exact",
+        pattern="^(exact|estimate)$",
+        description="exact: conteo exacto; estimate: conteo aproximado en listados sin búsqueda"
+    ),
     db: AsyncSession = Depends(get_db)
 ):
     if sortBy == "newest":
         sortBy = "created_at_desc"
-    
+    searchQuery = searchQuery.strip() if searchQuery and searchQuery.strip() else None
+    if sortBy not in SORT_OPTIONS or (sortBy == "relevance" and not searchQuery):
+        sortBy = "default"
+
+    cache_key = (
+        "listado", get_catalog_version(), categoria, genero, searchQuery,
+        sortBy, None if cursor else page, limit, cursor, total_mode
+    )
+    cached = productos_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
     try:
         result = await get_productos(
             db, 
@@ -68,17 +72,175 @@ async def listar_productos(
             search_query=searchQuery,
             sortBy=sortBy,
             page=page,
-            limit=limit
+            limit=limit,
+            cursor=cursor,
+            total_mode=total_mode
         )
-        return ProductoResponse(
+        respuesta = ProductoResponse(
             products=result["products"],
-            total=result["total"]
+            total=result["total"],
+            next_cursor=result["next_cursor"]
         )
+        body = respuesta.model_dump_json(by_alias=True).encode()
+        productos_cache.set(cache_key, body)
+        return Response(content=body, media_type="application/json")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@router.get("/facets", response_model=ProductoFacetasResponse)
+async def facetas_productos(
+    categoria: Optional[str] = None,
+    genero: Optional[str] = None,
+    searchQuery: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    searchQuery = searchQuery.strip() if searchQuery and searchQuery.strip() else None
+    cache_key = ("facetas", get_catalog_version(), categoria, genero, searchQuery)
+    cached = productos_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    try:
+        facetas = ProductoFacetasResponse(**await get_facetas(
+            db, categoria=categoria, genero=genero, search_query=searchQuery
+        ))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    body = facetas.model_dump_json().encode()
+    productos_cache.set(cache_key, body)
+    return Response(content=body, media_type="application/json")
+
+@router.get("/batch", response_model=ProductoBatchResponse)
+async def obtener_productos_batch(
+    ids: str = Query(..., description="IDs separados por coma, por ejemplo 3,1,7"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        producto_ids = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Los IDs deben ser números enteros separados por coma")
+    # productos.id es integer: fuera de rango asyncpg falla al enviar el parámetro.
+    if any(not 1 <= i <= 2**31 - 1 for i in producto_ids):
+        raise HTTPException(status_code=400, detail="Los IDs deben estar entre 1 y 2147483647")
+    # Sin duplicados, conservando el orden de la solicitud
+    producto_ids = list(dict.fromkeys(producto_ids))
+    if not producto_ids:
+        raise HTTPException(status_code=400, detail="Debe indicar al menos un ID")
+    if len(producto_ids) > PRODUCTOS_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No se pueden solicitar más de {PRODUCTOS_BATCH_MAX} productos a la vez"
+        )
+
+    productos = await get_productos_by_ids(db, producto_ids)
+    encontrados = {p.id for p in productos}
+    return ProductoBatchResponse(
+        products=productos,
+        missing=[i for i in producto_ids if i not in encontrados]
+    )
+
+@router.get("/export", summary="Exportar el catálogo en NDJSON o CSV")
+async def exportar_productos(
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    categoria: Optional[str] = None,
+    genero: Optional[str] = None,
+    searchQuery: Optional[str] = None,
+):
+    searchQuery = searchQuery.strip() if searchQuery and searchQuery.strip() else None
+
+    # La sesión se abre dentro del generador: la de get_db se cierra antes de
+    # que termine de enviarse una respuesta en streaming.
+    async def generar():
+        async with async_session() as db:
+            if format == "csv":
+                yield _csv_linea([c.key for c in EXPORT_COLUMNS])
+            async for filas in stream_productos(
+                db, categoria=categoria, genero=genero,
+                search_query=searchQuery, batch_size=EXPORT_BATCH_SIZE
+            ):
+                if format == "csv":
+                    yield "".join(_csv_linea(_fila_csv(f)) for f in filas)
+                else:
+                    yield "".join(json.dumps(_fila_json(f), ensure_ascii=False) + "\n" for f in filas)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        generar(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="productos.{format}"'}
+    )
+
+def _fila_json(fila) -> dict:
+    datos = dict(fila)
+    if datos["created_at"] is not None:
+        datos["created_at"] = datos["created_at"].isoformat()
+    return datos
+
+def _fila_csv(fila) -> list:
+    datos = _fila_json(fila)
+    for columna in ("image_url", "image_variants"):
+        datos[columna] = json.dumps(datos[columna]) if datos[columna] is not None else ""
+    return [datos[c.key] for c in EXPORT_COLUMNS]
+
+def _csv_linea(valores) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(valores)
+    return buffer.getvalue()
+
+@router.get("/cache/stats", summary="Métricas de la caché del listado de productos")
+async def estadisticas_cache():
+    return {**productos_cache.stats(), "catalog_version": get_catalog_version()}
+
+@router.post("/import", summary="Importación masiva de productos desde CSV/NDJSON y un ZIP de imágenes")
+async def importar_productos_archivo(
+    archivo: UploadFile = File(...),
+    imagenes: Optional[UploadFile] = File(None),
+    formato: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    formato = formato or detectar_formato(archivo.filename)
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato no soportado: use csv o ndjson")
+
+    zip_path = None
+    try:
+        if imagenes:
+            # Los workers abren el ZIP por su cuenta, así que necesita estar en disco.
+            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+                await asyncio.to_thread(shutil.copyfileobj, imagenes.file, tmp)
+                zip_path = tmp.name
+            if not zipfile.is_zipfile(zip_path):
+                raise HTTPException(status_code=400, detail="El archivo de imágenes debe ser un ZIP")
+
+        texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+        inicio = time.perf_counter()
+        resumen = await importar_productos(db, texto, formato, zip_path=zip_path)
+        resumen["duracion_segundos"] = round(time.perf_counter() - inicio, 3)
+        return resumen
+    finally:
+        if zip_path:
+            Path(zip_path).unlink(missing_ok=True)
+
+@router.get("/imagenes/cola", summary="Trabajos de la cola de imágenes por estado")
+async def estado_cola_imagenes(db: AsyncSession = Depends(get_db)):
+    return await resumen_cola(db)
+
+@router.get("/{producto_id}/imagenes/estado", response_model=ProductoImagenesEstado,
+            summary="Estado del procesamiento de las imágenes de un producto",
+            responses={404: {"description": "Producto no encontrado"}})
+async def estado_imagenes_producto(producto_id: int, db: AsyncSession = Depends(get_db)):
+    estado = await estado_imagenes(db, producto_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return estado
 
 @router.get("/{producto_id}", response_model=ProductoSchema, responses={404: {"description": "Producto no encontrado"}})
 async def obtener_producto(producto_id: int, db: AsyncSession = Depends(get_db)):
@@ -104,58 +266,10 @@ async def crear_producto(
     ProductoValidator.validate_precio(precio)
     ProductoValidator.validate_cantidad(cantidad)
 
-    image_urls: List[str] = []
-    folder_name = generate_folder_name(nombre)
-    product_folder = PRODUCTS_UPLOAD_DIR / folder_name
-    product_folder.mkdir(parents=True, exist_ok=True)
-
-    if image:
-        try:
-            unique_file_name = generate_unique_name(image.filename)
-            extension = Path(image.filename).suffix
-            image_path = product_folder / f"{unique_file_name}{extension}"
-            with open(image_path, "wb") as buffer:
-                buffer.write(await image.read())
-            if image.content_type != "image/webp":
-                webp_image_path = convert_to_webp(image_path)
-                try:
-                    image_path.unlink()
-                except Exception as e:
-                    print(f"Error al eliminar el archivo original: {e}")
-                final_image_name = webp_image_path.name
-            else:
-                final_image_name = image_path.name
-            # Construye la URL que se guardará.
-            image_url = f"/uploads/CarpetasDeProductos/{folder_name}/{final_image_name}"
-            image_urls.append(image_url)
-        except Exception as e:
-            print(f"Error al procesar la imagen: {e}")
-            raise HTTPException(status_code=500, detail=f"Error al procesar la imagen: {str(e)}")
-
-    if additional_images:
-        for add_image in additional_images:
-            try:
-                print(f"Procesando imagen adicional: {add_image.filename}")
-                unique_file_name = generate_unique_name(add_image.filename)
-                extension = Path(add_image.filename).suffix
-                image_path = product_folder / f"{unique_file_name}{extension}"
-                with open(image_path, "wb") as buffer:
-                    buffer.write(await add_image.read())
-                if add_image.content_type != "image/webp":
-                    webp_image_path = convert_to_webp(image_path)
-                    try:
-                        image_path.unlink()
-                    except Exception as e:
-                        print(f"Error al eliminar el archivo original: {e}")
-                    final_image_name = webp_image_path.name
-                else:
-                    final_image_name = image_path.name
-                add_image_url = f"/uploads/CarpetasDeProductos/{folder_name}/{final_image_name}"
-                image_urls.append(add_image_url)
-            except Exception as e:
-                print(f"Error al procesar una imagen adicional: {e}")
-                raise HTTPException(status_code=500, detail=f"Error al procesar una imagen adicional: {str(e)}")
-
+    # Las imágenes se guardan tal como llegan y se codifican en la cola de fondo;
+    # el producto responde enseguida con image_status = "procesando".
+    uploads = ([image] if image else []) + list(additional_images or [])
+    recibidas = await recibir_imagenes(uploads)
 
     producto_data = ProductoCreate(
         nombre=nombre,
@@ -163,9 +277,14 @@ async def crear_producto(
         precio=precio,
         cantidad=cantidad,
         categoria_id=categoria_id,
-        image_url=image_urls if image_urls else None
+        image_url=None,
+        image_variants=None
     )
-    return await create_producto(db, producto_data)
+    try:
+        return await create_producto(db, producto_data, recibidas)
+    except Exception:
+        await descartar_imagenes(recibidas)
+        raise
 
 
 
@@ -220,81 +339,32 @@ async def actualizar_producto(
                 old_images = [db_producto.image_url]
     old_images = [normalize_url(url) for url in old_images]
 
-    # 4. Determinar cuáles imágenes fueron removidas (comparando las listas normalizadas)
+    # 4. Determinar cuáles imágenes quitó el usuario: las que tenía el producto al leerlo y
+    # no vienen en el formulario. La lista final la arma update_producto sobre la fila
+    # bloqueada, para no perder las que la cola agregue mientras tanto; también borra
+    # los archivos quitados (los blobs, solo cuando ningún producto los usa).
     removed_images = [img for img in old_images if img not in existing_image_urls]
-    for img_url in removed_images:
-        file_path = extract_file_path_from_url(img_url)
-        if file_path.exists():
-            try:
-                file_path.unlink()  # elimina el archivo
-                print(f"Se eliminó el archivo: {file_path}")
-            except Exception as e:
-                print(f"Error al eliminar {file_path}: {e}")
-
-    # Iniciamos el arreglo final con las imágenes que el usuario decidió mantener.
-    final_image_urls = list(existing_image_urls)
-
-    # 5. Determinar el folder_name: se reutiliza el de las imágenes existentes o de la BD.
-    folder_name = ""
-    for img in existing_image_urls:
-        folder_name = extract_folder_from_url(img)
-        if folder_name:
-            break
-    if not folder_name and db_producto.image_url:
-        if isinstance(db_producto.image_url, list) and len(db_producto.image_url) > 0:
-            folder_name = extract_folder_from_url(db_producto.image_url[0])
-        elif isinstance(db_producto.image_url, str):
-            try:
-                parsed = json.loads(db_producto.image_url)
-                if isinstance(parsed, list) and len(parsed) > 0:
-                    folder_name = extract_folder_from_url(parsed[0])
-            except Exception:
-                folder_name = extract_folder_from_url(db_producto.image_url)
-    if not folder_name:
-        folder_name = generate_folder_name(nombre)
-        print(f"Se generó un nuevo folder_name: {folder_name}")
-
-    product_folder = PRODUCTS_UPLOAD_DIR / folder_name
-    product_folder.mkdir(parents=True, exist_ok=True)
-
-    # 6. Procesar las nuevas imágenes subidas.
-    if images:
-        for image in images:
-            try:
-                unique_file_name = generate_unique_name(image.filename)
-                extension = Path(image.filename).suffix
-                new_image_path = product_folder / f"{unique_file_name}{extension}"
-                with open(new_image_path, "wb") as buffer:
-                    buffer.write(await image.read())
-
-                if image.content_type != "image/webp":
-                    webp_image_path = convert_to_webp(new_image_path)
-                    try:
-                        new_image_path.unlink()  # elimina el archivo original
-                    except Exception as e:
-                        print(f"Error al eliminar el archivo original: {e}")
-                    final_image_name = webp_image_path.name
-                else:
-                    final_image_name = new_image_path.name
 
-                new_image_url = f"/uploads/CarpetasDeProductos/{folder_name}/{final_image_name}"
-                final_image_urls.append(new_image_url)
-            except Exception as e:
-                print(f"Error al procesar la imagen en actualización: {e}")
-                raise HTTPException(status_code=500, detail=f"Error al procesar la imagen: {str(e)}")
+    # 5. Guardar las nuevas imágenes para la cola; se agregan al final de image_url
+    # cuando terminan de codificarse.
+    recibidas = await recibir_imagenes(images) if images else []
 
-    # 7. Actualizar el producto.
+    # 6. Actualizar el producto.
     producto_data = ProductoCreate(
         nombre=nombre,
         descripcion=descripcion,
         precio=precio,
         cantidad=cantidad,
         categoria_id=categoria_id,
-        image_url=final_image_urls if final_image_urls else None
     )
 
-    db_producto = await update_producto(db, producto_id, producto_data)
+    try:
+        db_producto = await update_producto(db, producto_id, producto_data, recibidas, removed_images)
+    except Exception:
+        await descartar_imagenes(recibidas)
+        raise
     if not db_producto:
+        await descartar_imagenes(recibidas)
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     return db_producto
 
@@ -309,43 +379,28 @@ async def eliminar_producto(producto_id: int, db: AsyncSession = Depends(get_db)
             status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado"
         )
         
-    first_img_val = ""
-    if producto_a_eliminar.image_url:
-        if isinstance(producto_a_eliminar.image_url, list):
-            if len(producto_a_eliminar.image_url) > 0:
-                first_img_val = producto_a_eliminar.image_url[0]
-        elif isinstance(producto_a_eliminar.image_url, str):
-            try:
-                parsed = json.loads(producto_a_eliminar.image_url)
-                if isinstance(parsed, list) and len(parsed) > 0:
-                    first_img_val = parsed[0]
-                else:
-                    first_img_val = producto_a_eliminar.image_url
-            except Exception as e:
-                first_img_val = producto_a_eliminar.image_url
-    
-    folder_path = None
+    # La carpeta propia del producto solo existe para imágenes anteriores al almacén por
+    # contenido; los blobs los libera delete_producto según sus referencias.
+    first_img_val = next((url for url in parse_image_urls(producto_a_eliminar.image_url) if not blob_hash(url)), "")
+
+    folder_prefix = None
     if first_img_val:
-        # Usamos el helper para obtener la ruta del archivo, y luego tomamos su carpeta (parent)
-        folder_path = extract_file_path_from_url(first_img_val).parent
-        print(f"Carpeta identificada para eliminar: {folder_path}")
+        # La carpeta es el prefijo de la clave de la imagen (CarpetasDeProductos/<carpeta>/)
+        clave = almacen.clave_de_url(first_img_val) or ""
+        folder_prefix = clave.rsplit("/", 1)[0] + "/"
+        print(f"Carpeta identificada para eliminar: {folder_prefix}")
     else:
         print("No se encontró una URL de imagen válida.")
     
     db_producto = await delete_producto(db, producto_id)
     
-    if folder_path:
-        BASE_IMAGE_DIR = Path("uploads/CarpetasDeProductos")
-        # Comprobamos que la carpeta a eliminar esté realmente dentro de BASE_IMAGE_DIR
-        try:
-            folder_path.relative_to(BASE_IMAGE_DIR)
-            if folder_path.exists():
-                shutil.rmtree(folder_path)
-                print(f"Carpeta eliminada: {folder_path}")
-            else:
-                print(f"La carpeta {folder_path} no existe.")
-        except ValueError:
-            print(f"Advertencia: La carpeta {folder_path} no está dentro de {BASE_IMAGE_DIR}. No se elimina.")
+    if folder_prefix:
+        # Comprobamos que la carpeta a eliminar esté realmente dentro de CarpetasDeProductos
+        if folder_prefix.startswith(PRODUCTS_PREFIX) and folder_prefix != PRODUCTS_PREFIX:
+            eliminados = await almacen.eliminar_prefijo(folder_prefix)
+            print(f"Carpeta eliminada: {folder_prefix} ({eliminados})")
+        else:
+            print(f"Advertencia: La carpeta {folder_prefix} no está dentro de {PRODUCTS_PREFIX}. No se elimina.")
     
     return db_producto
 
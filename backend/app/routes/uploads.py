@@ -2,21 +2,15 @@ from fastapi import APIRouter, Form, UploadFile, File, HTTPException, Depends
 from app.models.productos import Producto as ProductoModel
 from sqlalchemy.orm import Session
 from pathlib import Path
+import asyncio
+import re
+import uuid
 from app.database import get_db
-from PIL import Image
+from app.almacenamiento import almacen
+from app.imagenes import BLOBS_TMP_DIR, PRODUCTS_PREFIX, convert_to_webp, get_image_executor, guardar_upload
 
 router = APIRouter()
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-def convert_to_webp(image_path: Path) -> Path:
-    """Convierte una imagen a formato .webp si no está ya en ese formato."""
-    with Image.open(image_path) as img:
-        webp_path = image_path.with_suffix('.webp')
-        img.save(webp_path, format="WEBP", quality=100)
-    return webp_path
-
 @router.post("/productos/")
 async def create_producto(
     nombre: str = Form(...),
@@ -28,18 +22,25 @@ async def create_producto(
     db: Session = Depends(get_db), 
 ):
     try:
-        image_path = None
-        webp_image_path = None
+        image_url = None
         if image:
-            image_path = UPLOAD_DIR / image.filename
-            with open(image_path, "wb") as buffer:
-                buffer.write(image.file.read())
+            archivo = Path(image.filename).name
+            image_path = BLOBS_TMP_DIR / f"{uuid.uuid4().hex}_{archivo}"
+            _, digest = await guardar_upload(image, image_path)
             
             if image.content_type != "image/webp":
-                webp_image_path = convert_to_webp(image_path)
+                # Pillow ocupa la CPU: la conversión va al pool de procesos, no al event loop.
+                loop = asyncio.get_running_loop()
+                webp_image_path = await loop.run_in_executor(get_image_executor(), convert_to_webp, image_path)
                 image_path.unlink()
             else:
                 webp_image_path = image_path
+            # Carpeta propia del producto y nombre por contenido: dos subidas con el mismo
+            # nombre de archivo no se pisan.
+            carpeta = f"{re.sub(r'[^a-zA-Z0-9_-]', '_', nombre)}_{uuid.uuid4().hex[:8]}"
+            clave = f"{PRODUCTS_PREFIX}{carpeta}/{digest}.webp"
+            await almacen.put_file(clave, webp_image_path, mover=True)
+            image_url = almacen.url(clave)
 
         producto = ProductoModel(
             nombre=nombre,
@@ -47,12 +48,14 @@ async def create_producto(
             precio=precio,
             cantidad=cantidad,
             categoria_id=categoria_id,
-            image_url=str(webp_image_path) if webp_image_path else None,
+            image_url=image_url,
         )
         db.add(producto)
         db.commit()
         db.refresh(producto)
 
         return {"message": "Producto creado exitosamente", "producto": producto}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear producto: {str(e)}")
\ No newline at end of file
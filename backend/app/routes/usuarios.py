@@ -5,6 +5,8 @@ from sqlalchemy.future import select
 from app.models.usuarios import Usuario
 from app.models.productos import Producto
 from app.database import get_db
+from app.almacen_carritos import carritos
+from app.crud.favoritos import modificar_favoritos
 from app.routes.authentication import get_current_user
 from app.crud.usuarios import (
     create_usuario,
@@ -92,9 +94,8 @@ async def agregar_a_favoritos(db: AsyncSession, usuario_id: int, producto_id: in
             status_code=404, detail="Usuario no encontrado"
         )
 
-    if producto_id not in usuario.favoritos:
-        usuario.favoritos.append(producto_id)
-        db.add(usuario)
+    if producto_id not in (usuario.favoritos or []):
+        await modificar_favoritos(db, usuario_id, producto_id, True)
         await db.commit()
         await db.refresh(usuario)
 
@@ -102,33 +103,6 @@ async def agregar_a_favoritos(db: AsyncSession, usuario_id: int, producto_id: in
 
 
 async def agregar_al_carrito(db: AsyncSession, usuario_id: int, producto_id: int, cantidad: int):
-    producto = await db.execute(select(Producto).filter(Producto.id == producto_id))
-    producto = producto.scalar_one_or_none()
-
-    if not producto:
-        raise HTTPException(
-            status_code=404, detail="El producto no existe"
-        )
-
-    usuario = await db.execute(select(Usuario).filter(Usuario.id == usuario_id))
-    usuario = usuario.scalar_one_or_none()
+    await carritos.agregar(db, usuario_id, producto_id, "", "", cantidad)
 
-    if not usuario:
-        raise HTTPException(
-            status_code=404, detail="Usuario no encontrado"
-        )
-
-    carrito = usuario.carrito or []
-    for item in carrito:
-        if item["producto_id"] == producto_id:
-            item["cantidad"] += cantidad
-            break
-    else:
-        carrito.append({"producto_id": producto_id, "cantidad": cantidad})
-
-    usuario.carrito = carrito
-    db.add(usuario)
-    await db.commit()
-    await db.refresh(usuario)
-
-    return usuario
+    return await get_usuario_by_id(db, usuario_id)
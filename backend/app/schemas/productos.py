@@ -1,6 +1,6 @@
 import json
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List
+from pydantic import BaseModel, Field, validator, computed_field
+from typing import Optional, List, Dict
 from datetime import datetime
 
 class ProductoBase(BaseModel):
@@ -10,6 +10,7 @@ class ProductoBase(BaseModel):
     cantidad: int
     categoria_id: int
     image_url: Optional[List[str]] = None
+    image_variants: Optional[Dict[str, Dict[str, str]]] = None
     createdAt: Optional[datetime] = Field(None, alias="created_at")
 
     @validator('image_url', pre=True)
@@ -34,6 +35,28 @@ class ProductoCreate(ProductoBase):
 
 class Producto(ProductoBase):
     id: int
+    image_status: Optional[str] = None
+
+    def _variantes_principal(self) -> Dict[str, str]:
+        if not self.image_url or not self.image_variants:
+            return {}
+        return self.image_variants.get(self.image_url[0]) or {}
+
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        variantes = self._variantes_principal()
+        if variantes:
+            return variantes[min(variantes, key=int)]
+        return self.image_url[0] if self.image_url else None
+
+    @computed_field
+    @property
+    def srcset(self) -> Optional[str]:
+        variantes = self._variantes_principal()
+        if not variantes:
+            return None
+        return ", ".join(f"{url} {w}w" for w, url in sorted(variantes.items(), key=lambda v: int(v[0])))
 
     class Config:
         from_attributes = True
@@ -41,6 +64,41 @@ class Producto(ProductoBase):
 class ProductoResponse(BaseModel):
     products: List[Producto]
     total: int
+    next_cursor: Optional[str] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ProductoBatchResponse(BaseModel):
+    products: List[Producto]
+    missing: List[int]
+
+class FacetaValor(BaseModel):
+    valor: str
+    total: int
+
+class FacetaPrecio(BaseModel):
+    min: float
+    max: Optional[float] = None
+    total: int
+
+class ProductoFacetasResponse(BaseModel):
+    categorias: List[FacetaValor]
+    generos: List[FacetaValor]
+    precios: List[FacetaPrecio]
+    total: int
+
+class TrabajoImagenEstado(BaseModel):
+    id: int
+    estado: str
+    intentos: int
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class ProductoImagenesEstado(BaseModel):
+    producto_id: int
+    image_status: str
+    image_url: Optional[List[str]] = None
+    trabajos: List[TrabajoImagenEstado]
@@ -1,3 +1,4 @@
+import math
 from typing import Any
 from pydantic_core import PydanticCustomError
 
@@ -17,6 +18,12 @@ class ProductoValidator:
 
     @staticmethod
     def validate_precio(precio: float) -> float:
+        # float() acepta "nan" e "inf", y nan <= 0 es falso.
+        if not math.isfinite(precio):
+            raise PydanticCustomError(
+                "precio_invalido",
+                "El precio debe ser un número finito"
+            )
         if precio <= 0:
             raise PydanticCustomError(
                 "precio_invalido",
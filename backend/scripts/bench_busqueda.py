@@ -0,0 +1,65 @@
+"""
+Latencia de búsqueda (p50/p99): índice de texto completo + trigramas frente
+al antiguo filtro ILIKE '%q%' sobre el nombre.
+
+Uso (desde backend/, con la migración de búsqueda aplicada):
+    python -m scripts.bench_busqueda --productos 100000 --repeticiones 50
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from app.models.categorias import Categoria
+from app.models.productos import Producto
+from app.crud.productos import get_productos
+from scripts.bench_paginacion import SessionLocal, sembrar_catalogo
+
+CONSULTAS = ["camisa", "pantalon azul", "algodón", "chaqueta de cuero", "plateado", "vestid"]
+
+
+async def busqueda_ilike(session, search_query: str, limit: int):
+    """Reproduce la ruta anterior: count + página con ILIKE sobre el nombre."""
+    query = select(Producto).join(Categoria).filter(Producto.nombre.ilike(f"%{search_query}%"))
+    await session.scalar(select(func.count()).select_from(query))
+    await session.execute(query.limit(limit))
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def medir(session, nombre: str, funcion, repeticiones: int):
+    tiempos = []
+    for _ in range(repeticiones):
+        for consulta in CONSULTAS:
+            inicio = time.perf_counter()
+            await funcion(session, consulta)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    print(f"{nombre:<28} p50={percentil(tiempos, 0.50):8.2f} ms  p99={percentil(tiempos, 0.99):8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--productos", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=30)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    async with SessionLocal() as session:
+        await sembrar_catalogo(session, args.productos)
+
+        await medir(session, "ILIKE (anterior)",
+                    lambda s, q: busqueda_ilike(s, q, args.limit), args.repeticiones)
+        await medir(session, "texto completo + trigramas",
+                    lambda s, q: get_productos(s, search_query=q, limit=args.limit), args.repeticiones)
+        await medir(session, "sortBy=relevance",
+                    lambda s, q: get_productos(s, search_query=q, limit=args.limit, sortBy="relevance"),
+                    args.repeticiones)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Throughput de carga de productos: create_producto fila por fila (ruta actual),
+INSERT de varias filas, COPY y el pipeline completo de importación (opcionalmente
+con imágenes).
+
+Uso (desde backend/):
+    python -m scripts.bench_importacion --filas 20000 --imagenes 200
+"""
+import argparse
+import asyncio
+import csv
+import io
+import random
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+from sqlalchemy import insert
+
+from app.crud.productos import create_producto
+from app.importacion import importar_productos, _insertar_lote
+from app.models.productos import Producto
+from app.registro_categorias import refresh_categorias
+from app.schemas.productos import ProductoCreate
+from scripts.bench_paginacion import SessionLocal, sembrar_catalogo, CATEGORIA_BENCH, PRENDAS, COLORES
+
+
+def generar_filas(n: int, categoria_id: int) -> list:
+    return [
+        {
+            "nombre": f"{random.choice(PRENDAS)} {random.choice(COLORES)} {i}",
+            "descripcion": "Producto de importación de prueba",
+            "precio": round(random.uniform(1000, 200000), 2),
+            "cantidad": random.randint(0, 50),
+            "categoria_id": categoria_id,
+            "image_url": None,
+            "image_variants": None,
+        }
+        for i in range(n)
+    ]
+
+
+def generar_zip(n: int) -> str:
+    tmp = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+    with zipfile.ZipFile(tmp, "w") as archivo_zip:
+        for i in range(n):
+            buffer = io.BytesIO()
+            Image.new("RGB", (1200, 1600), tuple(random.randint(0, 255) for _ in range(3))).save(buffer, "JPEG")
+            archivo_zip.writestr(f"foto{i}.jpg", buffer.getvalue())
+    tmp.close()
+    return tmp.name
+
+
+def reportar(nombre: str, filas: int, segundos: float) -> None:
+    print(f"{nombre:<32} {filas:>7} filas  {segundos:8.2f} s  {filas / segundos:10.0f} filas/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filas", type=int, default=20_000)
+    parser.add_argument("--filas-por-fila", type=int, default=500,
+                        help="Filas para la ruta create_producto (una transacción por fila)")
+    parser.add_argument("--imagenes", type=int, default=0,
+                        help="Filas del pipeline completo que llevan una imagen")
+    args = parser.parse_args()
+
+    async with SessionLocal() as db:
+        await sembrar_catalogo(db, 0)
+        snapshot = await refresh_categorias(db)
+        categoria_id = snapshot.ids(CATEGORIA_BENCH)[0]
+
+        filas = generar_filas(args.filas_por_fila, categoria_id)
+        inicio = time.perf_counter()
+        for fila in filas:
+            await create_producto(db, ProductoCreate(**fila))
+        reportar("create_producto (fila por fila)", len(filas), time.perf_counter() - inicio)
+
+        filas = generar_filas(args.filas, categoria_id)
+        inicio = time.perf_counter()
+        await db.execute(insert(Producto), filas)
+        await db.commit()
+        reportar("INSERT de varias filas", len(filas), time.perf_counter() - inicio)
+
+        filas = generar_filas(args.filas, categoria_id)
+        inicio = time.perf_counter()
+        await _insertar_lote(db, filas)
+        await db.commit()
+        reportar("COPY", len(filas), time.perf_counter() - inicio)
+
+        zip_path = generar_zip(args.imagenes) if args.imagenes else None
+        try:
+            texto = io.StringIO()
+            escritor = csv.DictWriter(texto, fieldnames=["nombre", "descripcion", "precio", "cantidad", "categoria_id", "imagenes"])
+            escritor.writeheader()
+            for i, fila in enumerate(generar_filas(args.filas, categoria_id)):
+                fila.pop("image_url")
+                fila.pop("image_variants")
+                fila["imagenes"] = f"foto{i}.jpg" if i < args.imagenes else ""
+                escritor.writerow(fila)
+            texto.seek(0)
+
+            inicio = time.perf_counter()
+            resumen = await importar_productos(db, texto, "csv", zip_path=zip_path)
+            reportar(f"pipeline ({args.imagenes} con imagen)", resumen["insertados"], time.perf_counter() - inicio)
+        finally:
+            if zip_path:
+                Path(zip_path).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+Memoria pico al guardar imágenes subidas: lectura completa (await upload.read(),
+como antes) frente a la copia en bloques de app.imagenes.guardar_upload.
+
+Cada archivo se arma igual que lo deja Starlette tras parsear el formulario
+(SpooledTemporaryFile que pasa a disco sobre 1 MB) y se mide con tracemalloc la
+memoria de Python reservada durante la escritura de --concurrentes subidas a la vez.
+Con --imagen además se mide el RSS máximo de un proceso que decodifica una imagen
+de ese tamaño con process_image, para comprobar el límite de píxeles.
+
+Uso (desde backend/):
+    python -m scripts.bench_memoria_subidas --mb 20 --concurrentes 8
+    python -m scripts.bench_memoria_subidas --imagen 12000x12000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from app.config import UPLOAD_CHUNK_SIZE, UPLOAD_MAX_FILE_BYTES, IMAGE_MAX_PIXELS
+from app.imagenes import guardar_upload, process_image, ImagenRechazada
+
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def crear_upload(tamano: int) -> UploadFile:
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    restante = tamano
+    while restante > 0:
+        bloque = min(restante, UPLOAD_CHUNK_SIZE)
+        archivo.write(os.urandom(bloque))
+        restante -= bloque
+    archivo.seek(0)
+    return UploadFile(file=archivo, size=tamano, filename="bench.jpg")
+
+
+async def guardar_completo(upload: UploadFile, destino: Path) -> None:
+    with open(destino, "wb") as buffer:
+        buffer.write(await upload.read())
+
+
+async def guardar_en_bloques(upload: UploadFile, destino: Path) -> None:
+    await guardar_upload(upload, destino, max_bytes=max(UPLOAD_MAX_FILE_BYTES, upload.size))
+
+
+async def medir(nombre, guardar, tamano: int, concurrentes: int, carpeta: Path) -> None:
+    uploads = [crear_upload(tamano) for _ in range(concurrentes)]
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    await asyncio.gather(*[guardar(u, carpeta / f"{nombre}_{i}.bin") for i, u in enumerate(uploads)])
+    duracion = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for upload in uploads:
+        await upload.close()
+
+    mb = 1024 * 1024
+    print(
+        f"{nombre:<10} pico total {pico / mb:8.1f} MB | por subida {pico / concurrentes / mb:7.2f} MB"
+        f" | {duracion * 1000:7.0f} ms"
+    )
+
+
+def _rss_pico_decodificacion(path: Path):
+    # Se ejecuta en un proceso nuevo para que ru_maxrss refleje solo esta imagen.
+    try:
+        process_image(path, True)
+        resultado = "decodificada"
+    except ImagenRechazada as e:
+        resultado = f"rechazada ({e})"
+    return resultado, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def medir_decodificacion(ancho: int, alto: int, carpeta: Path) -> None:
+    path = carpeta / "grande.png"
+    Image.new("RGB", (ancho, alto), (200, 120, 40)).save(path)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        resultado, rss = pool.submit(_rss_pico_decodificacion, path).result()
+    print(
+        f"imagen {ancho}x{alto} ({ancho * alto / 1e6:.1f} MP, límite {IMAGE_MAX_PIXELS / 1e6:.1f} MP): "
+        f"{resultado}; RSS máximo del worker {rss / 1024:.1f} MB"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=20)
+    parser.add_argument("--concurrentes", type=int, default=8)
+    parser.add_argument("--imagen", help="ANCHOxALTO de una imagen a decodificar en un proceso aparte")
+    args = parser.parse_args()
+
+    carpeta = Path(tempfile.mkdtemp(prefix="bench_memoria_"))
+    try:
+        tamano = int(args.mb * 1024 * 1024)
+        print(f"{args.concurrentes} subidas concurrentes de {args.mb} MB, bloques de {UPLOAD_CHUNK_SIZE // 1024} KB")
+        await medir("completo", guardar_completo, tamano, args.concurrentes, carpeta)
+        await medir("bloques", guardar_en_bloques, tamano, args.concurrentes, carpeta)
+
+        try:
+            await guardar_upload(crear_upload(UPLOAD_MAX_FILE_BYTES + 1), carpeta / "excedido.bin")
+        except HTTPException as e:
+            print(f"archivo de {UPLOAD_MAX_FILE_BYTES + 1} bytes: {e.status_code} {e.detail}")
+
+        if args.imagen:
+            ancho, alto = (int(v) for v in args.imagen.lower().split("x"))
+            medir_decodificacion(ancho, alto, carpeta)
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Compara la paginación por OFFSET contra la paginación por cursor (keyset)
+sobre un catálogo sembrado.
+
+Uso (desde backend/):
+    python -m scripts.bench_paginacion --productos 100000 --limit 30 --pagina 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from app.models.categorias import Categoria
+from app.models.productos import Producto
+from app.registro_categorias import refresh_categorias
+from app.crud.productos import get_productos, build_productos_query, apply_ordering, _encode_producto_cursor
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise Exception("No se encontró DATABASE_URL en las variables de entorno.")
+
+engine = create_async_engine(DATABASE_URL)
+SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+CATEGORIA_BENCH = "BenchCatalogo"
+LOTE = 5000
+
+PRENDAS = ["Camisa", "Pantalón", "Vestido", "Chaqueta", "Falda", "Blusa", "Corbata", "Zapatos", "Cinturón", "Abrigo"]
+COLORES = ["blanco", "negro", "azul", "café", "gris", "rojo", "verde", "celeste", "beige", "plateado"]
+MATERIALES = ["algodón", "lino", "satén", "cuero", "lana", "mezclilla", "poliéster", "seda"]
+
+
+async def sembrar_catalogo(session: AsyncSession, total: int) -> None:
+    """Crea la categoría de benchmark y la rellena hasta tener `total` productos."""
+    categoria = (await session.execute(
+        select(Categoria).where(Categoria.nombre == CATEGORIA_BENCH)
+    )).scalars().first()
+    if not categoria:
+        categoria = Categoria(nombre=CATEGORIA_BENCH, descripcion="Datos de benchmark", genero="Unisex")
+        session.add(categoria)
+        await session.flush()
+
+    existentes = await session.scalar(
+        select(func.count()).select_from(Producto).where(Producto.categoria_id == categoria.id)
+    )
+    faltantes = total - existentes
+    while faltantes > 0:
+        n = min(LOTE, faltantes)
+        filas = []
+        for i in range(n):
+            prenda, color, material = random.choice(PRENDAS), random.choice(COLORES), random.choice(MATERIALES)
+            filas.append({
+                "nombre": f"{prenda} {color} {existentes + i}",
+                "descripcion": f"{prenda} de {material} color {color}, generado para benchmark",
+                "precio": round(random.uniform(1000, 200000), 2),
+                "cantidad": random.randint(0, 50),
+                "categoria_id": categoria.id,
+                "image_url": [],
+            })
+        await session.execute(insert(Producto), filas)
+        existentes += n
+        faltantes -= n
+        print(f"Sembrados {existentes}/{total}")
+    await session.commit()
+
+
+async def medir(descripcion: str, coro_factory, repeticiones: int) -> None:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        await coro_factory()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    print(f"{descripcion:<40} p50={tiempos[len(tiempos) // 2]:8.2f} ms  max={tiempos[-1]:8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--productos", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=30)
+    parser.add_argument("--pagina", type=int, default=1000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--sort", default="price_asc")
+    args = parser.parse_args()
+    if args.pagina < 2:
+        parser.error("--pagina debe ser mayor que 1")
+
+    async with SessionLocal() as session:
+        await sembrar_catalogo(session, args.productos)
+        await refresh_categorias(session)
+
+        # Cursor equivalente al comienzo de la página pedida (no se mide).
+        anterior = apply_ordering(build_productos_query(categoria=CATEGORIA_BENCH), args.sort)
+        anterior = anterior.offset((args.pagina - 1) * args.limit - 1).limit(1)
+        ultima_fila = (await session.execute(anterior)).first()
+        if not ultima_fila:
+            raise SystemExit("El catálogo sembrado no alcanza la página solicitada")
+        # Sin total en el cursor, para que la página por cursor también calcule el conteo.
+        cursor = _encode_producto_cursor(ultima_fila, args.sort)
+
+        for pagina in (1, args.pagina):
+            await medir(
+                f"offset page={pagina}",
+                lambda: get_productos(session, categoria=CATEGORIA_BENCH, sortBy=args.sort,
+                                      page=pagina, limit=args.limit),
+                args.repeticiones,
+            )
+        await medir(
+            f"cursor (equivalente a page={args.pagina})",
+            lambda: get_productos(session, categoria=CATEGORIA_BENCH, sortBy=args.sort,
+                                  limit=args.limit, cursor=cursor),
+            args.repeticiones,
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
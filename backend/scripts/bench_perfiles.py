@@ -0,0 +1,150 @@
+"""
+Compara los perfiles de codificación de IMAGE_PROFILES sobre un corpus de
+imágenes: bytes resultantes, tiempo de codificación (mediana) y SSIM frente al
+original, para elegir IMAGE_PROFILE con datos.
+
+El SSIM se calcula sobre la luminancia, por bloques de 8x8 sin solapamiento y
+en Python puro con PIL (no hay numpy en el entorno). Las dos imágenes se
+comparan con la misma orientación y el mismo tamaño de salida, reducidas a
+--lado-ssim px, de modo que mide la pérdida por compresión y no el cambio
+de tamaño del perfil.
+
+Uso (desde backend/):
+    python -m scripts.bench_perfiles --corpus ruta/a/fotos
+    python -m scripts.bench_perfiles            # corpus sintético
+"""
+import argparse
+import io
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.config import IMAGE_PROFILES, IMAGE_PROFILE
+from app.imagenes import abrir_imagen, encode_webp, prepare_image
+
+EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+
+
+def ssim(a: Image.Image, b: Image.Image, ventana: int = 8) -> float:
+    """SSIM medio de bloques ventana x ventana sobre la luminancia (a y b del mismo tamaño)."""
+    a, b = a.convert("L"), b.convert("L")
+    ancho, alto = a.size
+    pa, pb = a.tobytes(), b.tobytes()
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    n = ventana * ventana
+    total, bloques = 0.0, 0
+    for y0 in range(0, alto - ventana + 1, ventana):
+        for x0 in range(0, ancho - ventana + 1, ventana):
+            sa = sb = saa = sbb = sab = 0
+            for y in range(y0, y0 + ventana):
+                inicio = y * ancho + x0
+                fa, fb = pa[inicio:inicio + ventana], pb[inicio:inicio + ventana]
+                sa += sum(fa)
+                sb += sum(fb)
+                saa += sum(v * v for v in fa)
+                sbb += sum(v * v for v in fb)
+                sab += sum(va * vb for va, vb in zip(fa, fb))
+            ma, mb = sa / n, sb / n
+            va, vb = saa / n - ma * ma, sbb / n - mb * mb
+            cov = sab / n - ma * mb
+            total += ((2 * ma * mb + c1) * (2 * cov + c2)) / ((ma * ma + mb * mb + c1) * (va + vb + c2))
+            bloques += 1
+    return total / bloques if bloques else 1.0
+
+
+def corpus_sintetico(directorio: Path) -> list:
+    """Foto con ruido y degradado, ilustración PNG con transparencia y una foto con orientación EXIF."""
+    foto = Image.merge("RGB", [
+        Image.linear_gradient("L").resize((3000, 2000)),
+        Image.effect_noise((3000, 2000), 40).filter(ImageFilter.GaussianBlur(1.5)),
+        Image.radial_gradient("L").resize((3000, 2000)),
+    ])
+    foto.save(directorio / "foto.jpg", quality=90)
+
+    ilustracion = Image.new("RGBA", (1200, 1200), (0, 0, 0, 0))
+    dibujo = ImageDraw.Draw(ilustracion)
+    for i in range(12):
+        dibujo.ellipse((i * 80, i * 60, i * 80 + 400, i * 60 + 300), fill=(20 * i, 200 - 10 * i, 120, 180))
+    ilustracion.save(directorio / "ilustracion.png")
+
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotada 90° a la derecha
+    foto.resize((2000, 1333)).save(directorio / "rotada.jpg", quality=88, exif=exif.tobytes())
+    return sorted(directorio.iterdir())
+
+
+def referencia(path: Path, perfil: dict) -> Image.Image:
+    with abrir_imagen(path) as img:
+        img.load()
+        return prepare_image(img, perfil)
+
+
+def medir(path: Path, perfil: dict, repeticiones: int) -> tuple:
+    tiempos, datos = [], b""
+    for _ in range(repeticiones):
+        with abrir_imagen(path) as img:
+            img.load()
+            buffer = io.BytesIO()
+            inicio = time.perf_counter()
+            encode_webp(img, buffer, perfil)
+            tiempos.append(time.perf_counter() - inicio)
+            datos = buffer.getvalue()
+    return datos, statistics.median(tiempos)
+
+
+def reducir(img: Image.Image, lado: int) -> Image.Image:
+    if max(img.size) <= lado:
+        return img
+    escala = lado / max(img.size)
+    return img.resize((max(1, round(img.width * escala)), max(1, round(img.height * escala))), Image.BOX)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Directorio con imágenes de muestra")
+    parser.add_argument("--perfiles", default=",".join(IMAGE_PROFILES))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--lado-ssim", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.corpus:
+            archivos = sorted(p for p in Path(args.corpus).iterdir() if p.suffix.lower() in EXTENSIONES)
+        else:
+            archivos = corpus_sintetico(Path(tmp))
+        perfiles = [p.strip() for p in args.perfiles.split(",") if p.strip()]
+        print(f"{len(archivos)} imágenes, perfiles: {', '.join(perfiles)} (configurado: {IMAGE_PROFILE})\n")
+
+        totales = {nombre: {"bytes": 0, "segundos": 0.0, "ssim": []} for nombre in perfiles}
+        bytes_originales = 0
+        for path in archivos:
+            bytes_originales += path.stat().st_size
+            print(f"{path.name} ({path.stat().st_size / 1024:.0f} KB)")
+            for nombre in perfiles:
+                perfil = IMAGE_PROFILES[nombre]
+                datos, segundos = medir(path, perfil, args.repeticiones)
+                with Image.open(io.BytesIO(datos)) as codificada:
+                    codificada.load()
+                    original = referencia(path, perfil)
+                    if original.size != codificada.size:
+                        original = original.resize(codificada.size, Image.LANCZOS)
+                    valor = ssim(reducir(original, args.lado_ssim), reducir(codificada, args.lado_ssim))
+                totales[nombre]["bytes"] += len(datos)
+                totales[nombre]["segundos"] += segundos
+                totales[nombre]["ssim"].append(valor)
+                print(f"  {nombre:<12} {len(datos) / 1024:8.0f} KB  "
+                      f"{len(datos) / path.stat().st_size:6.0%} del original  "
+                      f"{segundos * 1000:7.0f} ms  SSIM {valor:.4f}")
+
+        print(f"\nTotal ({bytes_originales / 1024:.0f} KB de originales)")
+        for nombre, t in totales.items():
+            print(f"  {nombre:<12} {t['bytes'] / 1024:8.0f} KB  {t['bytes'] / bytes_originales:6.0%}  "
+                  f"{t['segundos'] * 1000:7.0f} ms  SSIM medio {statistics.mean(t['ssim']):.4f}  "
+                  f"mínimo {min(t['ssim']):.4f}")
+
+
+if __name__ == "__main__":
+    main()
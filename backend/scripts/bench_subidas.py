@@ -0,0 +1,94 @@
+"""
+Latencia del listado del catálogo mientras se suben productos con varias
+imágenes en paralelo. Con la codificación WebP fuera del event loop la latencia
+del listado debería mantenerse plana durante las subidas.
+
+Requiere el servidor corriendo. Uso (desde backend/):
+    python -m scripts.bench_subidas --url http://localhost:8000 --categoria-id 1 \
+        --subidas 8 --imagenes 6
+"""
+import argparse
+import asyncio
+import io
+import random
+import time
+
+import aiohttp
+from PIL import Image
+
+
+def imagen_jpeg(ancho: int, alto: int) -> bytes:
+    buffer = io.BytesIO()
+    # Ruido para que la codificación cueste lo mismo que una foto real.
+    img = Image.effect_noise((ancho, alto), 64).convert("RGB")
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+
+async def sondear_listado(session, url: str, detener: asyncio.Event, tiempos: list):
+    while not detener.is_set():
+        inicio = time.perf_counter()
+        async with session.get(f"{url}/api/productos/", params={"limit": 30}) as resp:
+            await resp.read()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.sleep(0.05)
+
+
+async def subir_producto(session, url: str, categoria_id: int, imagenes: list):
+    form = aiohttp.FormData()
+    form.add_field("nombre", f"Bench subida {random.randint(1, 10**6)}")
+    form.add_field("descripcion", "Producto creado por bench_subidas")
+    form.add_field("precio", "19990")
+    form.add_field("cantidad", "5")
+    form.add_field("categoria_id", str(categoria_id))
+    form.add_field("image", imagenes[0], filename="principal.jpg", content_type="image/jpeg")
+    for i, data in enumerate(imagenes[1:]):
+        form.add_field("additional_images", data, filename=f"extra{i}.jpg", content_type="image/jpeg")
+    async with session.post(f"{url}/api/productos/", data=form) as resp:
+        await resp.read()
+        return resp.status
+
+
+async def fase(session, url: str, segundos: float, subidas=None):
+    tiempos = []
+    detener = asyncio.Event()
+    sonda = asyncio.create_task(sondear_listado(session, url, detener, tiempos))
+    if subidas:
+        estados = await asyncio.gather(*subidas)
+        print(f"  subidas terminadas: {estados}")
+    else:
+        await asyncio.sleep(segundos)
+    detener.set()
+    await sonda
+    return tiempos
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--categoria-id", type=int, required=True)
+    parser.add_argument("--subidas", type=int, default=8)
+    parser.add_argument("--imagenes", type=int, default=6)
+    parser.add_argument("--segundos-base", type=float, default=5)
+    args = parser.parse_args()
+
+    imagenes = [imagen_jpeg(2400, 3200) for _ in range(args.imagenes)]
+    async with aiohttp.ClientSession() as session:
+        base = await fase(session, args.url, args.segundos_base)
+        carga = await fase(session, args.url, 0, [
+            subir_producto(session, args.url, args.categoria_id, imagenes)
+            for _ in range(args.subidas)
+        ])
+
+    for nombre, tiempos in (("sin subidas", base), ("durante subidas", carga)):
+        print(f"listado {nombre:<16} n={len(tiempos):4d}  p50={percentil(tiempos, 0.5):8.2f} ms  "
+              f"p99={percentil(tiempos, 0.99):8.2f} ms  max={max(tiempos, default=0):8.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
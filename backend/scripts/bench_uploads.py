@@ -0,0 +1,135 @@
+"""
+Rendimiento de /uploads: StaticFiles sin configurar (montaje anterior) frente a
+UploadsStaticFiles. Levanta ambos servidores uvicorn en este proceso sobre una
+copia de prueba de uploads (miniaturas y algunas imágenes grandes) y mide
+solicitudes por segundo y bytes transferidos en tres escenarios:
+
+- primera visita: GET sin cabeceras condicionales
+- revisita: GET con If-None-Match (lo que hace el navegador si no hay Cache-Control)
+- rango: GET con Range de una imagen grande
+
+Uso (desde backend/):
+    python -m scripts.bench_uploads --solicitudes 5000 --concurrencia 64
+"""
+import argparse
+import asyncio
+import io
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from PIL import Image
+
+from app.estaticos import UploadsStaticFiles
+
+
+def sembrar(directorio: Path, miniaturas: int, grandes: int) -> tuple:
+    carpeta = directorio / "blobs" / "ab"
+    carpeta.mkdir(parents=True)
+    chicas, pesadas = [], []
+    for i in range(miniaturas):
+        nombre = f"ab{i:062x}_w200.webp"
+        img = Image.effect_noise((200, 260), 48).convert("RGB")
+        img.save(carpeta / nombre, "WEBP", quality=80)
+        chicas.append(f"blobs/ab/{nombre}")
+    for i in range(grandes):
+        nombre = f"ab{i:062x}.webp"
+        buffer = io.BytesIO()
+        Image.effect_noise((1600, 2000), 48).convert("RGB").save(buffer, "WEBP", quality=90)
+        (carpeta / nombre).write_bytes(buffer.getvalue())
+        pesadas.append(f"blobs/ab/{nombre}")
+    return chicas, pesadas
+
+
+def crear_app(static_files) -> FastAPI:
+    app = FastAPI()
+    app.mount("/uploads", static_files, name="uploads")
+    return app
+
+
+async def iniciar(app: FastAPI, puerto: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, port=puerto, log_level="warning", access_log=False))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+async def medir(session, base: str, rutas: list, total: int, concurrencia: int, cabeceras) -> tuple:
+    etags = {}
+    if cabeceras == "if-none-match":
+        for ruta in rutas:
+            async with session.get(f"{base}/uploads/{ruta}") as resp:
+                etags[ruta] = resp.headers.get("etag")
+
+    cola = [random.choice(rutas) for _ in range(total)]
+    transferidos = 0
+    estados = {}
+
+    async def trabajador():
+        nonlocal transferidos
+        while cola:
+            ruta = cola.pop()
+            headers = {}
+            if cabeceras == "if-none-match":
+                headers["If-None-Match"] = etags[ruta]
+            elif cabeceras == "range":
+                headers["Range"] = "bytes=0-65535"
+            async with session.get(f"{base}/uploads/{ruta}", headers=headers) as resp:
+                transferidos += len(await resp.read())
+                estados[resp.status] = estados.get(resp.status, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+    return total / (time.perf_counter() - inicio), transferidos, estados
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--solicitudes", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, default=64)
+    parser.add_argument("--miniaturas", type=int, default=200)
+    parser.add_argument("--grandes", type=int, default=5)
+    args = parser.parse_args()
+
+    directorio = Path(tempfile.mkdtemp(prefix="bench_uploads_"))
+    try:
+        chicas, pesadas = sembrar(directorio, args.miniaturas, args.grandes)
+        servidores = {
+            "StaticFiles": await iniciar(crear_app(StaticFiles(directory=directorio)), 8811),
+            "UploadsStaticFiles": await iniciar(crear_app(UploadsStaticFiles(directory=directorio)), 8812),
+        }
+        bases = {"StaticFiles": "http://127.0.0.1:8811", "UploadsStaticFiles": "http://127.0.0.1:8812"}
+
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrencia)) as session:
+            async with session.get(f"{bases['UploadsStaticFiles']}/uploads/{chicas[0]}") as resp:
+                print("Cabeceras de UploadsStaticFiles:",
+                      {k: resp.headers.get(k) for k in ("Cache-Control", "ETag", "Content-Length")})
+
+            for escenario, rutas, cabeceras in (
+                ("primera visita", chicas, None),
+                ("revisita", chicas, "if-none-match"),
+                ("rango", pesadas, "range"),
+            ):
+                for nombre, base in bases.items():
+                    rps, transferidos, estados = await medir(
+                        session, base, rutas, args.solicitudes, args.concurrencia, cabeceras
+                    )
+                    print(f"{escenario:<15} {nombre:<19} {rps:9.0f} req/s  "
+                          f"{transferidos / 1024 / 1024:8.1f} MB  estados {estados}")
+
+        for server in servidores.values():
+            server.should_exit = True
+        await asyncio.sleep(0.5)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
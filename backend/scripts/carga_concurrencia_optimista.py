@@ -0,0 +1,245 @@
+"""
+Carga de concurrencia optimista sobre un solo usuario: muchas corrutinas (como
+pestañas o dispositivos) modifican a la vez sus favoritos y su carrito a través
+de la API.
+
+- favoritos sin If-Match: cada corrutina agrega y quita su propio producto. Los
+  choques se resuelven con los reintentos del servidor; al final los favoritos
+  deben coincidir con la última operación exitosa de cada corrutina (sin
+  actualizaciones perdidas) y los 409 son reintentos agotados.
+- favoritos con If-Match: GET (ETag) y POST con If-Match; ante un 412 se vuelve
+  a leer. Cada producto debe quedar agregado exactamente una vez.
+- carrito con If-Match: GET y agregar una unidad con If-Match, reintentando los
+  412. La cantidad final debe ser igual a los 200 y la versión avanzar lo mismo.
+
+Las peticiones llevan Origin como las del frontend y el ETag solo se lee si CORS
+lo expone (Access-Control-Expose-Headers), igual que fetch() en el navegador;
+antes de las fases se comprueba el preflight de un POST con If-Match.
+
+Informa los códigos de estado, la tasa de conflictos y la latencia por fase.
+Requiere el servidor corriendo (con OPTIMISTIC_MAX_RETRIES a gusto). Uso (desde backend/):
+    python -m scripts.carga_concurrencia_optimista --url http://localhost:8000 --corrutinas 50 --rondas 20
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+from typing import Optional
+
+import aiohttp
+from sqlalchemy import delete
+
+from app.config import FRONTEND_URL
+from app.models.productos import Producto
+from scripts.bench_paginacion import SessionLocal, engine
+from scripts.prueba_carrito_concurrente import borrar_datos, crear_datos
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+
+def etag_visible(headers) -> Optional[str]:
+    """El ETag tal como lo ve fetch() desde otro origen: solo si CORS lo expone."""
+    expuestos = {h.strip().lower() for h in headers.get("Access-Control-Expose-Headers", "").split(",")}
+    return headers.get("ETag") if "etag" in expuestos else None
+
+
+class Fase:
+    def __init__(self, nombre: str, origen: str):
+        self.nombre = nombre
+        self.origen = origen
+        self.estados = Counter()
+        self.tiempos = []
+        self.inicio = time.perf_counter()
+
+    async def pedir(self, session, metodo: str, url: str, headers: Optional[dict] = None, **kwargs):
+        inicio = time.perf_counter()
+        headers = {"Origin": self.origen, **(headers or {})}
+        async with session.request(metodo, url, headers=headers, **kwargs) as resp:
+            cuerpo = await resp.json()
+            self.tiempos.append((time.perf_counter() - inicio) * 1000)
+            self.estados[resp.status] += 1
+            return resp.status, etag_visible(resp.headers), cuerpo
+
+    def informe(self) -> None:
+        total = sum(self.estados.values())
+        duracion = time.perf_counter() - self.inicio
+        conflictos = self.estados[409] + self.estados[412]
+        print(f"\n{self.nombre}: {total} peticiones en {duracion:.2f} s ({total / duracion:.0f}/s)")
+        print(f"  estados: {dict(sorted(self.estados.items()))}, conflictos {conflictos / max(total, 1):.1%}")
+        print(f"  latencia ms: p50 {percentil(self.tiempos, 0.5):.1f}  p95 {percentil(self.tiempos, 0.95):.1f}"
+              f"  p99 {percentil(self.tiempos, 0.99):.1f}  max {max(self.tiempos, default=0):.1f}")
+
+
+def comprobar(condicion: bool, mensaje: str, fallas: list) -> None:
+    print(f"  [{'OK' if condicion else 'FALLA'}] {mensaje}")
+    if not condicion:
+        fallas.append(mensaje)
+
+
+async def crear_productos(categoria_id: int, cantidad: int) -> list:
+    async with SessionLocal() as db:
+        productos = [
+            Producto(nombre=f"Carga optimista {i}", descripcion="Prueba", precio=1000, cantidad=10,
+                     categoria_id=categoria_id)
+            for i in range(cantidad)
+        ]
+        db.add_all(productos)
+        await db.commit()
+        return [p.id for p in productos]
+
+
+async def borrar_productos(ids: list) -> None:
+    async with SessionLocal() as db:
+        await db.execute(delete(Producto).where(Producto.id.in_(ids)))
+        await db.commit()
+
+
+async def favoritos_sin_if_match(session, api: str, origen: str, usuario_id: int, productos: list, rondas: int,
+                                 fallas: list):
+    fase = Fase("favoritos sin If-Match (reintentos del servidor)", origen)
+    presentes = {}
+
+    async def corrutina(producto_id: int):
+        for _ in range(rondas):
+            for metodo, presente in (("POST", True), ("DELETE", False)):
+                estado, _, _ = await fase.pedir(session, metodo, f"{api}/favorites/{producto_id}",
+                                                json={"user_id": usuario_id})
+                if estado == 200:
+                    presentes[producto_id] = presente
+        # Deja la mitad agregados para que el estado final no sea trivial.
+        if producto_id % 2:
+            estado, _, _ = await fase.pedir(session, "POST", f"{api}/favorites/{producto_id}",
+                                            json={"user_id": usuario_id})
+            if estado == 200:
+                presentes[producto_id] = True
+
+    await asyncio.gather(*(corrutina(p) for p in productos))
+    fase.informe()
+    _, _, cuerpo = await fase.pedir(session, "GET", f"{api}/favorites/{usuario_id}")
+    esperados = {p for p, presente in presentes.items() if presente}
+    comprobar(sorted(cuerpo["favorites"]) == sorted(esperados),
+              f"favoritos finales = última operación exitosa de cada corrutina ({len(esperados)})", fallas)
+    # Un 400 solo puede venir de quitar un favorito cuyo agregado dio 409 (o al revés).
+    otros = set(fase.estados) - {200, 400, 409}
+    comprobar(not otros and fase.estados[400] <= fase.estados[409],
+              f"solo 200 y 409 por reintentos agotados: {dict(fase.estados)}", fallas)
+    for p in esperados:
+        await fase.pedir(session, "DELETE", f"{api}/favorites/{p}", json={"user_id": usuario_id})
+
+
+async def favoritos_con_if_match(session, api: str, origen: str, usuario_id: int, productos: list, fallas: list):
+    fase = Fase("favoritos con If-Match (412 y nueva lectura en el cliente)", origen)
+    agregados = Counter()
+
+    async def corrutina(producto_id: int):
+        for _ in range(1000):
+            _, etag, _ = await fase.pedir(session, "GET", f"{api}/favorites/{usuario_id}")
+            estado, _, _ = await fase.pedir(session, "POST", f"{api}/favorites/{producto_id}",
+                                            json={"user_id": usuario_id}, headers={"If-Match": etag})
+            if estado == 200:
+                agregados[producto_id] += 1
+                return
+            if estado != 412:
+                return
+
+    await asyncio.gather(*(corrutina(p) for p in productos))
+    fase.informe()
+    _, _, cuerpo = await fase.pedir(session, "GET", f"{api}/favorites/{usuario_id}")
+    comprobar(sorted(cuerpo["favorites"]) == sorted(productos) and set(agregados.values()) == {1},
+              f"cada uno de los {len(productos)} productos agregado exactamente una vez", fallas)
+
+    # Un ETag viejo nunca se acepta.
+    estado, _, _ = await fase.pedir(session, "DELETE", f"{api}/favorites/{productos[0]}",
+                                    json={"user_id": usuario_id}, headers={"If-Match": '"0"'})
+    comprobar(estado == 412, "If-Match con una versión vieja responde 412", fallas)
+    estado, _, _ = await fase.pedir(session, "DELETE", f"{api}/favorites/{productos[0]}",
+                                    json={"user_id": usuario_id}, headers={"If-Match": "no-es-un-etag"})
+    comprobar(estado == 400, "If-Match malformado responde 400", fallas)
+
+
+async def carrito_con_if_match(session, api: str, origen: str, usuario_id: int, producto_id: int, corrutinas: int,
+                               rondas: int, fallas: list):
+    fase = Fase("carrito con If-Match (412 y nueva lectura en el cliente)", origen)
+    _, etag_inicial, _ = await fase.pedir(session, "GET", f"{api}/carrito/{usuario_id}")
+    exitos = Counter()
+
+    async def corrutina(n: int):
+        for _ in range(rondas):
+            for _ in range(1000):
+                _, etag, _ = await fase.pedir(session, "GET", f"{api}/carrito/{usuario_id}")
+                estado, _, _ = await fase.pedir(
+                    session, "POST", f"{api}/carrito/agregar/{producto_id}",
+                    json={"cart_item": {"user_id": usuario_id, "cantidad": 1, "color": "negro", "talla": "M"}},
+                    headers={"If-Match": etag},
+                )
+                if estado != 412:
+                    exitos[estado] += 1
+                    break
+
+    await asyncio.gather(*(corrutina(n) for n in range(corrutinas)))
+    fase.informe()
+    _, etag_final, cuerpo = await fase.pedir(session, "GET", f"{api}/carrito/{usuario_id}")
+    cantidad = sum(i["cantidad"] for i in cuerpo["carrito"] if (i["color"], i["talla"]) == ("negro", "M"))
+    comprobar(exitos[200] == corrutinas * rondas and cantidad == exitos[200],
+              f"{cantidad} unidades en el carrito, {exitos[200]} agregados aceptados", fallas)
+    avance = int(etag_final.strip('"')) - int(etag_inicial.strip('"'))
+    comprobar(avance == exitos[200], f"la versión avanzó {avance}, una por cambio", fallas)
+
+
+async def comprobar_cors(session, api: str, origen: str, usuario_id: int, producto_id: int, fallas: list) -> None:
+    """Lo que necesita el navegador para usar If-Match desde el frontend."""
+    print("\nCORS")
+    async with session.options(f"{api}/carrito/agregar/{producto_id}", headers={
+        "Origin": origen,
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "content-type,if-match",
+    }) as resp:
+        permitidos = {h.strip().lower() for h in resp.headers.get("Access-Control-Allow-Headers", "").split(",")}
+        comprobar(resp.status == 200 and "if-match" in permitidos,
+                  f"el preflight de un POST con If-Match se acepta ({resp.status})", fallas)
+    fase = Fase("CORS", origen)
+    for recurso in ("carrito", "favorites"):
+        _, etag, _ = await fase.pedir(session, "GET", f"{api}/{recurso}/{usuario_id}")
+        comprobar(etag is not None, f"GET /{recurso} expone el ETag al frontend", fallas)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--corrutinas", type=int, default=50)
+    parser.add_argument("--rondas", type=int, default=20, help="Operaciones por corrutina en cada fase")
+    parser.add_argument("--origen", default=FRONTEND_URL, help="Origin de las peticiones (el del frontend)")
+    args = parser.parse_args()
+    api = f"{args.url}/api"
+
+    ids = await crear_datos()
+    categoria_id, producto_id, usuario_id = ids
+    productos = await crear_productos(categoria_id, args.corrutinas)
+    fallas = []
+    try:
+        conector = aiohttp.TCPConnector(limit=args.corrutinas)
+        async with aiohttp.ClientSession(connector=conector) as session:
+            await comprobar_cors(session, api, args.origen, usuario_id, producto_id, fallas)
+            # Sin el ETag visible las fases con If-Match no tienen qué enviar.
+            if not fallas:
+                await favoritos_sin_if_match(session, api, args.origen, usuario_id, productos, args.rondas, fallas)
+                await favoritos_con_if_match(session, api, args.origen, usuario_id, productos, fallas)
+                await carrito_con_if_match(session, api, args.origen, usuario_id, producto_id, args.corrutinas,
+                                           args.rondas, fallas)
+    finally:
+        await borrar_productos(productos)
+        await borrar_datos(ids)
+        await engine.dispose()
+
+    if fallas:
+        print(f"\n{len(fallas)} comprobaciones fallaron")
+        sys.exit(1)
+    print("\nTodas las comprobaciones pasaron.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
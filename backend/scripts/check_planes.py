@@ -0,0 +1,136 @@
+"""
+Revisa con EXPLAIN los planes de las consultas del listado de productos sobre
+un catálogo sembrado, sin filtro, por categoría, por género (categoria_id IN) y
+con búsqueda. Falla (código de salida 1) si alguna consulta:
+
+- sin la ventana de conteo (páginas por cursor y total_mode=estimate) vuelve a
+  un Seq Scan sobre productos seguido de un Sort;
+- con count(*) OVER () (la primera página por defecto, la más frecuente) lee
+  productos más de una vez. Esta tiene que leer todas las filas filtradas de
+  todos modos, así que un Seq Scan sin búsqueda no es una regresión;
+- con búsqueda recorre productos con un Seq Scan en vez de los índices GIN.
+
+Uso (desde backend/, con las migraciones aplicadas):
+    python -m scripts.check_planes --productos 50000
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from sqlalchemy import text
+
+from app.crud.productos import ORDENAMIENTOS, build_page_query, _encode_producto_cursor
+from app.helpers import decode_cursor
+from app.registro_categorias import refresh_categorias
+from scripts.bench_paginacion import SessionLocal, sembrar_catalogo, CATEGORIA_BENCH
+
+BUSQUEDA = "camisa azul"
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _lecturas(plan, tipo: str = None) -> int:
+    """Nodos que leen productos (de tipo `tipo`, si se indica)."""
+    return sum(
+        1 for n in _nodos(plan)
+        if n.get("Relation Name") == "productos" and (tipo is None or n["Node Type"] == tipo)
+    )
+
+
+def es_regresion(plan) -> bool:
+    """True si hay un Sort cuyo subárbol lee productos con un Seq Scan."""
+    for nodo in _nodos(plan):
+        if nodo["Node Type"] in ("Sort", "Incremental Sort") and _lecturas(nodo, "Seq Scan"):
+            return True
+    return False
+
+
+def regresiones_del_plan(plan, con_total: bool, busqueda: bool) -> list:
+    problemas = []
+    if con_total:
+        if _lecturas(plan) > 1:
+            problemas.append("lee productos más de una vez")
+    elif es_regresion(plan):
+        problemas.append("Seq Scan + Sort")
+    if busqueda and _lecturas(plan, "Seq Scan"):
+        problemas.append("búsqueda sin índice")
+    return problemas
+
+
+async def explain(session, statement):
+    conn = await session.connection()
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[nombre] for nombre in compiled.positiontup)
+    result = await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + compiled.string, params)
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def resumen(plan) -> str:
+    return " -> ".join(
+        f"{n['Node Type']}" + (f"({n['Index Name']})" if "Index Name" in n else "")
+        for n in _nodos(plan)
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--productos", type=int, default=50_000)
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    regresiones = []
+    async with SessionLocal() as session:
+        await sembrar_catalogo(session, args.productos)
+        await session.execute(text("ANALYZE productos"))
+        await refresh_categorias(session)
+
+        filtros = [
+            ("sin filtro", {}),
+            ("categoria", {"categoria": CATEGORIA_BENCH}),
+            # Todas las categorías del género: categoria_id IN (...) con varios IDs si hay más de una.
+            ("genero", {"genero": "Unisex"}),
+            ("búsqueda", {"search_query": BUSQUEDA}),
+        ]
+        for sortBy in ORDENAMIENTOS:
+            for nombre_filtro, filtro in filtros:
+                casos = [
+                    ("primera página con total", build_page_query(
+                        sortBy=sortBy, limit=args.limit, with_total=True, **filtro
+                    ), True),
+                ]
+                # Cursor real tomado de la primera página para revisar también la variante keyset.
+                primera = build_page_query(sortBy=sortBy, limit=args.limit, with_total=False, **filtro)
+                filas = (await session.execute(primera)).all()
+                casos.append(("primera página", primera, False))
+                if filas:
+                    payload = decode_cursor(_encode_producto_cursor(filas[-1], sortBy))
+                    casos.append(("cursor", build_page_query(
+                        sortBy=sortBy, limit=args.limit, cursor_payload=payload, with_total=False, **filtro
+                    ), False))
+
+                for modo, statement, con_total in casos:
+                    plan = await explain(session, statement)
+                    nombre = f"sortBy={sortBy} {nombre_filtro} {modo}"
+                    problemas = regresiones_del_plan(plan, con_total, "search_query" in filtro)
+                    if problemas:
+                        regresiones.append(f"{nombre}: {', '.join(problemas)}")
+                    print(f"[{'REGRESIÓN' if problemas else 'OK'}] {nombre}: {resumen(plan)}")
+
+    if regresiones:
+        print(f"\n{len(regresiones)} consultas con regresiones de plan:")
+        for nombre in regresiones:
+            print(f"  - {nombre}")
+        sys.exit(1)
+    print("\nTodos los planes usan índices para ordenar y filtrar.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Genera las variantes reducidas (IMAGE_VARIANT_WIDTHS) de las imágenes de los
+productos existentes y las registra en productos.image_variants.
+Recorre la tabla por lotes ordenados por id y se puede reanudar con --desde-id.
+
+Uso (desde backend/):
+    python -m scripts.generar_variantes --lote 200
+    python -m scripts.generar_variantes --forzar   # regenera aunque ya existan
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy.future import select
+
+from app.almacenamiento import almacen
+from app.database import async_session
+from app.helpers import parse_image_urls
+from app.imagenes import BLOBS_TMP_DIR, build_variants, get_image_executor, shutdown_image_executor, variant_urls
+from app.models.productos import Producto
+
+
+async def generar(clave: str) -> dict:
+    """Genera las variantes de una imagen del almacenamiento y las publica junto a ella."""
+    loop = asyncio.get_running_loop()
+    if almacen.local:
+        # Las variantes se escriben directamente junto al original.
+        return await loop.run_in_executor(get_image_executor(), build_variants, almacen.ruta(clave))
+
+    trabajo = Path(tempfile.mkdtemp(dir=BLOBS_TMP_DIR))
+    try:
+        nombre = clave.rsplit("/", 1)[-1]
+        carpeta = clave[:-len(nombre)]
+        await almacen.descargar(clave, trabajo / nombre)
+        variantes = await loop.run_in_executor(get_image_executor(), build_variants, trabajo / nombre)
+        await asyncio.gather(*[
+            almacen.put_file(carpeta + archivo, trabajo / archivo, mover=True)
+            for archivo in variantes.values() if archivo != nombre
+        ])
+        return variantes
+    finally:
+        shutil.rmtree(trabajo, ignore_errors=True)
+
+
+async def procesar_producto(producto: Producto, forzar: bool) -> int:
+    variantes = dict(producto.image_variants or {})
+    pendientes = {}
+    for url in parse_image_urls(producto.image_url):
+        if url in variantes and not forzar:
+            continue
+        clave = almacen.clave_de_url(url)
+        if not clave or await almacen.stat(clave) is None:
+            print(f"Producto {producto.id}: no existe {url}")
+            continue
+        pendientes[url] = asyncio.ensure_future(generar(clave))
+
+    for url, futuro in pendientes.items():
+        try:
+            variantes[url] = variant_urls(url, await futuro)
+        except Exception as e:
+            print(f"Producto {producto.id}: error al generar variantes de {url}: {e}")
+    if pendientes:
+        producto.image_variants = variantes
+    return len(pendientes)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lote", type=int, default=200)
+    parser.add_argument("--desde-id", type=int, default=0)
+    parser.add_argument("--forzar", action="store_true")
+    args = parser.parse_args()
+
+    ultimo_id = args.desde_id
+    productos_total = imagenes_total = 0
+    inicio = time.perf_counter()
+    async with async_session() as db:
+        while True:
+            result = await db.execute(
+                select(Producto).where(Producto.id > ultimo_id).order_by(Producto.id).limit(args.lote)
+            )
+            productos = result.scalars().all()
+            if not productos:
+                break
+            conteos = await asyncio.gather(*[procesar_producto(p, args.forzar) for p in productos])
+            await db.commit()
+            db.expunge_all()
+
+            ultimo_id = productos[-1].id
+            productos_total += len(productos)
+            imagenes_total += sum(conteos)
+            print(f"Hasta id {ultimo_id}: {productos_total} productos, {imagenes_total} imágenes procesadas")
+
+    shutdown_image_executor()
+    await almacen.cerrar()
+    print(f"Listo en {time.perf_counter() - inicio:.1f} s. Para reanudar: --desde-id {ultimo_id}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""
+Importación masiva de productos desde la línea de comandos.
+
+Uso (desde backend/):
+    python -m scripts.importar_productos coleccion.csv --imagenes fotos.zip
+    python -m scripts.importar_productos coleccion.ndjson --lote 2000 --workers 8
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.config import IMPORT_BATCH_SIZE, IMAGE_WORKERS
+from app.imagenes import get_image_executor, shutdown_image_executor
+from app.database import async_session
+from app.importacion import importar_productos, detectar_formato
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archivo", help="Archivo CSV o NDJSON con los productos")
+    parser.add_argument("--imagenes", help="ZIP con las imágenes referenciadas en la columna 'imagenes'")
+    parser.add_argument("--formato", choices=["csv", "ndjson"])
+    parser.add_argument("--lote", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS,
+                        help="Procesos que codifican las imágenes (por defecto IMAGE_WORKERS)")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers debe ser al menos 1")
+
+    formato = args.formato or detectar_formato(args.archivo)
+    if not formato:
+        parser.error("No se pudo deducir el formato; use --formato")
+
+    get_image_executor(args.workers)
+    inicio = time.perf_counter()
+    with open(args.archivo, encoding="utf-8-sig", newline="") as archivo:
+        async with async_session() as db:
+            resumen = await importar_productos(
+                db, archivo, formato, zip_path=args.imagenes,
+                batch_size=args.lote
+            )
+    shutdown_image_executor()
+    duracion = time.perf_counter() - inicio
+
+    for error in resumen["errores"]:
+        print(json.dumps(error, ensure_ascii=False))
+    print(f"Insertados: {resumen['insertados']}  Con errores: {len(resumen['errores'])}  "
+          f"Duración: {duracion:.2f} s ({resumen['insertados'] / duracion:.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+Ejercita el almacén de carritos con escritura diferida y compara su throughput
+con las mutaciones directas en PostgreSQL.
+
+Comprueba que las mutaciones concurrentes no se pierden, que no escriben en
+cart_items hasta el volcado, que un volcado escribe todo en una transacción,
+que un almacén lleno no descarta el carrito que está mutando, las métricas de
+atraso, que extraer (finalizar_orden) saca el carrito y sus pendientes en un
+paso, y que la versión del carrito (ETag) avanza con cada cambio, rechaza
+un If-Match viejo con 412 y se vuelca a usuarios.carrito_version. Con --backend redis además compara el script Lua con la lógica en
+Python y verifica que una reserva vencida (proceso caído a mitad de un volcado)
+la retoma otro proceso.
+
+Contra Redis se puede usar un servidor local:
+    docker run -p 6379:6379 redis:7 redis-server --appendonly yes
+
+Uso (desde backend/):
+    python -m scripts.prueba_almacen_carritos --backend memoria --operaciones 2000
+    CART_STORE_REDIS_URL=redis://localhost:6379/15 python -m scripts.prueba_almacen_carritos --backend redis
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from app.almacen_carritos import (
+    AlmacenCarritos, AlmacenCarritosMemoria, AlmacenCarritosRedis, _MUTAR, _op, aplicar_en_lineas,
+)
+from fastapi import HTTPException
+
+from app.crud.carrito import (
+    bloquear_carrito, obtener_carrito, obtener_carrito_versionado, reemplazar_carritos, vaciar_carrito,
+)
+from app.database import async_session, engine
+from scripts.prueba_carrito_concurrente import borrar_datos, crear_datos
+
+
+def comprobar(condicion: bool, mensaje: str, fallas: list) -> None:
+    print(f"  [{'OK' if condicion else 'FALLA'}] {mensaje}")
+    if not condicion:
+        fallas.append(mensaje)
+
+
+async def en_db(usuario_id: int) -> dict:
+    async with async_session() as db:
+        return {(i["color"], i["talla"]): i["cantidad"] for i in await obtener_carrito(db, usuario_id)}
+
+
+async def version_en_db(usuario_id: int) -> int:
+    async with async_session() as db:
+        return (await obtener_carrito_versionado(db, usuario_id))[1]
+
+
+async def martillar(almacen, usuario_id: int, producto_id: int, operaciones: int, concurrencia: int) -> float:
+    """Agrega `operaciones` unidades desde `concurrencia` corrutinas; devuelve operaciones por segundo."""
+    async def pestana(n: int):
+        for _ in range(operaciones // concurrencia):
+            async with async_session() as db:
+                await almacen.agregar(db, usuario_id, producto_id, "negro", "M", 1)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(pestana(n) for n in range(concurrencia)))
+    return operaciones // concurrencia * concurrencia / (time.perf_counter() - inicio)
+
+
+async def comparar_lua(almacen: AlmacenCarritosRedis, fallas: list) -> None:
+    clave = "carrito:prueba-lua"
+    for _ in range(50):
+        lineas = []
+        await almacen.redis.ejecutar("SET", clave, almacen._codificar([], 0))
+        operaciones = [
+            _op(random.choice(["add", "set", "update", "remove"]), random.randint(1, 4),
+                random.choice(["rojo", "azul"]), random.choice(["S", "M"]), random.randint(1, 5))
+            for _ in range(random.randint(1, 20))
+        ]
+        afectadas = aplicar_en_lineas(lineas, operaciones)
+        resultado = await almacen._script(_MUTAR, [clave, "carritos:prueba-lua"],
+                                          ["x", json.dumps(operaciones), 0, 60, ""])
+        if (almacen._lineas(resultado[0]) != lineas or resultado[1] != afectadas
+                or resultado[2] != (1 if afectadas else 0)
+                or almacen._decodificar(await almacen.redis.ejecutar("GET", clave)) != (lineas, resultado[2])):
+            comprobar(False, f"Lua y Python difieren para {operaciones}", fallas)
+            break
+    else:
+        comprobar(True, "el script Lua coincide con aplicar_en_lineas", fallas)
+    await almacen.redis.ejecutar("DEL", clave, "carritos:prueba-lua")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["memoria", "redis"], default="memoria")
+    parser.add_argument("--operaciones", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--aof", action="store_true", help="Exigir appendonly en Redis, como en producción")
+    args = parser.parse_args()
+
+    def crear():
+        # Intervalo largo: los volcados de la prueba son explícitos.
+        if args.backend == "memoria":
+            return AlmacenCarritosMemoria(intervalo=3600)
+        return AlmacenCarritosRedis(intervalo=3600, reserva=1, requerir_aof=args.aof)
+
+    almacen = crear()
+    await almacen.iniciar()
+    ids = await crear_datos()
+    _, producto_id, usuario_id = ids
+    fallas = []
+    try:
+        por_segundo = await martillar(AlmacenCarritos(), usuario_id, producto_id, args.operaciones, args.concurrencia)
+        print(f"  postgres: {por_segundo:.0f} mutaciones/s")
+        async with async_session() as db:
+            await AlmacenCarritos().eliminar(db, usuario_id, producto_id, "negro", "M")
+
+        por_segundo = await martillar(almacen, usuario_id, producto_id, args.operaciones, args.concurrencia)
+        print(f"  {args.backend}: {por_segundo:.0f} mutaciones/s")
+        esperado = args.operaciones // args.concurrencia * args.concurrencia
+        async with async_session() as db:
+            en_almacen, version = await almacen.obtener(db, usuario_id)
+        comprobar(en_almacen == [{"producto_id": producto_id, "cantidad": esperado, "color": "negro", "talla": "M"}],
+                  f"{esperado} incrementos concurrentes sin pérdidas", fallas)
+        version_inicial = await version_en_db(usuario_id)
+        comprobar(version == version_inicial + esperado, f"versión {version}: una por mutación", fallas)
+
+        async with async_session() as db:
+            try:
+                await almacen.agregar(db, usuario_id, producto_id, "negro", "M", 1, version=version - 1)
+                comprobar(False, "If-Match con una versión vieja responde 412", fallas)
+            except HTTPException as e:
+                comprobar(e.status_code == 412, "If-Match con una versión vieja responde 412", fallas)
+            _, sin_cambio = await almacen.eliminar(db, usuario_id, producto_id, "verde", "XL", version=version)
+        comprobar(sin_cambio == version, "una mutación que no cambia el carrito no avanza la versión", fallas)
+        comprobar(await en_db(usuario_id) == {}, "cart_items no se escribe antes del volcado", fallas)
+
+        stats = await almacen.stats()
+        comprobar(stats["pendientes"] == 1 and stats["lag_segundos"] > 0,
+                  f"métricas: {stats['pendientes']} pendiente, atraso {stats['lag_segundos']} s", fallas)
+
+        inicio_transacciones = almacen.transacciones
+        comprobar(await almacen.volcar() == 1, "el volcado escribe el carrito", fallas)
+        comprobar(almacen.transacciones - inicio_transacciones == 1,
+                  f"{esperado} mutaciones en una transacción", fallas)
+        comprobar(await en_db(usuario_id) == {("negro", "M"): esperado}, "cart_items tiene el carrito volcado", fallas)
+        comprobar(await version_en_db(usuario_id) == version, "el volcado escribe carrito_version", fallas)
+        comprobar((await almacen.stats())["pendientes"] == 0, "sin pendientes después del volcado", fallas)
+
+        async with async_session() as db:
+            await almacen.agregar(db, usuario_id, producto_id, "azul", "S", 2)
+            comprobar(await almacen.fijar(db, usuario_id, producto_id, "rojo", "S", 1) is None,
+                      "fijar una línea inexistente devuelve None", fallas)
+        comprobar(await almacen.volcar() == 1 and await en_db(usuario_id) == {("negro", "M"): esperado, ("azul", "S"): 2},
+                  "el siguiente volcado escribe los cambios nuevos", fallas)
+
+        if args.backend == "memoria":
+            # Almacén lleno: el carrito recién cargado no se poda antes de aplicarle la mutación.
+            lleno = AlmacenCarritosMemoria(max_carritos=0, intervalo=3600)
+            async with async_session() as db:
+                lineas, _ = await lleno.agregar(db, usuario_id, producto_id, "gris", "S", 1)
+            comprobar(("gris", "S") in {(l["color"], l["talla"]) for l in lineas},
+                      "mutar con el almacén lleno no pierde el carrito recién cargado", fallas)
+            await lleno.extraer(usuario_id)
+
+        if args.backend == "redis":
+            await comparar_lua(almacen, fallas)
+
+            # Un proceso reserva el carrito y "muere" sin confirmar; otro lo retoma al vencer la reserva.
+            async with async_session() as db:
+                await almacen.eliminar(db, usuario_id, producto_id, "azul", "S")
+            caido = await almacen._tomar(almacen.lote)
+            comprobar(usuario_id in caido, "reserva del carrito pendiente", fallas)
+            otro = crear()
+            comprobar(await otro.volcar() == 0, "un carrito reservado no se vuelca desde otro proceso", fallas)
+            await asyncio.sleep(1.1)
+            comprobar(await otro.volcar() == 1 and await en_db(usuario_id) == {("negro", "M"): esperado},
+                      "la reserva vencida se retoma", fallas)
+            # El proceso "caído" despierta y escribe lo que había tomado: no debe pisar el volcado posterior.
+            async with async_session() as db:
+                escritas = await reemplazar_carritos(
+                    db, {u: lineas for u, (_, lineas, _) in caido.items()}, omitir_inexistentes=True,
+                    versiones={u: v for u, (_, _, v) in caido.items()},
+                )
+                await db.commit()
+            comprobar(escritas == 0 and await en_db(usuario_id) == {("negro", "M"): esperado},
+                      "un volcado atrasado no se escribe", fallas)
+            await otro.redis.cerrar()
+
+        # finalizar_orden: el carrito sale del almacén con la fila bloqueada y un
+        # volcado posterior no vuelve a escribir lo pedido.
+        async with async_session() as db:
+            await almacen.agregar(db, usuario_id, producto_id, "verde", "L", 3)
+        async with async_session() as db:
+            await bloquear_carrito(db, usuario_id)
+            extraido = await almacen.extraer(usuario_id)
+            pedido = await vaciar_carrito(db, usuario_id, extraido)
+            await db.commit()
+        comprobar(("verde", "L", 3) in {(i["color"], i["talla"], i["cantidad"]) for i in pedido},
+                  "el pedido incluye la mutación no volcada", fallas)
+        comprobar((await almacen.stats())["pendientes"] == 0 and await almacen.volcar() == 0,
+                  "el carrito extraído ya no está pendiente", fallas)
+        comprobar(await en_db(usuario_id) == {} and await version_en_db(usuario_id) > extraido[1],
+                  "cart_items vacío y carrito_version por encima de la del almacén", fallas)
+    finally:
+        await almacen.extraer(usuario_id)
+        await almacen.detener()
+        await borrar_datos(ids)
+        await engine.dispose()
+
+    if fallas:
+        print(f"\n{len(fallas)} comprobaciones fallaron")
+        sys.exit(1)
+    print("\nTodas las comprobaciones pasaron.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+Ejercita un backend de almacenamiento con las operaciones que usa la API y
+verifica los resultados: put de bytes y en streaming, subida por partes,
+get en bloques, stat, listado reanudable, mover, tocar, URL firmada y borrado.
+
+Contra S3 se puede usar un MinIO local:
+    docker run -p 9000:9000 -e MINIO_ROOT_USER=minio -e MINIO_ROOT_PASSWORD=minio123 \\
+        minio/minio server /data
+    (crear el bucket STORAGE_S3_BUCKET en la consola o con `mc mb`)
+
+Uso (desde backend/):
+    python -m scripts.prueba_almacenamiento --backend local
+    STORAGE_S3_ACCESS_KEY=minio STORAGE_S3_SECRET_KEY=minio123 \\
+        python -m scripts.prueba_almacenamiento --backend s3 --mb 40
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import aiohttp
+
+from app.almacenamiento import AlmacenamientoLocal, crear_almacenamiento
+
+
+async def leer(almacen, clave: str) -> bytes:
+    return b"".join([chunk async for chunk in almacen.get(clave)])
+
+
+async def bloques(datos: bytes, tamano: int = 256 * 1024):
+    for inicio in range(0, len(datos), tamano):
+        await asyncio.sleep(0)
+        yield datos[inicio:inicio + tamano]
+
+
+def comprobar(condicion: bool, mensaje: str, fallas: list) -> None:
+    print(f"  [{'OK' if condicion else 'FALLA'}] {mensaje}")
+    if not condicion:
+        fallas.append(mensaje)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["local", "s3"], default="local")
+    parser.add_argument("--mb", type=float, default=20, help="Tamaño del archivo de la subida por partes")
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="prueba_almacenamiento_"))
+    almacen = AlmacenamientoLocal(tmp / "uploads") if args.backend == "local" else crear_almacenamiento("s3")
+    prefijo = f"prueba/{uuid.uuid4().hex}/"
+    fallas = []
+    print(f"Backend {args.backend}, prefijo {prefijo}")
+
+    try:
+        pequeno = os.urandom(100 * 1024)
+        await almacen.put(prefijo + "a/pequeno.webp", pequeno)
+        comprobar(await leer(almacen, prefijo + "a/pequeno.webp") == pequeno, "put de bytes y get", fallas)
+
+        objeto = await almacen.stat(prefijo + "a/pequeno.webp")
+        comprobar(objeto is not None and objeto.tamano == len(pequeno), "stat con el tamaño", fallas)
+        comprobar(await almacen.stat(prefijo + "no-existe") is None, "stat de una clave inexistente", fallas)
+
+        grande = os.urandom(int(args.mb * 1024 * 1024))
+        inicio = time.perf_counter()
+        await almacen.put(prefijo + "b/stream.bin", bloques(grande))
+        duracion = time.perf_counter() - inicio
+        recibido = await leer(almacen, prefijo + "b/stream.bin")
+        comprobar(hashlib.sha256(recibido).digest() == hashlib.sha256(grande).digest(),
+                  f"put en streaming de {args.mb} MB ({len(grande) / duracion / 1e6:.1f} MB/s)", fallas)
+
+        archivo = tmp / "grande.bin"
+        archivo.write_bytes(grande)
+        inicio = time.perf_counter()
+        await almacen.put_file(prefijo + "b/archivo.bin", archivo)
+        duracion = time.perf_counter() - inicio
+        comprobar((await almacen.stat(prefijo + "b/archivo.bin")).tamano == len(grande),
+                  f"put_file por partes ({len(grande) / duracion / 1e6:.1f} MB/s)", fallas)
+        comprobar(archivo.exists(), "put_file sin mover conserva el archivo local", fallas)
+
+        await almacen.put_file(prefijo + "b/movido.bin", archivo, mover=True)
+        comprobar(not archivo.exists(), "put_file con mover=True elimina el archivo local", fallas)
+
+        claves = [o.clave async for o in almacen.listar(prefijo)]
+        comprobar(claves == sorted(claves) and len(claves) == 4, f"listar en orden ({len(claves)} claves)", fallas)
+        desde = [o.clave async for o in almacen.listar(prefijo, desde=claves[1])]
+        comprobar(desde == claves[2:], "listar a partir de una clave", fallas)
+
+        await almacen.mover(prefijo + "a/pequeno.webp", prefijo + "c/pequeno.webp")
+        comprobar(await almacen.stat(prefijo + "a/pequeno.webp") is None
+                  and await leer(almacen, prefijo + "c/pequeno.webp") == pequeno, "mover", fallas)
+
+        antes = (await almacen.stat(prefijo + "c/pequeno.webp")).modificado
+        await asyncio.sleep(1.1)
+        await almacen.tocar(prefijo + "c/pequeno.webp")
+        comprobar((await almacen.stat(prefijo + "c/pequeno.webp")).modificado > antes, "tocar renueva la fecha", fallas)
+
+        if args.backend == "s3":
+            url = await almacen.url_publica(prefijo + "c/pequeno.webp")
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    cuerpo = await resp.read()
+                    comprobar(resp.status == 200 and cuerpo == pequeno, "URL firmada", fallas)
+                    comprobar(resp.headers.get("Content-Type") == "image/webp", "content-type por extensión", fallas)
+            comprobar(url == await almacen.url_publica(prefijo + "c/pequeno.webp"),
+                      "la URL firmada se repite dentro de la ventana", fallas)
+
+        try:
+            await leer(almacen, prefijo + "no-existe")
+            comprobar(False, "get de una clave inexistente lanza FileNotFoundError", fallas)
+        except FileNotFoundError:
+            comprobar(True, "get de una clave inexistente lanza FileNotFoundError", fallas)
+    finally:
+        eliminados = await almacen.eliminar_prefijo(prefijo)
+        print(f"  limpieza: {eliminados} objetos eliminados")
+        await almacen.cerrar()
+
+    if fallas:
+        print(f"\n{len(fallas)} comprobaciones fallaron")
+        sys.exit(1)
+    print("\nTodas las comprobaciones pasaron.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
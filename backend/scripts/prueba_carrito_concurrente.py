@@ -0,0 +1,119 @@
+"""
+Comprueba que las mutaciones concurrentes del carrito no pierden actualizaciones.
+
+Simula varias pestañas del mismo usuario: cada corrutina abre su propia sesión
+(como una petición) y agrega unidades a la misma línea y a una línea propia,
+mientras otra corrutina cambia y elimina una línea aparte. Al final cada línea
+debe tener exactamente las unidades agregadas. Con el carrito en JSONB
+(leer, editar en Python, escribir) la mayoría de los incrementos se perdían.
+
+Uso (desde backend/):
+    python -m scripts.prueba_carrito_concurrente --pestanas 20 --operaciones 50
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete
+
+from app.crud.carrito import agregar_item, eliminar_item, fijar_cantidad, obtener_carrito
+from app.models.categorias import Categoria
+from app.models.productos import Producto
+from app.models.usuarios import Usuario
+from scripts.bench_paginacion import SessionLocal, engine
+
+
+async def crear_datos() -> tuple:
+    """Crea una categoría, un producto y un usuario de prueba; devuelve sus IDs."""
+    marca = uuid.uuid4().hex[:8]
+    async with SessionLocal() as db:
+        categoria = Categoria(nombre=f"PruebaCarrito {marca}", descripcion="Prueba de concurrencia", genero="Unisex")
+        db.add(categoria)
+        await db.flush()
+        producto = Producto(nombre=f"Producto {marca}", descripcion="Prueba", precio=1000, cantidad=10,
+                            categoria_id=categoria.id)
+        usuario = Usuario(nombre=f"prueba-{marca}", correo=f"prueba-{marca}@example.com", contraseña="-",
+                          metodo_pago=[], rol="usuario", favoritos=[])
+        db.add_all([producto, usuario])
+        await db.commit()
+        return categoria.id, producto.id, usuario.id
+
+
+async def borrar_datos(ids: tuple) -> None:
+    categoria_id, producto_id, usuario_id = ids
+    async with SessionLocal() as db:
+        await db.execute(delete(Usuario).where(Usuario.id == usuario_id))
+        await db.execute(delete(Producto).where(Producto.id == producto_id))
+        await db.execute(delete(Categoria).where(Categoria.id == categoria_id))
+        await db.commit()
+
+
+async def pestana(usuario_id: int, producto_id: int, numero: int, operaciones: int) -> None:
+    for _ in range(operaciones):
+        async with SessionLocal() as db:
+            await agregar_item(db, usuario_id, producto_id, "negro", "M", 1)
+            await db.commit()
+        async with SessionLocal() as db:
+            await agregar_item(db, usuario_id, producto_id, f"pestana-{numero}", "S", 1)
+            await db.commit()
+
+
+async def editor(usuario_id: int, producto_id: int, operaciones: int) -> None:
+    # Cambia y elimina una línea que las pestañas no tocan.
+    for i in range(operaciones):
+        async with SessionLocal() as db:
+            await agregar_item(db, usuario_id, producto_id, "blanco", "L", 1)
+            await fijar_cantidad(db, usuario_id, producto_id, "blanco", "L", i + 1)
+            await db.commit()
+        async with SessionLocal() as db:
+            await eliminar_item(db, usuario_id, producto_id, "blanco", "L")
+            await db.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pestanas", type=int, default=20)
+    parser.add_argument("--operaciones", type=int, default=50, help="Operaciones por pestaña")
+    args = parser.parse_args()
+
+    ids = await crear_datos()
+    _, producto_id, usuario_id = ids
+    fallas = []
+    try:
+        inicio = time.perf_counter()
+        await asyncio.gather(
+            *(pestana(usuario_id, producto_id, n, args.operaciones) for n in range(args.pestanas)),
+            editor(usuario_id, producto_id, args.operaciones),
+        )
+        duracion = time.perf_counter() - inicio
+        total = args.pestanas * args.operaciones * 2 + args.operaciones * 3
+        print(f"{total} statements en {duracion:.2f} s ({total / duracion:.0f}/s)")
+
+        async with SessionLocal() as db:
+            carrito = {(i["color"], i["talla"]): i["cantidad"] for i in await obtener_carrito(db, usuario_id)}
+
+        esperado = args.pestanas * args.operaciones
+        if carrito.get(("negro", "M")) != esperado:
+            fallas.append(f"línea compartida: {carrito.get(('negro', 'M'))} unidades, se esperaban {esperado}")
+        for n in range(args.pestanas):
+            if carrito.get((f"pestana-{n}", "S")) != args.operaciones:
+                fallas.append(f"línea de la pestaña {n}: {carrito.get((f'pestana-{n}', 'S'))} unidades")
+        if ("blanco", "L") in carrito:
+            fallas.append("la línea eliminada sigue en el carrito")
+        if len(carrito) != args.pestanas + 1:
+            fallas.append(f"{len(carrito)} líneas, se esperaban {args.pestanas + 1}")
+    finally:
+        await borrar_datos(ids)
+        await engine.dispose()
+
+    for falla in fallas:
+        print(f"  [FALLA] {falla}")
+    if fallas:
+        sys.exit(1)
+    print("Sin actualizaciones perdidas.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
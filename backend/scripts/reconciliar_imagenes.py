@@ -0,0 +1,76 @@
+"""
+Retira las imágenes de uploads que ninguna fila referencia (ver app.reconciliacion).
+
+Por defecto mueve los huérfanos bajo ORPHAN_QUARANTINE_PREFIX en el mismo
+almacenamiento, conservando su clave, de donde pueden restaurarse moviéndolos de vuelta. Con --modo eliminar los borra.
+Si se interrumpe, la siguiente ejecución continúa desde el checkpoint.
+
+Uso (desde backend/):
+    python -m scripts.reconciliar_imagenes --dry-run
+    python -m scripts.reconciliar_imagenes --arboles productos,tmp --gracia-horas 48
+    python -m scripts.reconciliar_imagenes --modo eliminar --reiniciar
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from app.almacenamiento import almacen
+from app.config import ORPHAN_GRACE_HOURS, ORPHAN_QUARANTINE_PREFIX, ORPHAN_BATCH_SIZE
+from app.database import async_session
+from app.reconciliacion import ARBOLES, leer_checkpoint, reconciliar_arbol, resumen_metricas, verificar_urls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modo", choices=["cuarentena", "eliminar"], default="cuarentena")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informa los huérfanos, sin moverlos")
+    parser.add_argument("--gracia-horas", type=float, default=ORPHAN_GRACE_HOURS)
+    parser.add_argument("--lote", type=int, default=ORPHAN_BATCH_SIZE)
+    parser.add_argument("--arboles", default=",".join(ARBOLES))
+    parser.add_argument("--cuarentena", default=ORPHAN_QUARANTINE_PREFIX)
+    parser.add_argument("--checkpoint", default="reconciliacion.checkpoint.json")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignora el checkpoint y recorre todo de nuevo")
+    args = parser.parse_args()
+
+    arboles = [a.strip() for a in args.arboles.split(",") if a.strip()]
+    desconocidos = [a for a in arboles if a not in ARBOLES]
+    if desconocidos:
+        parser.error(f"Árboles desconocidos: {', '.join(desconocidos)}")
+
+    checkpoint = Path(args.checkpoint)
+    datos = {} if args.reiniciar else leer_checkpoint(checkpoint)
+    if args.reiniciar:
+        checkpoint.unlink(missing_ok=True)
+
+    resultados = {}
+    async with async_session() as db:
+        if "productos" in arboles:
+            problemas = await verificar_urls(db)
+            await db.rollback()
+            if problemas:
+                for problema in problemas:
+                    print(f"Abortado: {problema}", file=sys.stderr)
+                sys.exit(1)
+
+        for arbol in arboles:
+            estado = datos.get(arbol) or {}
+            if estado.get("terminado"):
+                print(f"{arbol}: terminado en una ejecución anterior")
+                resultados[arbol] = estado["metricas"]
+                continue
+            resultados[arbol] = await reconciliar_arbol(
+                db, arbol, modo=args.modo, dry_run=args.dry_run, gracia_horas=args.gracia_horas,
+                lote=args.lote, cuarentena=args.cuarentena.strip("/"), checkpoint=checkpoint, estado=estado
+            )
+    await almacen.cerrar()
+
+    print("\nResumen" + (" (dry-run, sin cambios)" if args.dry_run else f" ({args.modo})"))
+    for arbol, metricas in resultados.items():
+        print("  " + resumen_metricas(arbol, metricas))
+    if not args.dry_run:
+        checkpoint.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,5 @@
 import os
 import asyncio
-import shutil
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -9,6 +8,8 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select 
 
 from app.models.productos import Producto
+from app.almacenamiento import almacen
+from app.imagenes import PRODUCTS_PREFIX
 
 load_dotenv()
 
@@ -19,9 +20,9 @@ if not DATABASE_URL:
 engine = create_async_engine(DATABASE_URL, echo=True)
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Las imágenes sin migrar están sueltas en la carpeta uploads local; se suben al
+# almacenamiento configurado (local o S3) dentro de la carpeta de su producto.
 BASE_UPLOAD_DIR = Path("uploads")
-PRODUCTS_UPLOAD_DIR = BASE_UPLOAD_DIR / "CarpetasDeProductos"
-PRODUCTS_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 def get_folder_name_from_filename(filename: str) -> str:
     """
@@ -37,7 +38,7 @@ def get_folder_name_from_filename(filename: str) -> str:
 async def migrate_product_image(product: Producto, session: AsyncSession):
     """
     Si el campo image_url del producto es un string (es decir, no se migró aún),
-    crea la carpeta correspondiente y mueve el archivo. Finalmente, actualiza el registro
+    mueve el archivo a la carpeta correspondiente del almacenamiento. Finalmente, actualiza el registro
     asignando el nuevo valor de image_url como una lista.
     """
     if not product.image_url:
@@ -48,17 +49,13 @@ async def migrate_product_image(product: Producto, session: AsyncSession):
 
     filename = Path(product.image_url).name  # "vestidoDamazco_20241229234345_5.webp"
     folder_name = get_folder_name_from_filename(filename)  # "vestidoDamazco"
-    product_folder = PRODUCTS_UPLOAD_DIR / folder_name
-    product_folder.mkdir(parents=True, exist_ok=True)
-
     origen = BASE_UPLOAD_DIR / filename
-    destino = product_folder / filename
+    destino = f"{PRODUCTS_PREFIX}{folder_name}/{filename}"
 
     if origen.exists():
         print(f"Moviendo {origen} a {destino}")
-        shutil.move(str(origen), str(destino))
-        new_path = f"/uploads/CarpetasDeProductos/{folder_name}/{filename}"
-        product.image_url = [new_path]
+        await almacen.put_file(destino, origen, mover=True)
+        product.image_url = [almacen.url(destino)]
     else:
         print(f"El archivo {origen} no existe para el producto {product.id}")
 
@@ -72,6 +69,7 @@ async def main():
             await migrate_product_image(product, session)
 
         await session.commit()
+    await almacen.cerrar()
     print("Migración completada.")
 
 if __name__ == "__main__":